@@ -0,0 +1,204 @@
+# run_benchmark.py : time a whole harvest against the mock providers of sushi_mock.py, with the settings given by --set
+### (see Readme.md); --check-derived compares the tsvs of the derived reports with the downloaded ones
+
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from sushi_mock import SushiMock, add_mock_arguments, mock_options, provider_name, REPORT_IDS
+
+SRC_DIR = Path(__file__).resolve().parent.parent / 'src'
+sys.path.insert(0, str(SRC_DIR))
+
+from getcounter import run_harvester  # noqa: E402 (needs SRC_DIR on the path)
+
+DERIVE_SETTINGS = ('derive_master_reports', 'derive_standard_views')
+UNCOMPARED_HEADER = ('Created', 'Created_By')  # the tsv header lines that differ between two harvests of the same data
+PROVIDERS_HEADER = ['Name', 'Base_URL', 'Customer_ID', 'Requestor_ID', 'API_Key', 'Platform', 'Version', 'Delay', 'Retry']
+
+
+def parse_settings(settings):
+    """The --set key=value options as a config dict (true/false become booleans, like current_config.py)."""
+    config = {}
+    for setting in settings:
+        if '=' not in setting:
+            raise SystemExit(f"--set needs key=value, not {setting}")
+        key, value = setting.split('=', 1)
+        value = value.strip()
+        if value.lower() in ('true', 'false'):
+            value = value.lower() == 'true'
+        config[key.strip()] = value
+    return config
+
+
+def write_providers(path, base_urls, delay, retry):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        f.write('\t'.join(PROVIDERS_HEADER) + '\n')
+        for name, base_url in base_urls.items():
+            f.write('\t'.join([name, base_url, f'{name}-customer', '', '', '', '5.1', delay, retry]) + '\n')
+
+
+def count_rows(sqlite_file):
+    """The rows in each table of the harvester's sqlite database."""
+    if not Path(sqlite_file).exists():
+        return {}
+    connection = sqlite3.connect(sqlite_file)
+    try:
+        tables = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+        return {table: connection.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables}
+    finally:
+        connection.close()
+
+
+def run_once(args, work_dir, settings):
+    """
+    One harvest of every mock provider in work_dir, with its own mock server.
+
+    Returns:
+        dict of what was harvested and how long it took
+    """
+    mock = SushiMock(mock_options(args))
+    try:
+        base_urls = {provider_name(number): mock.add_provider(provider_name(number), args.port + number - 1 if args.port else 0)
+                     for number in range(1, args.providers + 1)}
+        providers_file = work_dir / 'providers.tsv'
+        write_providers(providers_file, base_urls, args.delay, args.retry)
+        config = {'sqlite_filename': 'counterdata.db', 'error_log_file': 'infolog.txt', 'json_dir': 'json_folder',
+                  'tsv_dir': 'tsv_folder', 'state_dir': str(work_dir / 'harvester_state'),
+                  'providers_file': str(providers_file), **settings}
+        current_dir = os.getcwd()
+        os.chdir(work_dir)  # the harvester's files and folders are relative to where it runs
+        try:
+            start = time.perf_counter()
+            results = run_harvester(args.begin, args.end, list(base_urls), args.reports.split(','), config,
+                                    progress_callback=(print if args.verbose else lambda message: None),
+                                    is_cancelled_callback=lambda: False)
+            seconds = time.perf_counter() - start
+        finally:
+            os.chdir(current_dir)
+        stats = mock.stats.snapshot()
+    finally:
+        mock.stop()
+    rows = count_rows(work_dir / config['sqlite_filename'])
+    return {'seconds': round(seconds, 3), 'errors': len(results.get('errors', [])), **stats,
+            'reports_per_second': round(stats['reports'] / seconds, 2) if seconds else 0,
+            'mb_per_second': round(stats['bytes_sent'] / (1024 * 1024) / seconds, 3) if seconds else 0,
+            'rows': sum(rows.values()), 'rows_per_second': round(sum(rows.values()) / seconds) if seconds else 0,
+            'network': results.get('network', {})}  # per provider, see telemetry.py
+
+
+def read_tsv(path):
+    """A report tsv as (header lines, column heading line, data lines in sorted order)."""
+    with open(path, 'r', encoding='utf-8-sig') as f:
+        lines = f.read().splitlines()
+    blank = lines.index('') if '' in lines else len(lines)
+    header = [line for line in lines[:blank] if line.split('\t', 1)[0] not in UNCOMPARED_HEADER]
+    body = lines[blank + 1:]
+    return header, body[:1], sorted(body[1:])
+
+
+def compare_tsv_folders(downloaded_dir, derived_dir):
+    """
+    Compare the tsvs of a harvest that downloaded every report with those of one that derived them.
+
+    Returns:
+        (number of tsvs compared, list of messages about the ones that differ)
+    """
+    differences = []
+    downloaded = sorted(path.relative_to(downloaded_dir) for path in Path(downloaded_dir).rglob('*.tsv'))
+    derived = {path.relative_to(derived_dir) for path in Path(derived_dir).rglob('*.tsv')}
+    for name in downloaded:
+        if name not in derived:
+            differences.append(f"{name}: not made by the derived harvest")
+            continue
+        for part, expected, got in zip(('header', 'column headings', 'rows'),
+                                       read_tsv(Path(downloaded_dir) / name), read_tsv(Path(derived_dir) / name)):
+            if expected != got:
+                differing = len(set(expected) ^ set(got))
+                differences.append(f"{name}: the {part} differ ({differing} lines in only one of them)")
+    differences.extend(f"{name}: only made by the derived harvest" for name in sorted(derived - set(downloaded)))
+    return len(downloaded), differences
+
+
+def check_derived(args, settings):
+    """Harvest the same mock data downloading every report and deriving them, and print how the tsvs compare."""
+    tsv_dirs = []
+    work_dirs = []
+    try:
+        for derive in (False, True):
+            work_dir = Path(tempfile.mkdtemp(prefix='harvest_benchmark_'))
+            work_dirs.append(work_dir)
+            result = run_once(args, work_dir, {**settings, **{name: derive for name in DERIVE_SETTINGS}})
+            tsv_dirs.append(work_dir / 'tsv_folder')
+            print(f"{'derived' if derive else 'downloaded'}: {result['seconds']:.2f} s, {result['requests']} requests, "
+                  f"{result['rows']} rows, {result['errors']} errors")
+        compared, differences = compare_tsv_folders(*tsv_dirs)
+    finally:
+        for work_dir in work_dirs:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    for difference in differences:
+        print(difference)
+    print(f"{compared} tsvs compared, {len(differences)} differences")
+    return not differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time run_harvester against mock COUNTER 5.1 providers')
+    parser.add_argument('--providers', type=int, default=5, help='how many mock providers')
+    parser.add_argument('--reports', default=None,
+                        help='comma separated report ids to harvest (default TR,DR,PR,IR, or every report with --check-derived)')
+    parser.add_argument('--begin', default='2025-01', help='first month, YYYY-MM')
+    parser.add_argument('--end', default='2025-12', help='last month, YYYY-MM')
+    parser.add_argument('--port', type=int, default=0,
+                        help='port of the first provider, the others follow it (default: any free ports); '
+                             'give one to replay a cassette recorded with --set cassette_mode=record')
+    parser.add_argument('--delay', default='', help='the Delay column of every mock provider')
+    parser.add_argument('--retry', default='1', help='the Retry column of every mock provider (seconds before asking again for a queued report)')
+    parser.add_argument('--set', dest='settings', action='append', default=[], metavar='KEY=VALUE',
+                        help='a harvester setting for the runs (eg max_workers=4); can be given many times')
+    parser.add_argument('--runs', type=int, default=1, help='how many times to run the harvest')
+    parser.add_argument('--keep', default=None, help='folder to keep the files of the last run in (default: thrown away)')
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    parser.add_argument('--verbose', action='store_true', help='print the harvester progress messages')
+    parser.add_argument('--check-derived', action='store_true',
+                        help='check that the derived masters and standard views are the same as the downloaded ones')
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    settings = parse_settings(args.settings)
+    if args.reports is None:
+        args.reports = ','.join(REPORT_IDS) if args.check_derived else 'TR,DR,PR,IR'
+    if args.check_derived:
+        sys.exit(0 if check_derived(args, settings) else 1)
+
+    results = []
+    for run in range(1, args.runs + 1):
+        work_dir = Path(tempfile.mkdtemp(prefix='harvest_benchmark_'))
+        try:
+            result = run_once(args, work_dir, settings)
+            if args.keep and run == args.runs:
+                shutil.copytree(work_dir, args.keep, dirs_exist_ok=True)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+        results.append(result)
+        if not args.json:
+            print(f"run {run}: {result['seconds']:.2f} s, {result['reports']} reports ({result['reports_per_second']}/s), "
+                  f"{result['requests']} requests {result['status_counts']}, {result['bytes_sent'] / (1024 * 1024):.1f} MB "
+                  f"({result['mb_per_second']} MB/s), {result['rows']} rows, {result['errors']} errors")
+
+    summary = {'providers': args.providers, 'reports': args.reports, 'settings': settings, 'runs': results,
+               'median_seconds': statistics.median(result['seconds'] for result in results)}
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    elif len(results) > 1:
+        print(f"median {summary['median_seconds']:.2f} s, best {min(result['seconds'] for result in results):.2f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,459 @@
+# sushi_mock.py : a COUNTER 5.1 API server on this computer, one mock provider per port of 127.0.0.1, for trying
+### out and timing the harvester offline (see Readme.md); how the providers behave is set with MockOptions
+
+import argparse
+import gzip
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+MASTER_REPORTS = ('TR', 'DR', 'PR', 'IR')
+REPORT_IDS = ('TR', 'DR', 'PR', 'IR', 'TR_J1', 'TR_J2', 'TR_J3', 'TR_J4', 'TR_B1', 'TR_B2', 'TR_B3',
+              'DR_D1', 'DR_D2', 'PR_P1', 'IR_A1', 'IR_M1')
+
+ITEM_METRICS = ['Total_Item_Investigations', 'Total_Item_Requests', 'Unique_Item_Investigations', 'Unique_Item_Requests']
+TITLE_METRICS = ['Unique_Title_Investigations', 'Unique_Title_Requests']
+DENIAL_METRICS = ['Limit_Exceeded', 'No_License']
+SEARCH_METRICS = ['Searches_Automated', 'Searches_Federated', 'Searches_Regular']
+IR_ITEM_DETAILS = ('Authors', 'Publication_Date', 'Article_Version')
+
+# Each standard view: its master report, its name, the filters on its rows, the attributes it shows and its metric types
+STANDARD_VIEWS = {
+    'PR_P1': ('PR', 'Platform Usage', {'Access_Method': ['Regular']}, [],
+              ['Searches_Platform', 'Total_Item_Requests', 'Unique_Item_Requests', 'Unique_Title_Requests']),
+    'DR_D1': ('DR', 'Database Search and Item Usage', {'Access_Method': ['Regular']}, [], SEARCH_METRICS + ITEM_METRICS),
+    'DR_D2': ('DR', 'Database Access Denied', {'Access_Method': ['Regular']}, [], DENIAL_METRICS),
+    'TR_J1': ('TR', 'Journal Requests (Controlled)', {'Data_Type': ['Journal'], 'Access_Type': ['Controlled'], 'Access_Method': ['Regular']},
+              [], ['Total_Item_Requests', 'Unique_Item_Requests']),
+    'TR_J2': ('TR', 'Journal Access Denied', {'Data_Type': ['Journal'], 'Access_Method': ['Regular']}, [], DENIAL_METRICS),
+    'TR_J3': ('TR', 'Journal Usage by Access Type', {'Data_Type': ['Journal'], 'Access_Method': ['Regular']}, ['Access_Type'], ITEM_METRICS),
+    'TR_J4': ('TR', 'Journal Requests by YOP (Controlled)', {'Data_Type': ['Journal'], 'Access_Type': ['Controlled'], 'Access_Method': ['Regular']},
+              ['YOP'], ['Total_Item_Requests', 'Unique_Item_Requests']),
+    'TR_B1': ('TR', 'Book Requests (Controlled)', {'Data_Type': ['Book'], 'Access_Type': ['Controlled'], 'Access_Method': ['Regular']},
+              ['Data_Type', 'YOP'], ['Total_Item_Requests', 'Unique_Title_Requests']),
+    'TR_B2': ('TR', 'Book Access Denied', {'Data_Type': ['Book'], 'Access_Method': ['Regular']}, ['Data_Type', 'YOP'], DENIAL_METRICS),
+    'TR_B3': ('TR', 'Book Usage by Access Type', {'Data_Type': ['Book'], 'Access_Method': ['Regular']},
+              ['Data_Type', 'YOP', 'Access_Type'], ITEM_METRICS + TITLE_METRICS),
+    'IR_A1': ('IR', 'Journal Article Requests', {'Data_Type': ['Article'], 'Access_Method': ['Regular']},
+              ['Access_Type'] + list(IR_ITEM_DETAILS), ['Total_Item_Requests', 'Unique_Item_Requests']),
+    'IR_M1': ('IR', 'Multimedia Item Requests', {'Data_Type': ['Multimedia'], 'Access_Method': ['Regular']},
+              ['Data_Type'], ['Total_Item_Requests', 'Unique_Item_Requests']),
+}
+
+EXCEPTIONS = {
+    202: {'Code': 1011, 'Severity': 'Warning', 'Message': 'Report Queued for Processing'},
+    429: {'Code': 1020, 'Severity': 'Error', 'Message': 'Client has made too many requests'},
+    500: {'Code': 1000, 'Severity': 'Fatal', 'Message': 'Service Not Available'},
+}
+
+
+class MockOptions:
+    """How the mock providers behave; the defaults answer every request at once and without errors."""
+
+    def __init__(self, latency=0.0, jitter=0.0, items=50, bandwidth=0, queued=0, throttle_every=0,
+                 retry_after=1, fail_rate=0.0, fail_providers=(), seed=1, recorded=None):
+        self.latency = latency  # seconds before each answer starts
+        self.jitter = jitter  # up to this many more seconds, at random
+        self.items = items  # titles, databases or articles in each report
+        self.bandwidth = bandwidth  # KB per second the answer is sent at (0 = as fast as possible)
+        self.queued = queued  # HTTP 202 answers to each report url before the report is sent
+        self.throttle_every = throttle_every  # every Nth report request to a provider gets HTTP 429 (0 = never)
+        self.retry_after = retry_after  # seconds in the Retry-After header of a 429
+        self.fail_rate = fail_rate  # share of report requests that get HTTP 500
+        self.fail_providers = set(fail_providers)  # providers that answer every request with HTTP 500
+        self.seed = seed  # the made up usage is the same for the same seed
+        self.recorded = recorded  # folder of saved json reports to send instead of made up ones
+
+
+class MockStats:
+    """What the mock providers have sent, added up over all of them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.reports = 0  # report requests answered with the report itself
+        self.bytes_sent = 0
+        self.status_counts = {}
+
+    def add(self, status, bytes_sent, is_report):
+        with self._lock:
+            self.requests += 1
+            self.bytes_sent += bytes_sent
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            if is_report and status == 200:
+                self.reports += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {'requests': self.requests, 'reports': self.reports, 'bytes_sent': self.bytes_sent,
+                    'status_counts': dict(sorted(self.status_counts.items()))}
+
+
+def load_recorded(folder):
+    """
+    Index the saved json reports in a folder (and its subfolders), eg the harvester's json folder.
+
+    Returns:
+        dict of (Report_ID, True for an _EX) -> the report json as bytes
+    """
+    recorded = {}
+    for path in sorted(Path(folder).rglob('*.json')):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            header = json.loads(data).get('Report_Header', {})
+        except (OSError, ValueError, AttributeError):
+            continue
+        attributes = header.get('Report_Attributes') or {}
+        is_ex = isinstance(attributes, dict) and bool(attributes.get('Attributes_To_Show'))
+        recorded.setdefault((str(header.get('Report_ID', '')).upper(), is_ex), data)
+    return recorded
+
+
+def month_list(begin_date, end_date):
+    """The YYYY-MM months from begin_date to end_date (YYYY-MM-DD or YYYY-MM)."""
+    year, month = int(begin_date[:4]), int(begin_date[5:7])
+    months = []
+    while f"{year:04d}-{month:02d}" <= end_date[:7]:
+        months.append(f"{year:04d}-{month:02d}")
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+    return months
+
+
+def master_facts(report_id, items):
+    """
+    The made up rows of a master report before anything is added up: (item, attributes, metric types).
+    The attributes are every attribute the _EX can show, so any view or attributes_to_show can be made from them.
+    """
+    if report_id == 'TR':
+        for i in range(items):
+            if i % 2 == 0:
+                item = {'Title': f'Journal {i}', 'Item_ID': {'Print_ISSN': f'{1000 + i:04d}-000X', 'Online_ISSN': f'{1000 + i:04d}-0001'},
+                        'Platform': 'Mock', 'Publisher': 'Mock Press'}
+                data_type, metrics = 'Journal', ITEM_METRICS
+            else:
+                item = {'Title': f'Book {i}', 'Item_ID': {'ISBN': f'978-0-00-{i:06d}-0'}, 'Platform': 'Mock', 'Publisher': 'Mock Books'}
+                data_type, metrics = 'Book', ITEM_METRICS + TITLE_METRICS
+            for yop in ('2020', '2024'):
+                for access_type in ('Controlled', 'Open'):
+                    for access_method in ('Regular', 'TDM'):
+                        denied = DENIAL_METRICS if access_type == 'Controlled' else []
+                        yield item, {'Data_Type': data_type, 'YOP': yop, 'Access_Type': access_type, 'Access_Method': access_method}, metrics + denied
+    elif report_id == 'DR':
+        for i in range(items):
+            item = {'Database': f'Database {i}', 'Item_ID': {'Proprietary': f'Mock:db{i}'}, 'Platform': 'Mock', 'Publisher': 'Mock Press'}
+            for access_method in ('Regular', 'TDM'):
+                yield item, {'Data_Type': 'Database_Aggregated', 'Access_Method': access_method}, SEARCH_METRICS + ITEM_METRICS + DENIAL_METRICS
+    elif report_id == 'PR':
+        item = {'Platform': 'Mock'}
+        for data_type in ('Platform', 'Journal', 'Book'):
+            for access_method in ('Regular', 'TDM'):
+                metrics = ['Searches_Platform'] if data_type == 'Platform' else ITEM_METRICS + TITLE_METRICS
+                yield item, {'Data_Type': data_type, 'Access_Method': access_method}, metrics
+    else:
+        for i in range(items):
+            if i % 10 == 9:
+                item = {'Item': f'Video {i}', 'Item_ID': {'Proprietary': f'Mock:v{i}'}, 'Platform': 'Mock', 'Publisher': 'Mock Press',
+                        '_parent': None}
+                data_type = 'Multimedia'
+            else:
+                item = {'Item': f'Article {i}', 'Item_ID': {'DOI': f'10.5555/mock.{i}'}, 'Platform': 'Mock', 'Publisher': 'Mock Press',
+                        'Authors': [{'Name': f'Author {i}'}], 'Publication_Date': '2024-01-15', 'Article_Version': 'VoR',
+                        '_parent': i // 5}
+                data_type = 'Article'
+            for yop in ('2020', '2024'):
+                for access_type in ('Controlled', 'Open'):
+                    for access_method in ('Regular', 'TDM'):
+                        denied = DENIAL_METRICS if access_type == 'Controlled' else []
+                        yield item, {'Data_Type': data_type, 'YOP': yop, 'Access_Type': access_type, 'Access_Method': access_method}, ITEM_METRICS + denied
+
+
+USAGE_COUNTS = (0, 0, 1, 1, 2, 3, 5, 8, 13)
+
+
+def fact_key(seed, report_id, item, attributes):
+    # what a made up count depends on, besides the metric type and the month, so every report, _EX and standard
+    # view is a sum over one set of facts, and a month has the same usage whatever range it is asked in
+    return json.dumps([seed, report_id, item, attributes], sort_keys=True, default=str)
+
+
+def usage_count(key, metric, month):
+    """The made up usage of one fact (see fact_key) for one metric type in one month."""
+    digest = hashlib.blake2b(f"{key}|{metric}|{month}".encode('utf-8'), digest_size=4).digest()
+    return USAGE_COUNTS[digest[0] % len(USAGE_COUNTS)]
+
+
+def build_items(report_id, items, months, shown, filters, metric_types, seed):
+    """
+    Add up the made up rows of the master report_id over the attributes that are not shown.
+
+    Returns:
+        list of (item, Attribute_Performance list) in the order the items were made
+    """
+    built = {}  # id(item) -> (item, attribute values -> (attributes, performance))
+    for item, attributes, metrics in master_facts(report_id, items):
+        if any(attributes.get(name) not in values for name, values in filters.items() if name in attributes):
+            continue
+        key = fact_key(seed, report_id, item, attributes)
+        kept = {name: value for name, value in attributes.items() if name in shown}
+        entries = built.setdefault(id(item), (item, {}))[1]
+        _, performance = entries.setdefault(json.dumps(kept, sort_keys=True), (kept, {}))
+        for metric in metrics:
+            if metric_types and metric not in metric_types:
+                continue
+            for month in months:
+                count = usage_count(key, metric, month)
+                if count:
+                    by_month = performance.setdefault(metric, {})
+                    by_month[month] = by_month.get(month, 0) + count
+    result = []
+    for item, entries in built.values():
+        performance_list = [dict(kept, Performance=performance) for kept, performance in entries.values() if performance]
+        if performance_list:
+            result.append((item, performance_list))
+    return result
+
+
+def make_report(report_id, query, options):
+    """
+    The made up report json for one request.
+
+    Args:
+        report_id: the report id from the url path, eg 'tr' or 'tr_j1'
+        query: the parsed query string of the request
+        options: MockOptions
+
+    Returns:
+        the report as a dict
+    """
+    report_id = report_id.upper()
+    begin_date = query.get('begin_date', ['2025-01-01'])[0]
+    end_date = query.get('end_date', [begin_date])[0]
+    months = month_list(begin_date, end_date)
+    header = {'Report_Name': report_id, 'Report_ID': report_id, 'Release': '5.1', 'Institution_Name': 'Mock Library',
+              'Institution_ID': {'Proprietary': [f"Mock:{query.get('customer_id', [''])[0]}"]},
+              'Created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()), 'Created_By': 'sushi_mock',
+              'Report_Filters': {'Begin_Date': begin_date, 'End_Date': end_date}, 'Report_Attributes': {}}
+    if report_id in STANDARD_VIEWS:
+        master_id, report_name, filters, shown, metric_types = STANDARD_VIEWS[report_id]
+        parents = report_id == 'IR_A1'
+        header['Report_Name'] = report_name
+        header['Report_Filters'] = dict(filters, Metric_Type=metric_types, Begin_Date=begin_date, End_Date=end_date)
+    else:
+        master_id, filters, metric_types = report_id, {}, None
+        shown = [name for name in query.get('attributes_to_show', [''])[0].split('|') if name]
+        parents = query.get('include_parent_details', ['False'])[0].lower() == 'true'
+        if shown:
+            header['Report_Attributes']['Attributes_To_Show'] = shown
+        if parents:
+            header['Report_Attributes']['Include_Parent_Details'] = 'True'
+        shown = shown + ['Data_Type']  # a master report always has Data_Type
+    built = build_items(master_id, options.items, months, set(shown), filters, metric_types, options.seed)
+    hidden = [name for name in IR_ITEM_DETAILS if name not in shown]
+
+    def clean(item):
+        return {name: value for name, value in item.items() if not name.startswith('_') and name not in hidden}
+
+    if master_id != 'IR':
+        report_items = [dict(clean(item), Attribute_Performance=performance) for item, performance in built]
+    elif parents:
+        report_items = []
+        grouped = {}
+        for item, performance in built:
+            grouped.setdefault(item['_parent'], []).append(dict(clean(item), Attribute_Performance=performance))
+        for parent, children in grouped.items():
+            parent_info = {} if parent is None else {'Title': f'Journal {parent}', 'Item_ID': {'Print_ISSN': f'{2000 + parent:04d}-000X'},
+                                                      'Data_Type': 'Journal'}
+            report_items.append(dict(parent_info, Items=children))
+    else:
+        children = [dict(clean(item), Attribute_Performance=performance) for item, performance in built]
+        report_items = [{'Items': children}] if children else []
+    return {'Report_Header': header, 'Report_Items': report_items}
+
+
+def report_list():
+    """The /reports answer: every report, all months available."""
+    return [{'Report_ID': report_id, 'Report_Name': STANDARD_VIEWS.get(report_id, (None, report_id))[1],
+             'Release': '5.1', 'Path': f'/reports/{report_id.lower()}',
+             'First_Month_Available': '2020-01', 'Last_Month_Available': '2099-12'} for report_id in REPORT_IDS]
+
+
+class SushiMock:
+    """
+    A set of mock providers, each on its own port of 127.0.0.1, all behaving as options says.
+    Use add_provider() for each provider, then stop() when done.
+    """
+
+    def __init__(self, options=None):
+        self.options = options or MockOptions()
+        self.stats = MockStats()
+        self.recorded = load_recorded(self.options.recorded) if self.options.recorded else {}
+        self._servers = []
+        self._lock = threading.Lock()
+        self._url_requests = {}  # (provider, url) -> requests for that url, for the 202 answers
+        self._provider_requests = {}  # provider -> report requests, for the 429 answers
+        self._rng = random.Random(self.options.seed)
+        self._cache = {}  # (report id, query) -> encoded report, since every provider gets the same usage
+
+    def add_provider(self, name, port=0):
+        """
+        Start a mock provider on port (0 = any free port).
+
+        Returns:
+            the provider's Base_URL for providers.tsv
+        """
+        mock = self
+
+        class Handler(_MockHandler):
+            provider = name
+            server_mock = mock
+
+        server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, name=f'sushi mock {name}', daemon=True).start()
+        self._servers.append(server)
+        return f"http://127.0.0.1:{server.server_address[1]}/{name}/"
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers = []
+
+    def answer(self, provider, path, query_string):
+        """
+        Decide the answer to one request.
+
+        Returns:
+            (HTTP status, extra headers, body as bytes, True for a report request)
+        """
+        options = self.options
+        query = parse_qs(query_string)
+        report_id = path.rstrip('/').rsplit('/', 1)[-1]
+        if report_id.lower() == 'reports':
+            if provider in options.fail_providers:
+                return 500, {}, json.dumps(EXCEPTIONS[500]).encode(), False
+            return 200, {}, json.dumps(report_list()).encode(), False
+        if report_id.upper() not in REPORT_IDS:
+            return 404, {}, json.dumps({'Code': 3000, 'Severity': 'Error', 'Message': 'Report Not Supported'}).encode(), False
+        with self._lock:
+            url_requests = self._url_requests[(provider, path, query_string)] = self._url_requests.get((provider, path, query_string), 0) + 1
+            provider_requests = self._provider_requests[provider] = self._provider_requests.get(provider, 0) + 1
+            failed = options.fail_rate and self._rng.random() < options.fail_rate
+        if provider in options.fail_providers or failed:
+            return 500, {}, json.dumps(EXCEPTIONS[500]).encode(), True
+        if options.throttle_every and provider_requests % options.throttle_every == 0:
+            return 429, {'Retry-After': str(options.retry_after)}, json.dumps(EXCEPTIONS[429]).encode(), True
+        if url_requests <= options.queued:
+            return 202, {}, json.dumps(EXCEPTIONS[202]).encode(), True
+        is_ex = 'attributes_to_show' in query
+        recorded = self.recorded.get((report_id.upper(), is_ex))
+        if recorded is not None:
+            return 200, {}, recorded, True
+        key = (report_id.lower(), tuple(sorted((name, values[0]) for name, values in query.items())))  # the header names the customer_id
+        with self._lock:
+            body = self._cache.get(key)
+        if body is None:
+            body = json.dumps(make_report(report_id, query, options)).encode()
+            with self._lock:
+                self._cache[key] = body
+        return 200, {}, body, True
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    provider = ''
+    server_mock = None
+
+    def log_message(self, format, *args):
+        pass  # the counts are in MockStats
+
+    def do_GET(self):
+        mock = self.server_mock
+        options = mock.options
+        url = urlsplit(self.path)
+        wait = options.latency + (random.uniform(0, options.jitter) if options.jitter else 0)
+        if wait:
+            time.sleep(wait)
+        status, headers, body, is_report = mock.answer(self.provider, url.path, url.query)
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and len(body) > 1024:
+            body = gzip.compress(body, compresslevel=5)
+            headers['Content-Encoding'] = 'gzip'
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            if options.bandwidth:
+                piece = max(1024, int(options.bandwidth * 1024 / 10))  # ten pieces a second
+                for start in range(0, len(body), piece):
+                    self.wfile.write(body[start:start + piece])
+                    self.wfile.flush()
+                    time.sleep(len(body[start:start + piece]) / (options.bandwidth * 1024))
+            else:
+                self.wfile.write(body)
+        except OSError:
+            pass  # the harvester stopped reading (eg the user clicked Stop)
+        mock.stats.add(status, len(body), is_report)
+
+
+def add_mock_arguments(parser):
+    """The command line options for MockOptions, shared with run_benchmark.py."""
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds before each answer starts')
+    parser.add_argument('--jitter', type=float, default=0.0, help='up to this many more seconds of latency, at random')
+    parser.add_argument('--items', type=int, default=50, help='titles, databases or articles in each report')
+    parser.add_argument('--bandwidth', type=float, default=0, help='KB per second each answer is sent at (0 = no limit)')
+    parser.add_argument('--queued', type=int, default=0, help='HTTP 202 answers to each report url before the report')
+    parser.add_argument('--throttle-every', type=int, default=0, help='every Nth report request to a provider gets HTTP 429')
+    parser.add_argument('--retry-after', type=int, default=1, help='seconds in the Retry-After header of a 429')
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='share of report requests that get HTTP 500 (0 to 1)')
+    parser.add_argument('--fail-providers', default='', help='comma separated providers that always answer HTTP 500')
+    parser.add_argument('--seed', type=int, default=1, help='the made up usage is the same for the same seed')
+    parser.add_argument('--recorded', default=None, help='folder of saved json reports to send instead of made up ones')
+
+
+def mock_options(args):
+    """MockOptions from the parsed add_mock_arguments() options."""
+    return MockOptions(latency=args.latency, jitter=args.jitter, items=args.items, bandwidth=args.bandwidth,
+                       queued=args.queued, throttle_every=args.throttle_every, retry_after=args.retry_after,
+                       fail_rate=args.fail_rate, fail_providers=[name for name in args.fail_providers.split(',') if name],
+                       seed=args.seed, recorded=args.recorded)
+
+
+def provider_name(number):
+    return f"mock{number:02d}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock COUNTER 5.1 API providers on 127.0.0.1')
+    parser.add_argument('--providers', type=int, default=1, help='how many mock providers')
+    parser.add_argument('--port', type=int, default=8800, help='port of the first provider; the others follow it')
+    add_mock_arguments(parser)
+    args = parser.parse_args()
+    mock = SushiMock(mock_options(args))
+    print("Name\tBase_URL\tCustomer_ID\tRequestor_ID\tAPI_Key\tPlatform\tVersion\tDelay\tRetry")
+    for number in range(1, args.providers + 1):
+        base_url = mock.add_provider(provider_name(number), args.port + number - 1)
+        print(f"{provider_name(number)}\t{base_url}\tmock\t\t\t\t5.1\t\t")
+    print("Serving; press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        mock.stop()
+        print(json.dumps(mock.stats.snapshot()))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,34 @@
 #####  COUNTER Registry List
+### Every platform in the registry needs its SUSHI service record, and most also need the record of their usage
+### data host (Atypon, Silverchair, etc.), which many platforms share. These are fetched by WORKERS threads at once
+### on one pooled session, each data host only once per run, and every registry answer is kept in CACHE_FOLDER
+### for CACHE_HOURS, so running it again (eg after fixing a column) does not ask the registry for everything again.
+###
+###     python registry_download.py [--workers 8] [--cache-hours 24] [--no-cache]
 
 import requests
+from requests.adapters import HTTPAdapter
 from pathlib import Path
 import os.path
 import logging
 from datetime import datetime
+import argparse
 import csv
+import hashlib
 import json
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 UA = 'Mozilla/5.0'
 SERVICE1 = 'COP'
 base_URL = 'https://registry.countermetrics.org/api/v1/platform/'
 myheaders = {'User-Agent': UA}
+TIMEOUT = (10, 60)  # seconds to connect, and to wait for the registry to answer
+WORKERS = 8  # platforms fetched at the same time; the registry is one server, so keep this small
+CACHE_FOLDER = 'registry_cache'
+CACHE_HOURS = 24
 
 today = datetime.now()
 today_string = datetime.strftime(today, "%Y-%m-%d")
@@ -41,24 +57,73 @@ HEADER_MAPPING = {
 
 COLUMN_ORDER = ["Name", "Base_URL", "Customer_ID", "Requestor_ID","API_Key","Platform","Version","Delay","Retry","Support_Contact","Credentials_Expire","Customizations", "Host_Types","Website", "Notifications_URL", "Usage_Data_Host","Usage_Data_Host_Contact", "Usage_Data_Host_Website", "Usage_Data_Host_URL"]
 
+# Global variables, set in __main__ from the command line options
+session = None  # one requests.Session for every registry call, keeping its connections alive
+cache_folder = None  # None = no on-disk cache
+cache_seconds = CACHE_HOURS * 3600
+data_hosts = {}  # data host url -> its registry record, fetched once per run
+data_hosts_lock = threading.Lock()
+data_host_locks = {}  # data host url -> Lock, so platforms sharing a data host wait for one fetch of it
+
+
+def make_session(workers):
+    new_session = requests.Session()
+    new_session.headers.update(myheaders)
+    adapter = HTTPAdapter(pool_connections=2, pool_maxsize=workers)
+    new_session.mount('https://', adapter)
+    new_session.mount('http://', adapter)
+    return new_session
+
+
+def cache_path(url):
+    return Path(cache_folder) / (hashlib.sha256(url.encode('utf-8')).hexdigest()[:32] + '.json')
+
+
+def get_json(url):
+    # Get one registry record as json, from the cache if it was fetched less than cache_seconds ago
+    # raises requests.exceptions.RequestException or ValueError if the registry does not answer with json
+    path = cache_path(url) if cache_folder else None
+    if path and path.exists() and time.time() - path.stat().st_mtime < cache_seconds:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            pass  # a broken cache file is fetched again
+    r = (session or requests).get(url, headers=myheaders, timeout=TIMEOUT)
+    r.raise_for_status()
+    data = r.json()
+    if path:
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temporary = path.with_suffix(f'.{threading.get_ident()}.tmp')
+            with open(temporary, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(temporary, path)
+        except OSError as e:
+            logging.error(f"Could not save {url} in the cache {cache_folder}: {e}")
+    return data
+
+
 # PVD expects the dict for a single vendor from the list of vendor dicts
 ## which was the expected response from the main API call to https://registry.countermetrics.org/api/v1/platform/?format=api
-def process_vendor_data(vendor_data, output_file):
+def process_vendor_data(vendor_data):
     # VOV creates a dict for all of the column/values for this vendor for the tsv line
-    v_list_one = vlist_one_vendor(vendor_data)
+    # returns the tsv row for the vendor, or None if it has no 5.1 SUSHI service (or its records could not be fetched)
+    try:
+        v_list_one = vlist_one_vendor(vendor_data)
+    except (requests.exceptions.RequestException, ValueError) as e:
+        print(f'Error: could not get the registry records of {vendor_data.get("name")}: {e}')
+        logging.error(f'Could not get the registry records of {vendor_data.get("name")}: {e}')
+        return None
     if not v_list_one:
-        return
-    with open(output_file, mode='a', newline='') as tsv_file:
-        writer = csv.writer(tsv_file, delimiter='\t')
-        for key, value in v_list_one.items():
-            # Create a row based on the desired column order
-            row = []
-            for col in COLUMN_ORDER:
-                # Get the original key corresponding to this column header
-                original_key = get_original_key_from_label(col, HEADER_MAPPING)
-                row.append(v_list_one.get(original_key, ""))  # Default to "" if key is missing
-            # Write the row for this vendor
-        writer.writerow(row)
+        return None
+    # Create a row based on the desired column order
+    row = []
+    for col in COLUMN_ORDER:
+        # Get the original key corresponding to this column header
+        original_key = get_original_key_from_label(col, HEADER_MAPPING)
+        row.append(v_list_one.get(original_key, ""))  # Default to "" if key is missing
+    return row
 
 def get_original_key_from_label(label, header_mapping):
     for key, mapped_label in header_mapping.items():
@@ -87,10 +152,28 @@ def flatten_dict(contact):
     # Join the key-value pairs with a comma
     return ", ".join(flattened)
 
+def one_line(text):
+    # registry notes are typed with Windows line breaks, which would break the tsv line
+    return str(text).replace("\r\n", " ")
+
+def get_data_host(dh_url):
+    # The registry record of a usage data host, fetched once per run however many platforms use it
+    with data_hosts_lock:
+        if dh_url in data_hosts:
+            return data_hosts[dh_url]
+        lock = data_host_locks.setdefault(dh_url, threading.Lock())
+    with lock:
+        with data_hosts_lock:
+            if dh_url in data_hosts:
+                return data_hosts[dh_url]
+        dh_dict = get_json(dh_url)
+        with data_hosts_lock:
+            data_hosts[dh_url] = dh_dict
+    return dh_dict
+
 def get_usage_data_host_detail(v_list,dh_url):
     v_list["data_host_url"] = dh_url
-    dh = requests.get(dh_url, headers=myheaders) #get the registry record for that usage data host
-    dh_dict=dh.json()
+    dh_dict = get_data_host(dh_url) #get the registry record for that usage data host
     if dh_dict.get("contact"):
         v_list["data_host_contact"] = flatten_dict(dh_dict.get("contact"))
     if dh_dict.get("name"):
@@ -102,43 +185,42 @@ def get_usage_data_host_detail(v_list,dh_url):
     return v_list
 
 def get_sushi_detail(v_list, detail_url):
-    r=requests.get(detail_url, headers=myheaders)
-    get_sushi_dict=r.json()
+    get_sushi_dict = get_json(detail_url)
     for key, value  in get_sushi_dict.items():
         if key == "last_audit" and isinstance(value,dict):
             v_list[key] = flatten_dict(value)
         elif not isinstance(value, bool):
-            v_list[key] = str(value).replace("\r\n", " ")
+            v_list[key] = one_line(value)
         else:
             v_list[key] = value
-        if key == "data_host": # url to registry entry for the usage data host eg atypon, scholarlyiq etc.
+        if key == "data_host" and value: # url to registry entry for the usage data host eg atypon, scholarlyiq etc.
             dh_url = value
             get_usage_data_host_detail(v_list, dh_url)
     if v_list["services_string"] == None:
         v_list["services_string"]="No 5.1 SUSHI services"
         return None
     if v_list.get("requestor_id_required"):
-        v_list["requestor_id_info"] = f'Required: {v_list["requestor_id_info"].replace("\r\n", " ")}'
+        v_list["requestor_id_info"] = f'Required: {one_line(v_list["requestor_id_info"])}'
     else:
         v_list["requestor_id_info"] = "Not required"
     if v_list.get("api_key_required"):
-       v_list["api_key_info"] = f'Required: {v_list["api_key_info"].replace("\r\n", " ")}'
+       v_list["api_key_info"] = f'Required: {one_line(v_list["api_key_info"])}'
     else:
         v_list["api_key_info"] = "Not required"
     if v_list.get("platform_attr_required"):
-        v_list["platform_attr_info"] = f'Required: {v_list["platform_specific_info"].replace("\r\n", " ")}'
+        v_list["platform_attr_info"] = f'Required: {one_line(v_list["platform_specific_info"])}'
     else:
         v_list["platform_attr_info"] = "Not required"
     if v_list.get("credentials_auto_expire"):
-        v_list["credentials_auto_expire_info"] = f'Credentials Auto Expire: {v_list["credentials_auto_expire_info"].replace("\r\n", " ")}'
+        v_list["credentials_auto_expire_info"] = f'Credentials Auto Expire: {one_line(v_list["credentials_auto_expire_info"])}'
     else:
         v_list["credentials_auto_expire_info"] = "Credentials do not auto expire"
     if v_list.get("request_volume_limits_applied"):
-        v_list["request_volume_limits_info"] = f'Volume limits apply: {v_list["request_volume_limits_info"].replace("\r\n", " ")}'
+        v_list["request_volume_limits_info"] = f'Volume limits apply: {one_line(v_list["request_volume_limits_info"])}'
     else:
         v_list["request_volume_limits_info"] = "No volume limits"
     if v_list.get("customizations_in_place"):
-        v_list["customizations_info"] = f'Customizations: {v_list["customizations_info"].replace("\r\n", " ")}'
+        v_list["customizations_info"] = f'Customizations: {one_line(v_list["customizations_info"])}'
     else:
         v_list["customizations_info"] = "No customizations"
     v_list["retry_info"] = "Queuing reports unknown"
@@ -178,6 +260,17 @@ def vlist_one_vendor(vendor_dict):
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Download the COUNTER Registry entries of the 5.1 SUSHI providers into a tsv file')
+    parser.add_argument('--workers', type=int, default=WORKERS, help=f'platforms to fetch at the same time (default {WORKERS})')
+    parser.add_argument('--cache-hours', type=float, default=CACHE_HOURS,
+                        help=f'reuse registry answers saved in {CACHE_FOLDER} less than this many hours ago (default {CACHE_HOURS})')
+    parser.add_argument('--no-cache', action='store_true', help=f'always ask the registry, and save nothing in {CACHE_FOLDER}')
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+    session = make_session(workers)
+    cache_folder = None if args.no_cache else CACHE_FOLDER
+    cache_seconds = args.cache_hours * 3600
+
     try:
         recordsfolder = Path('.')
         os.chdir(recordsfolder)
@@ -193,29 +286,35 @@ if __name__ == "__main__":
     infohandler.setFormatter(infoformatter)  # Pass handler as a parameter, not assign
     infologger.addHandler(infohandler)
 
-    ### write the tsv column header line, hardcoded as COLUMN_ORDER
-    with open(outfile, 'w', encoding='utf-8', errors="ignore") as tsv_file:
-        writer = csv.writer(tsv_file, delimiter='\t')
-        writer.writerow(COLUMN_ORDER)
-
-    print(f'Retrieving all registry data, please wait, this can take a few minutes...')
-    vendor_list=requests.get(base_URL, headers=myheaders)
+    print(f'Retrieving all registry data, please wait...')
+    start = time.perf_counter()
+    # the list of platforms itself is always asked for, so new and removed platforms are never missed
+    vendor_list = session.get(base_URL, timeout=TIMEOUT)
     #Vendor list should be a list of dicts, one dict per platform (usually a company)
     if vendor_list.status_code == 200:
         try:
             vendor_list = vendor_list.json()
-            if isinstance(vendor_list, list) and all(isinstance(item, dict) for item in vendor_list):
-                for vendor_data in vendor_list:
-                    print(f'Processing vendor: {vendor_data.get("name")}\n')
-                    process_vendor_data(vendor_data, outfile)
-            else:
-                print("Error: JSON response is not a list of dictionaries.")
-                sys.exit()
         except ValueError:
             print("Error: Response is not valid JSON.")
             print(vendor_list.content)
+            sys.exit()
+        if not (isinstance(vendor_list, list) and all(isinstance(item, dict) for item in vendor_list)):
+            print("Error: JSON response is not a list of dictionaries.")
+            sys.exit()
     else:
         print(f"HTTP Error: {vendor_list.status_code} - {vendor_list.reason}")
         print(vendor_list.content)  # Debug content in case of failure
         sys.exit()
+
+    # the platforms are fetched in parallel, but written in the registry's order as before
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        rows = list(executor.map(process_vendor_data, vendor_list))
+    ### write the tsv column header line, hardcoded as COLUMN_ORDER, then one line per 5.1 platform
+    with open(outfile, 'w', encoding='utf-8', errors="ignore", newline='') as tsv_file:
+        writer = csv.writer(tsv_file, delimiter='\t')
+        writer.writerow(COLUMN_ORDER)
+        writer.writerows(row for row in rows if row)
+    session.close()
+    print(f"{sum(1 for row in rows if row)} of {len(vendor_list)} platforms have 5.1 SUSHI services, "
+          f"{len(data_hosts)} usage data hosts, {time.perf_counter() - start:.1f} seconds")
     print(f"DONE. COUNTER Registry entries as tab delimited file: {outfile}\n")
@@ -0,0 +1,350 @@
+# async_harvest.py : asyncio harvest engine (harvest_engine = asyncio), one event loop for every provider's requests
+### instead of a thread each; needs the optional aiohttp package, without it getcounter uses the threaded engine
+
+import asyncio
+import time
+import traceback
+from logger import log_error
+from fetch_json import (API_HEADERS, MAX_ATTEMPTS, REPORT_QUEUED, response_action, decode_json, record_health,
+                        make_provider_info, supported_reports_url, add_report_urls, add_member_urls, replay_json_data)
+from circuit_breaker import allow_request, record_failure
+from harvest_history import note_response_bytes, note_archived, record_report, move_response_bytes
+from reports_cache import cached_reports, store_reports
+from month_cache import plan_request, merge_reports
+from report_chunks import chunk_urls, merge_chunks
+from rate_limiter import get_rate_limiter
+from timeouts import request_timeouts, DEFAULT_TIMEOUTS
+from backoff import Backoff, retry_wait, parse_retry_after
+from process_item_details import process_report_data
+from deferred_queue import DeferredQueue
+from stream_json import new_download_file, load_report, WRITE_SIZE
+from compression import body_decoder, record_transfer
+from cancellation import WATCH_INTERVAL
+from consortium import member_label
+from cassette import recording, replaying, record_response
+from telemetry import RequestTimer
+from run_options import provider_options
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+
+def async_engine_available():
+    """True if aiohttp is installed so the asyncio engine can be used."""
+    return aiohttp is not None
+
+
+def write_decoded(f, decoder, chunk, last=False):
+    """Decompress one chunk of a streamed body (and the rest of it, if last) into the download file; returns (bytes written, decode seconds)."""
+    decode_start = time.perf_counter()
+    data = decoder.decompress(chunk) if chunk else b''
+    if last:
+        data += decoder.flush()
+    decode_seconds = time.perf_counter() - decode_start
+    f.write(data)
+    return len(data), decode_seconds
+
+
+# The asyncio twin of fetch_json.get_json_data, same return values:
+# return None means a failure of this one URL
+# return -1 means a failure of the entire provider API - don't bother trying any more URLs with that same base_url
+# return REPORT_QUEUED (only with defer_queued=True) means the provider is still building the report - ask again later
+async def async_get_json_data(session, url, provider_info, defer_queued=False, to_file=False):
+    provider_name = provider_info.get('Name','')
+    limiter = get_rate_limiter(provider_info)
+    options = provider_options(provider_info)
+    stream = to_file and options.stream_downloads  # write a 200 body to disk as it arrives, see stream_json.py
+    if replaying():  # answered from the cassette, see cassette.py
+        return await asyncio.to_thread(replay_json_data, url, provider_info, stream)
+    attempts = 0
+    http_desc = None
+    backoff = None
+    download_path = None
+    try:
+        while attempts < MAX_ATTEMPTS:
+            attempts += 1
+            if not allow_request(provider_info):  # the provider's API is down, see circuit_breaker.py
+                return -1
+            wait = limiter.reserve()
+            if wait:
+                await asyncio.sleep(wait)
+            try:
+                with RequestTimer(provider_info, url, attempts) as timer:  # a failed request is noted as it fails, see telemetry.py
+                    connect_timeout, read_timeout = request_timeouts(provider_info, url)  # see timeouts.py
+                    timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+                    async with session.get(url, timeout=timeout) as response:  #### The actual API call
+                        status_code = response.status
+                        timer.first_byte(status_code)
+                        # the session does not decompress (auto_decompress=False): the body is decoded here once, see compression.py
+                        decoder = body_decoder(response.headers.get('Content-Encoding'))
+                        read_start = time.perf_counter()
+                        if stream and status_code == 200:
+                            # the file is created, written and closed in worker threads, so a slow disk does not hold up the other downloads
+                            download_path = await asyncio.to_thread(new_download_file, options)
+                            download_size = 0
+                            wire_size = 0
+                            decode_seconds = 0.0
+                            f = await asyncio.to_thread(open, download_path, 'wb')
+                            try:
+                                async for chunk in response.content.iter_chunked(WRITE_SIZE):
+                                    wire_size += len(chunk)
+                                    written, seconds = await asyncio.to_thread(write_decoded, f, decoder, chunk)
+                                    download_size += written
+                                    decode_seconds += seconds
+                                written, seconds = await asyncio.to_thread(write_decoded, f, decoder, b'', True)
+                                download_size += written
+                                decode_seconds += seconds
+                            finally:
+                                await asyncio.to_thread(f.close)
+                            timer.transferred(time.perf_counter() - read_start - decode_seconds, wire_size, download_size, decode_seconds)
+                            record_transfer(provider_info, wire_size, download_size)
+                            content = b''
+                        else:
+                            wire_content = await response.read()
+                            read_done = time.perf_counter()
+                            content = decoder.decompress(wire_content) + decoder.flush()
+                            timer.transferred(read_done - read_start, len(wire_content), len(content), time.perf_counter() - read_done)
+                            record_transfer(provider_info, len(wire_content), len(content))
+                        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+                        if recording():
+                            await asyncio.to_thread(record_response, url, status_code, response.headers.get('Retry-After'), content, download_path)
+            except (asyncio.TimeoutError, aiohttp.ClientPayloadError) as e:
+                # a body that broke off part way is asked for again like a timeout (from the start: no Range resume here)
+                if record_failure(provider_info, 'answer broke off' if isinstance(e, aiohttp.ClientPayloadError) else 'request timed out'):
+                    return -1
+                if attempts <= 2:
+                    backoff = backoff or Backoff(5, options)
+                    wait = retry_wait(backoff, provider_name, url)
+                    if wait is None:
+                        return None
+                    await asyncio.sleep(wait)
+                    continue
+                log_error(f"ERROR: trying to get report for {provider_name}: The URL request timed out after multiple tries.\n   {url}\n")
+                return None
+            except aiohttp.TooManyRedirects as e:
+                log_error(f"ERROR: Too many redirects: {e}")
+                return -1
+            except aiohttp.ClientConnectionError as e:
+                log_error(f"ERROR: Network error occurred: {e}")
+                record_failure(provider_info, 'network error')
+                return -1
+            except aiohttp.ClientError as e:
+                log_error(f"ERROR: An error occurred: {e}")
+                return -1
+
+            record_health(provider_info, status_code)
+            action, wait, http_desc = response_action(status_code, attempts, provider_info, url,
+                                                      content.decode('utf-8', errors='replace'))
+            if action == 'ok':
+                parse_start = time.perf_counter()
+                try:
+                    if download_path:
+                        note_response_bytes(url, download_size)
+                        report_json = await asyncio.to_thread(load_report, download_path, True)
+                        if not isinstance(report_json, (dict, list)):
+                            log_error(f"ERROR: Failed to get a valid response after {MAX_ATTEMPTS} attempts, url={url}")
+                            return -1
+                        return report_json
+                    note_response_bytes(url, len(content))
+                    return decode_json(content, url)
+                finally:
+                    timer.parsed(time.perf_counter() - parse_start)
+                    timer.done()
+            timer.done()
+            if action == 'fatal':
+                return -1
+            if action == 'queued' and defer_queued:
+                return REPORT_QUEUED
+            if action == 'throttled':
+                backoff = backoff or Backoff(wait, options)
+                wait = retry_wait(backoff, provider_name, url, retry_after)
+                if wait is None:
+                    return -1
+                limiter.pause(wait)
+                attempts -= 1  # throttled retries are limited by the retry budget instead of MAX_ATTEMPTS
+            else:
+                await asyncio.sleep(wait)
+
+        log_error(f"ERROR: Failed to get a valid response after {MAX_ATTEMPTS} attempts, url={url}\n   {http_desc}")
+        return -1
+    except Exception as e2:
+        log_error(f'ERROR: An error occurred within the main try of async_get_json_data: {e2}\n')
+        return -1
+
+
+async def async_get_chunked_json(session, url, provider_info, report_id, defer_queued=False, report_url=None):
+    # The asyncio twin of report_chunks.get_chunked_json: a large report in date-range chunks, all asked for at once
+    chunks = chunk_urls(provider_info, report_id, url)
+    if not chunks:
+        report_json = await async_get_json_data(session, url, provider_info, defer_queued, to_file=not report_url)
+        report_url = report_url or url
+        move_response_bytes(url, report_url)
+        return report_json
+    report_url = report_url or url
+    log_error(f"INFO: {provider_info.get('Name','')}: {report_id.upper()}: asking for {len(chunks)} date-range chunks")
+    results = await asyncio.gather(*(async_get_json_data(session, chunk_url, provider_info, defer_queued) for chunk_url in chunks))
+    for chunk_url in chunks:
+        move_response_bytes(chunk_url, report_url)
+    return merge_chunks(results, url)
+
+
+async def async_get_report_json(session, url, provider_info, report_id, defer_queued=False):
+    # The asyncio twin of month_cache.get_report_json: the finished months from the json archive, the rest from the provider
+    archived, network_url = plan_request(provider_info, report_id, url)
+    if archived is None:
+        return await async_get_chunked_json(session, url, provider_info, report_id, defer_queued)
+    if not network_url:
+        note_archived(url)
+        return merge_reports(archived, None, url)
+    fresh = await async_get_chunked_json(session, network_url, provider_info, report_id, defer_queued, report_url=url)
+    if fresh is None or isinstance(fresh, int):
+        return fresh  # error codes, and REPORT_QUEUED, go back to the caller unchanged
+    return merge_reports(archived, fresh, url)
+
+
+async def poll_queued_report(session, item, config, is_cancelled, results):
+    """Ask again on the DeferredQueue schedule for a report the provider has queued, until it comes or the deadline passes."""
+    provider_name = member_label(item.provider_info)
+    while True:
+        while item.ready_at > time.monotonic() and not is_cancelled():
+            await asyncio.sleep(min(1.0, item.ready_at - time.monotonic()))
+        if is_cancelled():
+            return
+        log_error(f"INFO: Retrieving queued report: {provider_name}: {item.report_id.upper()}: {item.url}")
+        started = time.monotonic()
+        report_data = await async_get_report_json(session, item.url, item.provider_info, item.report_id, defer_queued=True)
+        if report_data != REPORT_QUEUED:
+            await asyncio.to_thread(process_report_data, item.provider_info, item.report_id, item.url, report_data, config)
+            record_report(item.provider_info['Name'], item.report_id, item.url, time.monotonic() - started)
+            return
+        if not item.reschedule():
+            error_msg = f"{provider_name}: {item.report_id.upper()} was still queued by the provider after {item.minutes_waited():.1f} minutes, try this one again later"
+            log_error(f"ERROR: {error_msg}:\n   {item.url}")
+            results['errors'].append(error_msg)
+            return
+
+
+async def harvest_provider_async(session, provider, begin_date, end_date, report_type_list, config, options, log, is_cancelled, results):
+    """Discover the supported reports for one provider, then download and process each selected report."""
+    if is_cancelled():
+        return
+    provider_info = make_provider_info(provider, end_date, options)
+    if not provider_info:
+        return
+    provider_name = provider_info['Name']
+    try:
+        report_json_url = supported_reports_url(provider_info)
+        log_error(f'INFO: {provider_name}: supported reports API URL={report_json_url}')
+        report_json = cached_reports(provider_info)  # the list from an earlier run, if it is recent enough
+        if report_json is None:
+            report_json = await async_get_json_data(session, report_json_url.replace('|', '%7C'), provider_info)
+            store_reports(provider_info, report_json)
+        else:
+            log_error(f'INFO: {provider_name}: using the saved list of supported reports')
+        if provider_info['Members']:
+            # a consortium: each member's reports, all at once (the session keeps to max_requests_per_host), see consortium.py
+            if add_member_urls(provider_info, report_json, begin_date, end_date, report_type_list):
+                await asyncio.gather(*(harvest_reports_async(session, member_info, config, log, is_cancelled, results)
+                                       for member_info in provider_info['Member_Infos']))
+            return
+        if not add_report_urls(provider_info, report_json, begin_date, end_date, report_type_list):
+            return
+        await harvest_reports_async(session, provider_info, config, log, is_cancelled, results)
+    except Exception as e:
+        # one provider failing must not stop the others
+        error_msg = f"Error processing {provider_name}: {str(e)}"
+        log_error(f"ERROR: {error_msg}\n{traceback.format_exc()}")
+        results['errors'].append(error_msg)
+
+
+async def harvest_reports_async(session, provider_info, config, log, is_cancelled, results):
+    """Download and process every report URL in one provider_info."""
+    provider_name = member_label(provider_info)
+    try:
+        report_urls = provider_info.get('Report_URLS', {})
+        if not report_urls:
+            log_error(f'WARNING: no reports for provider: {provider_name} met your criteria for retrieval\n')
+            return
+        log(f"Retrieving reports: {provider_name}")
+
+        # reports the provider queues (202) are polled in their own tasks while the other reports carry on
+        deferred = DeferredQueue(provider_options(provider_info))
+        queued_tasks = []
+        for report_id, report_url in report_urls.items():
+            if is_cancelled() or not allow_request(provider_info):
+                break
+            log_error(f"INFO: Retrieving : {provider_name}: {report_id.upper()}: {report_url}")
+            try:
+                started = time.monotonic()
+                report_data = await async_get_report_json(session, report_url, provider_info, report_id, defer_queued=True)
+                if report_data == REPORT_QUEUED:
+                    item = deferred.schedule(provider_info, report_id, report_url)
+                    log_error(f"INFO: {provider_name}: {report_id.upper()} is queued by the provider, asking again in {item.wait:.0f} seconds")
+                    queued_tasks.append(asyncio.create_task(poll_queued_report(session, item, config, is_cancelled, results)))
+                    continue
+                # saving, tsv conversion and the sqlite inserts are blocking work, keep them off the event loop
+                await asyncio.to_thread(process_report_data, provider_info, report_id, report_url, report_data, config)
+                record_report(provider_info['Name'], report_id, report_url, time.monotonic() - started)
+            except Exception as e:
+                error_msg = f"Error processing {provider_name}:{report_id}: {str(e)}"
+                log_error(f"ERROR: {error_msg}\n{traceback.format_exc()}")
+                results['errors'].append(error_msg)
+        if queued_tasks:
+            await asyncio.gather(*queued_tasks)
+    except Exception as e:
+        # one provider failing must not stop the others
+        error_msg = f"Error processing {provider_name}: {str(e)}"
+        log_error(f"ERROR: {error_msg}\n{traceback.format_exc()}")
+        results['errors'].append(error_msg)
+
+
+async def _harvest_all(providers, begin_date, end_date, report_type_list, config, options, log, is_cancelled, results):
+    timeout = aiohttp.ClientTimeout(sock_connect=DEFAULT_TIMEOUTS[0], sock_read=DEFAULT_TIMEOUTS[1])  # each request sets its own, see timeouts.py
+    connector = aiohttp.TCPConnector(limit_per_host=options.max_requests_per_host)
+    async with aiohttp.ClientSession(headers=API_HEADERS, timeout=timeout, connector=connector, auto_decompress=False) as session:
+        harvest = asyncio.gather(*(
+            harvest_provider_async(session, provider, begin_date, end_date, report_type_list, config, options, log, is_cancelled, results)
+            for provider in providers
+        ))
+        watcher = asyncio.create_task(_stop_on_cancel(harvest, is_cancelled))
+        try:
+            await harvest
+        except asyncio.CancelledError:
+            if not is_cancelled():
+                raise
+            log_error("INFO: the harvest was stopped, the requests in progress were cancelled")
+        finally:
+            watcher.cancel()
+
+
+async def _stop_on_cancel(harvest, is_cancelled):
+    # Stop cancels every request and wait in progress at once (see cancellation.py); the report steps
+    # already running in a thread stop at their next checkpoint
+    while not harvest.done():
+        if is_cancelled():
+            harvest.cancel()
+            return
+        await asyncio.sleep(WATCH_INTERVAL)
+
+
+def run_async_harvest(providers, begin_date, end_date, report_type_list, config, options, log, is_cancelled, results):
+    """
+    Harvest all providers from one asyncio event loop.
+
+    Args:
+        providers: List of provider dictionaries from load_providers
+        begin_date: Start date in YYYY-MM format
+        end_date: End date in YYYY-MM format
+        report_type_list: List of report types selected by the user in the GUI
+        config: config dict passed on to process_report_data
+        options: the RunOptions of the run; max_requests_per_host requests can be in flight at once to the same host
+        log: function that sends a progress message to the user
+        is_cancelled: function that returns True if the user cancelled
+        results: the run_harvester results dict, errors are appended to results['errors']
+    """
+    if not report_type_list:
+        print("You did not select any report types.\n")
+        return
+    asyncio.run(_harvest_all(providers, begin_date, end_date, report_type_list, config, options, log, is_cancelled, results))
@@ -0,0 +1,114 @@
+# backoff.py : how long to wait before retrying a throttled (429/503) or timed-out API request,
+### and how many retries each provider and the whole run may use
+
+import random
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from logger import log_error
+from run_options import DEFAULT_OPTIONS
+
+# Global variables
+_budget = None  # RetryBudget for the run
+_budget_lock = threading.Lock()
+
+
+def parse_retry_after(value):
+    """
+    Read a Retry-After header, which is either a number of seconds or an HTTP date.
+
+    Returns:
+        seconds to wait as a float, or None if there is no usable header
+    """
+    if not value:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+class Backoff:
+    """
+    The waits for the retries of one url: the provider's Retry-After when it sends one, otherwise "decorrelated
+    jitter", a random wait between the base and three times the last one, so threads do not all come back at once.
+    """
+
+    def __init__(self, base, options):
+        self.base = max(0.5, float(base))
+        self.previous = self.base
+        self.retries = 0
+        self.max_retries = options.max_retries
+        self.max_wait = options.max_retry_wait  # a Retry-After longer than this means give up on the url
+
+    def next_wait(self, retry_after=None):
+        """Return the wait before the next retry, honouring the server's Retry-After if given."""
+        self.retries += 1
+        if retry_after is not None:
+            self.previous = max(self.base, retry_after)
+            return retry_after
+        self.previous = min(self.max_wait, random.uniform(self.base, self.previous * 3))
+        return self.previous
+
+
+class RetryBudget:
+    """Counts the retries spent by each provider and by the whole run."""
+
+    def __init__(self, per_provider, per_run):
+        self.per_provider = per_provider
+        self.per_run = per_run
+        self.spent_by_provider = {}
+        self.spent = 0
+        self.lock = threading.Lock()
+
+    def spend(self, provider_name):
+        """Use one retry; returns False if the provider or the run has none left."""
+        with self.lock:
+            provider_spent = self.spent_by_provider.get(provider_name, 0)
+            if provider_spent >= self.per_provider or self.spent >= self.per_run:
+                return False
+            self.spent_by_provider[provider_name] = provider_spent + 1
+            self.spent += 1
+            return True
+
+
+def reset_retry_budget(options):
+    """Start the run's retry budget (called by run_harvester)."""
+    global _budget
+    with _budget_lock:
+        _budget = RetryBudget(options.retry_budget_per_provider, options.retry_budget_per_run)
+
+
+def retry_budget():
+    global _budget
+    with _budget_lock:
+        if _budget is None:
+            _budget = RetryBudget(DEFAULT_OPTIONS.retry_budget_per_provider, DEFAULT_OPTIONS.retry_budget_per_run)
+        return _budget
+
+
+def retry_wait(backoff, provider_name, url, retry_after=None):
+    """
+    Decide whether a url may be retried and how long to wait first.
+
+    Returns:
+        seconds to wait, or None if the url should not be retried
+    """
+    if backoff.retries >= backoff.max_retries:
+        log_error(f"ERROR: {provider_name}: gave up after {backoff.retries} retries of {url}")
+        return None
+    if retry_after is not None and retry_after > backoff.max_wait:
+        log_error(f"ERROR: {provider_name} asked us to wait {retry_after:.0f} seconds before retrying, try this one again later:\n   {url}")
+        return None
+    if not retry_budget().spend(provider_name):
+        log_error(f"ERROR: {provider_name}: the retry budget for this provider or this run is used up, not retrying {url}")
+        return None
+    return backoff.next_wait(retry_after)
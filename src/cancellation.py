@@ -0,0 +1,132 @@
+# cancellation.py : stop a harvester run within seconds of the user clicking Stop: every wait is a wait on
+### the run's CancelToken, and a response being read is shut down
+
+import threading
+from contextlib import contextmanager
+
+WATCH_INTERVAL = 0.2  # seconds between looks at an is_cancelled_callback that has no token behind it
+
+
+class HarvestCancelled(Exception):
+    """Raised at a checkpoint when the user has stopped the run."""
+
+
+class CancelToken:
+    """Cancellation for one harvester run, shared by every thread of the run."""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._aborts = {}  # id -> function to call on cancel (eg shut down a response being read)
+        self._next_id = 0
+
+    def cancel(self):
+        """Stop the run: wake every wait and abort the reads in progress."""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            aborts = list(self._aborts.values())
+        for abort in aborts:
+            try:
+                abort()
+            except Exception:
+                pass  # the read ends one way or another; nothing to report to the user here
+
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def wait(self, seconds):
+        """Wait up to seconds; returns True at once if the run is (or gets) cancelled."""
+        if seconds is None or seconds <= 0:
+            return self._event.is_set()
+        return self._event.wait(seconds)
+
+    def check(self):
+        """Raise HarvestCancelled if the run is cancelled."""
+        if self._event.is_set():
+            raise HarvestCancelled()
+
+    def add_abort(self, abort):
+        with self._lock:
+            if self._event.is_set():
+                abort_now = True
+            else:
+                abort_now = False
+                self._next_id += 1
+                abort_id = self._next_id
+                self._aborts[abort_id] = abort
+        if abort_now:
+            abort()
+            return None
+        return abort_id
+
+    def remove_abort(self, abort_id):
+        with self._lock:
+            self._aborts.pop(abort_id, None)
+
+
+# Global variables
+_token = CancelToken()
+_watcher_stop = None
+
+
+def begin_cancellation(cancel_token=None, is_cancelled_callback=None):
+    """
+    Set the token for this run (called by run_harvester).
+    A caller that only has an is_cancelled_callback gets a token that follows it, looked at every WATCH_INTERVAL seconds.
+
+    Returns:
+        the CancelToken of the run
+    """
+    global _token, _watcher_stop
+    _token = cancel_token or CancelToken()
+    if cancel_token is None and is_cancelled_callback is not None:
+        _watcher_stop = threading.Event()
+        threading.Thread(target=_watch, args=(_token, is_cancelled_callback, _watcher_stop),
+                         name='cancel watcher', daemon=True).start()
+    return _token
+
+
+def _watch(token, is_cancelled_callback, stop):
+    while not stop.wait(WATCH_INTERVAL):
+        try:
+            if is_cancelled_callback():
+                token.cancel()
+                return
+        except Exception:
+            return
+
+
+def end_cancellation():
+    """Stop following the is_cancelled_callback (called by run_harvester at the end of the run)."""
+    global _watcher_stop
+    if _watcher_stop is not None:
+        _watcher_stop.set()
+        _watcher_stop = None
+
+
+def cancelled():
+    """True if the user has stopped the run."""
+    return _token.is_cancelled()
+
+
+def check_cancelled():
+    """Raise HarvestCancelled if the user has stopped the run."""
+    _token.check()
+
+
+def cancellable_sleep(seconds):
+    """time.sleep that ends as soon as the run is cancelled; returns True if it was."""
+    return _token.wait(seconds)
+
+
+@contextmanager
+def abort_on_cancel(abort):
+    """Call abort() if the run is cancelled while the with block runs (at once if it already is)."""
+    abort_id = _token.add_abort(abort)
+    try:
+        yield
+    finally:
+        if abort_id is not None:
+            _token.remove_abort(abort_id)
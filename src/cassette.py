@@ -0,0 +1,142 @@
+# cassette.py : record the COUNTER API responses of a harvest in cassette_file (a zip, with the credentials in
+### the urls hashed), and run the harvest again from the recording with no network and no waits
+
+import hashlib
+import hmac
+import json
+import secrets
+import shutil
+import threading
+import zipfile
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from logger import log_error
+
+MODES = ('off', 'record', 'replay')
+INDEX_NAME = 'cassette.json'
+CREDENTIAL_PARAMETERS = {'customer_id', 'requestor_id', 'api_key'}
+
+# Global variables: the cassette open in this run
+_mode = 'off'
+_file = None
+_zip = None
+_key = b''  # the key of the credential hashes, saved in the index so a replay makes the same hashes
+_entries = []  # record: the index, in the order the responses came in
+_replay = {}  # replay: redacted url -> the index entries for it
+_lock = threading.Lock()
+
+
+def cassette_mode(config):
+    """The cassette_mode option: 'off', 'record' or 'replay'."""
+    mode = str(config.get('cassette_mode', 'off') or 'off').strip().lower()
+    if mode not in MODES:
+        log_error(f"WARNING: config option cassette_mode should be one of {', '.join(MODES)} but is '{mode}', using off")
+        return 'off'
+    return mode
+
+
+def start_cassette(options):
+    """Start recording to, or replaying from, cassette_file for this run (called by run_harvester)."""
+    global _mode, _file, _zip, _key, _entries, _replay
+    close_cassette()
+    _mode = options.cassette_mode
+    _file = options.cassette_file
+    _entries = []
+    _replay = {}
+    if _mode == 'record':
+        _key = secrets.token_bytes(16)
+        _zip = zipfile.ZipFile(_file, 'w', compression=zipfile.ZIP_DEFLATED)
+        log_error(f"INFO: recording every API response in the cassette {_file}")
+    elif _mode == 'replay':
+        try:
+            _zip = zipfile.ZipFile(_file, 'r')
+            index = json.loads(_zip.read(INDEX_NAME))
+        except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+            log_error(f"ERROR: cannot replay the cassette {_file}: {e}; the providers will be asked instead")
+            close_cassette()
+            _mode = 'off'
+            return
+        _key = bytes.fromhex(index.get('key', ''))
+        for entry in index.get('responses', []):
+            _replay.setdefault(entry['url'], []).append(entry)
+        log_error(f"INFO: replaying {len(index.get('responses', []))} API responses from the cassette {_file}, no requests are sent")
+
+
+def recording():
+    return _mode == 'record'
+
+
+def replaying():
+    return _mode == 'replay'
+
+
+def redact_url(url):
+    """The url with the values of its credentials replaced by a keyed hash, which is how the cassette knows it."""
+    parts = urlsplit(url)
+    query = []
+    for name, value in parse_qsl(parts.query, keep_blank_values=True):
+        if name.lower() in CREDENTIAL_PARAMETERS and value:
+            value = 'redacted-' + hmac.new(_key, value.encode('utf-8'), hashlib.sha256).hexdigest()[:16]
+        query.append((name, value))
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, urlencode(query, safe='|'), ''))
+
+
+def record_response(url, status_code, retry_after, content=None, path=None):
+    """
+    Add one response to the cassette: its body is content (the decoded bytes) or the file at path (a streamed download).
+    """
+    with _lock:
+        if _zip is None or _mode != 'record':
+            return
+        name = f"responses/{len(_entries):06d}.json"
+        try:
+            if path is not None:
+                _zip.write(path, name)
+            else:
+                _zip.writestr(name, content or b'')
+        except (OSError, ValueError) as e:
+            log_error(f"WARNING: could not add a response to the cassette {_file}: {e}")
+            return
+        _entries.append({'url': redact_url(url), 'status': status_code, 'retry_after': retry_after, 'body': name})
+
+
+def replay_response(url):
+    """
+    The recorded answer to url: the first 200 recorded for it, or else the last thing the provider answered.
+
+    Returns:
+        (status code, body entry name) or None if the url is not in the cassette
+    """
+    entries = _replay.get(redact_url(url))
+    if not entries:
+        return None
+    entry = next((entry for entry in entries if entry['status'] == 200), entries[-1])
+    return entry['status'], entry['body']
+
+
+def read_body(name):
+    """The decoded bytes of one recorded response body."""
+    with _lock:
+        return _zip.read(name)
+
+
+def copy_body(name, path):
+    """Write one recorded response body to the file at path (for stream_downloads)."""
+    with _lock:
+        with _zip.open(name) as source, open(path, 'wb') as target:
+            shutil.copyfileobj(source, target)
+
+
+def close_cassette():
+    """Finish the cassette: write the index of a recording and close the file (called by run_harvester at the end)."""
+    global _zip
+    with _lock:
+        if _zip is None:
+            return
+        try:
+            if _mode == 'record':
+                _zip.writestr(INDEX_NAME, json.dumps({'key': _key.hex(), 'responses': _entries}, indent=1))
+                log_error(f"INFO: {len(_entries)} API responses recorded in the cassette {_file}")
+            _zip.close()
+        except (OSError, ValueError) as e:
+            log_error(f"ERROR: could not finish the cassette {_file}: {e}")
+        _zip = None
@@ -0,0 +1,144 @@
+# circuit_breaker.py : stop calling a provider (Base_URL) whose API is down, for the rest of this run
+### and for circuit_breaker_cooldown minutes of the next ones (see provider_health_file)
+
+import json
+import threading
+from datetime import datetime
+from logger import log_error
+from run_options import provider_options
+
+# Global variables
+_breakers = {}  # Base_URL -> ProviderHealth
+_breakers_lock = threading.Lock()
+
+CLOSED = 'closed'  # requests go through
+OPEN = 'open'  # requests are skipped
+HALF_OPEN = 'half_open'  # tripped in an earlier run, the next request is a probe
+
+
+class ProviderHealth:
+    """The breaker for one provider Base_URL."""
+
+    def __init__(self, state=CLOSED, failures=0, tripped_at=None, last_error=''):
+        self.state = state
+        self.failures = failures
+        self.tripped_at = tripped_at  # datetime the breaker last tripped
+        self.last_error = last_error
+        self.skip_logged = False
+
+
+def breaker_key(provider_info):
+    # Base_URL identifies the provider API, several providers.tsv rows can share one
+    base_url = provider_info.get('Base_URL', '') or provider_info.get('Name', '')
+    return str(base_url).strip().rstrip('/').lower()
+
+
+def _get_breaker(provider_info):
+    key = breaker_key(provider_info)
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = ProviderHealth()
+            _breakers[key] = breaker
+    return breaker
+
+
+def load_provider_health(options):
+    """Start the run's breakers from the health saved by earlier runs (called by run_harvester)."""
+    with _breakers_lock:
+        _breakers.clear()
+    if not options.provider_health_file:
+        return
+    try:
+        with open(options.provider_health_file, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        log_error(f"WARNING: could not read {options.provider_health_file}, starting with no provider health history: {e}")
+        return
+    now = datetime.now()
+    for key, entry in saved.items():
+        try:
+            tripped_at = datetime.fromisoformat(entry['tripped_at']) if entry.get('tripped_at') else None
+        except (TypeError, ValueError):
+            tripped_at = None
+        if tripped_at is None:
+            continue  # healthy last time, nothing to remember
+        # still cooling down it is skipped straight away; after that its first request is a probe
+        if (now - tripped_at).total_seconds() < options.circuit_breaker_cooldown:
+            state = OPEN
+        else:
+            state = HALF_OPEN
+        with _breakers_lock:
+            _breakers[key] = ProviderHealth(state, entry.get('failures', 0), tripped_at, entry.get('last_error', ''))
+
+
+def allow_request(provider_info):
+    """
+    Check the breaker before an API call.
+
+    Returns:
+        False if the provider's breaker is open and the call should not be made
+    """
+    breaker = _get_breaker(provider_info)
+    if breaker.state != OPEN:
+        return True
+    if not breaker.skip_logged:
+        breaker.skip_logged = True
+        when = breaker.tripped_at.strftime('%Y-%m-%d %H:%M') if breaker.tripped_at else ''
+        log_error(f"ERROR: {provider_info.get('Name','')}: skipping the rest of this provider, its API stopped answering ({when}: {breaker.last_error})")
+    return False
+
+
+def record_success(provider_info):
+    """The provider answered; close its breaker."""
+    breaker = _get_breaker(provider_info)
+    with _breakers_lock:
+        breaker.state = CLOSED
+        breaker.failures = 0
+        breaker.tripped_at = None
+        breaker.skip_logged = False
+
+
+def record_failure(provider_info, reason):
+    """
+    Count a server error, timeout or connection failure; circuit_breaker_threshold of them in a row
+    (or one on a probe) trip the breaker.
+
+    Returns:
+        True if the breaker is now open
+    """
+    threshold = provider_options(provider_info).circuit_breaker_threshold
+    breaker = _get_breaker(provider_info)
+    with _breakers_lock:
+        breaker.failures += 1
+        breaker.last_error = reason
+        if breaker.state == OPEN:
+            return True
+        if breaker.state == HALF_OPEN or breaker.failures >= threshold:
+            breaker.state = OPEN
+            breaker.tripped_at = datetime.now()
+            tripped = True
+        else:
+            tripped = False
+    if tripped:
+        log_error(f"ERROR: {provider_info.get('Name','')}: {breaker.failures} failure(s) in a row ({reason}), skipping the rest of this provider's reports for this run")
+    return tripped
+
+
+def save_provider_health(options):
+    """Write the breakers to provider_health_file so the next run knows which providers were down."""
+    if not options.provider_health_file:
+        return
+    with _breakers_lock:
+        saved = {key: {'state': breaker.state,
+                       'failures': breaker.failures,
+                       'tripped_at': breaker.tripped_at.isoformat(timespec='seconds') if breaker.tripped_at else None,
+                       'last_error': breaker.last_error}
+                 for key, breaker in _breakers.items()}
+    try:
+        with open(options.provider_health_file, 'w', encoding='utf-8') as f:
+            json.dump(saved, f, indent=2)
+    except OSError as e:
+        log_error(f"WARNING: could not save provider health to {options.provider_health_file}: {e}")
@@ -0,0 +1,176 @@
+# compression.py : ask for compressed API responses (every codec that can be decoded here) and decode each one
+### exactly once; the bytes on the wire and decoded are added up per provider for the info log
+
+import threading
+import zlib
+from logger import log_error
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Global variables
+_transfer = {}  # provider name -> [bytes on the wire, bytes after decoding, responses]
+_transfer_lock = threading.Lock()
+
+
+def accept_encoding():
+    """The Accept-Encoding header value: every codec that can be decoded here, best compression first."""
+    codecs = []
+    if brotli is not None:
+        codecs.append('br')
+    if zstandard is not None:
+        codecs.append('zstd')
+    codecs.extend(['gzip', 'deflate'])
+    return ', '.join(codecs)
+
+
+class _Deflate:
+    # 'deflate' is meant to be zlib-wrapped, but some servers send raw deflate; try the first, fall back to the second
+    def __init__(self):
+        self._decoder = zlib.decompressobj()
+        self._first = True
+        self._data = b''
+
+    def decompress(self, chunk):
+        if not self._first:
+            return self._decoder.decompress(chunk)
+        # until the first bytes come out, every try starts a new decoder on all the bytes so far,
+        # as the last one has already taken in the earlier chunks
+        self._data += chunk
+        self._decoder = zlib.decompressobj()
+        try:
+            decoded = self._decoder.decompress(self._data)
+        except zlib.error:
+            self._decoder = zlib.decompressobj(-zlib.MAX_WBITS)
+            decoded = self._decoder.decompress(self._data)
+            self._first = False
+        if decoded:
+            self._first = False
+        if not self._first:
+            self._data = b''
+        return decoded
+
+    def flush(self):
+        return self._decoder.flush()
+
+
+class _Brotli:
+    def __init__(self):
+        self._decoder = brotli.Decompressor()
+
+    def decompress(self, chunk):
+        return self._decoder.process(chunk)
+
+    def flush(self):
+        return b''
+
+
+class _Zstd:
+    def __init__(self):
+        self._decoder = zstandard.ZstdDecompressor().decompressobj()
+
+    def decompress(self, chunk):
+        return self._decoder.decompress(chunk)
+
+    def flush(self):
+        return b''
+
+
+class _Identity:
+    def decompress(self, chunk):
+        return chunk
+
+    def flush(self):
+        return b''
+
+
+def body_decoder(content_encoding):
+    """
+    Get a decoder for a response body sent with this Content-Encoding, to feed the body through in chunks.
+
+    Returns:
+        object with decompress(chunk) -> bytes and flush() -> bytes
+    """
+    # a body encoded more than once (eg "gzip, br") is decoded in the reverse order
+    codings = [coding.strip().lower() for coding in (content_encoding or '').split(',') if coding.strip()]
+    decoders = [_decoder_for(coding) for coding in reversed(codings)]
+    decoders = [decoder for decoder in decoders if decoder is not None]
+    if not decoders:
+        return _Identity()
+    if len(decoders) == 1:
+        return decoders[0]
+    return _Chain(decoders)
+
+
+def _decoder_for(coding):
+    if coding in ('gzip', 'x-gzip'):
+        return zlib.decompressobj(16 + zlib.MAX_WBITS)
+    if coding == 'deflate':
+        return _Deflate()
+    if coding == 'br' and brotli is not None:
+        return _Brotli()
+    if coding == 'zstd' and zstandard is not None:
+        return _Zstd()
+    if coding == 'identity':
+        return None
+    raise ValueError(f"the response uses Content-Encoding '{coding}', which cannot be decoded here")
+
+
+class _Chain:
+    def __init__(self, decoders):
+        self._decoders = decoders
+
+    def decompress(self, chunk):
+        for decoder in self._decoders:
+            chunk = decoder.decompress(chunk)
+        return chunk
+
+    def flush(self):
+        data = b''
+        for decoder in self._decoders:
+            data = decoder.decompress(data) + decoder.flush()
+        return data
+
+
+def decode_body(content, content_encoding):
+    """Decode a whole response body as it came over the wire."""
+    decoder = body_decoder(content_encoding)
+    return decoder.decompress(content) + decoder.flush()
+
+
+def record_transfer(provider_info, wire_bytes, decoded_bytes):
+    """Add one response to the provider's totals of bytes on the wire and bytes after decoding."""
+    provider_name = provider_info.get('Name', '')
+    with _transfer_lock:
+        totals = _transfer.setdefault(provider_name, [0, 0, 0])
+        totals[0] += wire_bytes
+        totals[1] += decoded_bytes
+        totals[2] += 1
+
+
+def reset_transfer_stats():
+    """Start a new run with no transfer totals (called by run_harvester)."""
+    with _transfer_lock:
+        _transfer.clear()
+
+
+def log_transfer_stats():
+    """Write each provider's bytes on the wire and after decoding to the info log."""
+    with _transfer_lock:
+        totals = sorted(_transfer.items())
+    for provider_name, (wire_bytes, decoded_bytes, responses) in totals:
+        ratio = f", {decoded_bytes / wire_bytes:.1f}x" if wire_bytes else ''
+        log_error(f"INFO: {provider_name}: {responses} responses, {_size(wire_bytes)} transferred, {_size(decoded_bytes)} decoded{ratio}")
+
+
+def _size(size):
+    if size >= 1024 * 1024:
+        return f"{size / (1024 * 1024):.1f} MB"
+    return f"{size / 1024:.1f} KB"
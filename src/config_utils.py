@@ -0,0 +1,57 @@
+# config_utils.py : typed access to the values in the config dict, which mostly arrive as strings
+### from current_config.py; an option left out or unusable falls back to its default
+
+import os
+from logger import log_error
+
+
+def config_int(config, key, default):
+    """Return config[key] as an int, or default if missing or not a number."""
+    value = config.get(key, default)
+    if value in (None, ''):
+        return default
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        log_error(f"WARNING: config option {key} should be a whole number but is '{value}', using {default}")
+        return default
+
+
+def config_float(config, key, default):
+    """Return config[key] as a float, or default if missing or not a number."""
+    value = config.get(key, default)
+    if value in (None, ''):
+        return default
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        log_error(f"WARNING: config option {key} should be a number but is '{value}', using {default}")
+        return default
+
+
+def config_bool(config, key, default=False):
+    """Return config[key] as a bool; accepts True/False as well as the strings true/false/yes/no/1/0."""
+    value = config.get(key, default)
+    if isinstance(value, bool):
+        return value
+    if value in (None, ''):
+        return default
+    return str(value).strip().lower() in ('true', 'yes', 'y', '1')
+
+
+def state_path(config, key):
+    """
+    Where the file named by config[key] (eg harvest_history_file) is kept between runs: in state_dir, unless it is
+    an absolute path. Returns None if the option is empty, which turns that file off.
+    """
+    filename = config.get(key) or ''
+    if not filename:
+        return None
+    if os.path.isabs(filename):
+        return filename
+    state_dir = config.get('state_dir') or 'harvester_state'
+    try:
+        os.makedirs(state_dir, exist_ok=True)
+    except OSError as e:
+        log_error(f"WARNING: cannot create the state_dir {state_dir}: {e}")
+    return os.path.join(state_dir, filename)
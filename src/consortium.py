@@ -0,0 +1,38 @@
+# consortium.py : harvest one platform for many member institutions (several Customer_IDs separated by
+### semicolons in one providers.tsv row), each member with its own provider_info, report urls and file names
+
+import re
+
+MEMBER_SEPARATOR = ';'
+
+
+def member_ids(customer_id):
+    """The Customer_IDs in a providers.tsv Customer_ID value: one for a single institution, several for a consortium."""
+    return [member.strip() for member in str(customer_id or '').split(MEMBER_SEPARATOR) if member.strip()]
+
+
+def make_member_info(provider_info, customer_id):
+    """The provider_info for one consortium member: the provider's settings with the member's Customer_ID and no report urls yet."""
+    member_info = dict(provider_info)
+    member_info['Customer_ID'] = customer_id
+    member_info['Member'] = customer_id
+    member_info['Members'] = []
+    member_info['Report_URLS'] = {}
+    member_info['Derived_URLS'] = {}
+    member_info['Report_Dates'] = {}
+    return member_info
+
+
+def member_label(provider_info):
+    """The provider's name for messages, with the member's Customer_ID for a consortium member."""
+    member = provider_info.get('Member')
+    return f"{provider_info.get('Name', '')} ({member})" if member else provider_info.get('Name', '')
+
+
+def file_prefix(provider_info):
+    """The start of the provider's json and tsv file names: its name, and for a consortium member its Customer_ID."""
+    vendor = provider_info.get('Name', '').replace(' ', '_')
+    member = provider_info.get('Member')
+    if not member:
+        return vendor
+    return f"{vendor}_{re.sub(r'[^A-Za-z0-9.-]', '_', member)}"
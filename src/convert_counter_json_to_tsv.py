@@ -7,6 +7,8 @@ from dateutil.relativedelta import relativedelta
 import inspect
 import tsv_utils
 from tsv_utils import default_metric_types, format_nested_id, format_exceptions
+from stream_json import load_report
+from run_options import provider_options
 #from current_config import tsv_dir, always_include_header_metric_types, save_empty_report
 # Removed - will be passed as parameters,these values get cached at import time. We'll extract them from config dict instead.-Daniel
 from logger import log_error
@@ -26,8 +28,8 @@ def extract_metric_types(report_items):
                 # Add keys from the Performance object to the metric_types set
                 for metric in entry['Performance'].keys():
                     metric_types.add(metric)
-    # Convert set back to a list for the final output
-    return list(metric_types)
+    # Convert set back to a list for the final output, sorted so the header is the same every run
+    return sorted(metric_types)
 
 
 def date_columns(report_items):
@@ -136,8 +138,11 @@ def convert_counter_json_to_tsv(report_type, json_file_path,provider_info,config
 
     try:
         # Load JSON data for reading
-        with open(json_file_path, "r", encoding="utf-8") as f:
-            counter_data = json.load(f)
+        if provider_options(provider_info).stream_downloads:
+            counter_data = load_report(json_file_path)  # Report_Items are read from the file as they are looped over
+        else:
+            with open(json_file_path, "r", encoding="utf-8") as f:
+                counter_data = json.load(f)
         # Extract Report_Header and Report_Items
         report_header = counter_data.get("Report_Header", {})
         if not report_header:
@@ -242,6 +242,7 @@ def get_ir_m1_data(report_items,header_date_list):# For IR_M1, there are no pare
             # item is  a dict, its keys include Item, Item_ID, Attr_Per, etc.
             row = []
             row = [None] * len(IR_M1_list)  # Prepopulate/clear out the row with placeholders
+            data_to_insert = {}  # each item starts empty, so no Item_ID value is left over from the item before
             try:
                 for item_key, item_value in item.items(): # parse out the values in dict item
                     #log_error(f'The keys in item are: {item.keys()}\n')
@@ -297,6 +298,7 @@ def get_ir_data(report_items,header_date_list):# For IR, there are no parents; r
             # item is  a dict, its keys include Item, Item_ID, Attr_Per, etc.
             row = []
             row = [None] * len(IR_list)  # Prepopulate/clear out the row with placeholders
+            data_to_insert = {}  # each item starts empty, so no Item_ID value is left over from the item before
             try:
                 for item_key, item_value in item.items(): # parse out the values in dict item
                     #log_error(f'The keys in item are: {item.keys()}\n')
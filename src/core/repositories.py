@@ -17,6 +17,11 @@ from .state import AppSignals
 
 class ConfigRepository:
     """Handles configuration file persistence."""
+
+    # The options edited in the settings dialog, written at the top of current_config.py
+    BASIC_KEYS = ('sqlite_filename', 'error_log_file', 'json_dir', 'tsv_dir', 'providers_file',
+                  'save_empty_report', 'always_include_header_metric_types', 'default_begin')
+
     def __init__(self, config_file: Optional[Path] = None, signals: Optional[AppSignals] = None):
         """Initialize with optional config file path."""
         self.config_file = config_file or self._find_config_file()
@@ -81,6 +86,10 @@ class ConfigRepository:
         try:
             self.config_file.parent.mkdir(parents=True, exist_ok=True)
 
+            # The settings dialog only edits the basic options, so keep whatever the
+            # file (or the defaults) already has for the others, e.g. the advanced options
+            config = {**self.load(), **config}
+
             content = """#####  Various constant values that you can change as you like
 
 sqlite_filename = '{sqlite_filename}'
@@ -93,6 +102,16 @@ always_include_header_metric_types = {always_include_header_metric_types}
 default_begin = '{default_begin}'
 """.format(**config)
 
+            extra_keys = [key for key in config if key not in self.BASIC_KEYS]
+            if extra_keys:
+                content += "\n#####  Advanced options\n"
+                for key in extra_keys:
+                    value = config[key]
+                    if isinstance(value, bool) or str(value).replace('.', '', 1).isdigit():
+                        content += f"{key} = {value}\n"
+                    else:
+                        content += f"{key} = '{value}'\n"
+
             with open(self.config_file, 'w', encoding='utf-8') as f:
                 f.write(content)
 
@@ -178,7 +197,40 @@ default_begin = '{default_begin}'
             'providers_file': 'providers.tsv',
             'save_empty_report': False,
             'always_include_header_metric_types': True,
-            'default_begin': '2025-01'
+            'default_begin': '2025-01',
+            'max_workers': '1',
+            'max_requests_per_host': '1',
+            'harvest_engine': 'threads',
+            'max_retries': '5',
+            'max_retry_wait': '300',
+            'retry_budget_per_provider': '20',
+            'retry_budget_per_run': '200',
+            'queued_report_deadline': '30',
+            'queued_poll_interval': '300',
+            'circuit_breaker_threshold': '3',
+            'circuit_breaker_cooldown': '15',
+            'state_dir': 'harvester_state',
+            'provider_health_file': 'provider_health.json',
+            'harvest_history_file': 'harvest_history.json',
+            'reports_cache_file': 'reports_cache.json',
+            'reports_cache_ttl': '24',
+            'refresh_reports_cache': False,
+            'use_json_archive': False,
+            'restatement_months': '3',
+            'incremental_harvest': False,
+            'chunk_months': '0',
+            'chunk_reports': 'IR,IR_EX,TR,TR_EX',
+            'chunk_target_mb': '50',
+            'stream_downloads': False,
+            'derive_master_reports': False,
+            'derive_standard_views': False,
+            'discovery_workers': '8',
+            'pipeline_queue_size': '0',
+            'cassette_mode': 'off',
+            'cassette_file': 'harvest_cassette.zip',
+            'telemetry_file': '',
+            'adaptive_timeouts': True,
+            'max_read_timeout': '600'
         }
 
 
@@ -3,6 +3,7 @@
 
 from logger import log_error
 import data_columns # includes data_columns_TR etc.
+from db_coverage import create_coverage_table
 
 
 def create_data_table(cursor):
@@ -38,6 +39,11 @@ def create_data_table(cursor):
         # Execute the SQL to create the table
 
         cursor.execute(sql_statement)  # Finally execute the SQL
+        # a database made by an older version of the harvester gets the columns added since (eg Customer_ID)
+        existing_columns = {row[1] for row in cursor.execute(f'PRAGMA table_info({report_code})').fetchall()}
+        for col in all_data_columns[report_code]:
+            if col not in existing_columns:
+                cursor.execute(f'ALTER TABLE {report_code} ADD COLUMN {col} TEXT')
         Index_Report_Type = f'CREATE INDEX IF NOT EXISTS idx_report_type ON {report_code} (Report_Type)'
         Index_Provider_Name = f'CREATE INDEX IF NOT EXISTS idx_provider_name ON {report_code} (Provider_Name)'
         Index_Metric_Type = f'CREATE INDEX IF NOT EXISTS idx_Metric_Type ON {report_code} (Metric_Type)'
@@ -51,3 +57,4 @@ def create_data_table(cursor):
         cursor.execute(Index_Provider_Name)
         cursor.execute(Index_Metric_Type)
         cursor.execute(Index_Dates)
+    create_coverage_table(cursor)  # the months harvested so far, see db_coverage.py
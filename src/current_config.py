@@ -8,3 +8,70 @@ providers_file = 'providers.tsv'
 save_empty_report = True
 always_include_header_metric_types = True
 default_begin = '2025-01'
+
+#####  Advanced options
+# max_workers: how many providers to harvest at the same time (1 = one provider at a time)
+max_workers = 1
+# max_requests_per_host: how many API requests can be in flight at once to the same provider host
+max_requests_per_host = 1
+# harvest_engine: threads (the standard engine) or asyncio (needs the optional aiohttp package)
+harvest_engine = 'threads'
+# max_retries: how many times one report request is retried after the provider says it is too busy (429/503) or times out
+max_retries = 5
+# max_retry_wait: longest wait in seconds before a retry; if a provider asks for a longer wait that report is skipped
+max_retry_wait = 300
+# retry_budget_per_provider / retry_budget_per_run: total retries allowed for one provider, and for the whole run
+retry_budget_per_provider = 20
+retry_budget_per_run = 200
+# queued_report_deadline: minutes to keep asking for a report the provider has queued (HTTP 202) before giving up on it
+queued_report_deadline = 30
+# queued_poll_interval: longest wait in seconds between asking again for a queued report
+queued_poll_interval = 300
+# circuit_breaker_threshold: server errors or timeouts in a row after which the rest of a provider's reports are skipped
+circuit_breaker_threshold = 3
+# circuit_breaker_cooldown: minutes a provider that stopped answering is skipped in later runs before it is tried again
+circuit_breaker_cooldown = 15
+# state_dir: the folder the harvester keeps its files between runs in (provider_health_file, harvest_history_file, reports_cache_file, telemetry_file); a relative folder is next to current_config.py
+state_dir = 'harvester_state'
+# provider_health_file: where the harvester remembers which providers stopped answering
+provider_health_file = 'provider_health.json'
+# harvest_history_file: where the harvester remembers how long each provider's reports took, to start the slowest providers first
+harvest_history_file = 'harvest_history.json'
+# reports_cache_file: where each provider's list of supported reports is kept between runs
+reports_cache_file = 'reports_cache.json'
+# reports_cache_ttl: hours a saved list of supported reports is used before asking the provider again (0 = always ask)
+reports_cache_ttl = 24
+# refresh_reports_cache: True to ask every provider for its list of supported reports this run
+refresh_reports_cache = False
+# use_json_archive: True to take the months that can no longer change from the json files of earlier runs instead of downloading them again
+use_json_archive = False
+# restatement_months: how many months before the current month a provider may still change, and so are always asked for again (used with use_json_archive and incremental_harvest)
+restatement_months = 3
+# incremental_harvest: True to ask each provider only for the months of each report that have not been harvested into the database yet
+incremental_harvest = False
+# chunk_months: ask for long date ranges of the reports in chunk_reports in chunks of at most this many months (0 = never split)
+chunk_months = 0
+# chunk_reports: the reports that may be split into date-range chunks
+chunk_reports = 'IR,IR_EX,TR,TR_EX'
+# chunk_target_mb: once a report's size is known from earlier runs, its chunks are sized to about this many MB
+chunk_target_mb = 50
+# stream_downloads: True to write each downloaded report to disk as it arrives and read its items one at a time, for very large reports
+stream_downloads = False
+# derive_master_reports: True to download only the _EX copy of TR, DR, PR and IR and make the master report from it, halving the requests for those reports
+derive_master_reports = False
+# derive_standard_views: True to make the standard views (TR_J1, DR_D1, PR_P1, IR_A1, ...) from their master report's _EX download instead of asking for each one
+derive_standard_views = False
+# discovery_workers: how many providers are asked for their list of supported reports at the same time; each provider's reports start downloading as soon as its list is in
+discovery_workers = 8
+# pipeline_queue_size: how many downloaded reports can wait for each step after the download (json save, tsv conversion, sqlite insert), which run in their own threads so the next report downloads meanwhile; 0 (the default) does every step in the downloading thread
+pipeline_queue_size = 0
+# cassette_mode: record to save every API response of the run in cassette_file (with the credentials hashed), replay to harvest from that file instead of the providers, off for normal harvesting
+cassette_mode = 'off'
+# cassette_file: the zip file the API responses are recorded in and replayed from
+cassette_file = 'harvest_cassette.zip'
+# telemetry_file: where the status, time to first byte, download time and size of every API request of the run are written, one json line each (empty, the default = not written, or eg 'request_telemetry.jsonl'); a summary per provider is always in the info log
+telemetry_file = ''
+# adaptive_timeouts: True works out each request's timeouts from how long the provider took to start answering in earlier runs (harvest_history_file), False always waits 10 seconds to connect and 30 seconds for an answer
+adaptive_timeouts = True
+# max_read_timeout: the longest, in seconds, adaptive_timeouts will wait for a provider to start answering (or between two parts of its answer)
+max_read_timeout = 600
@@ -66,6 +66,7 @@ data_columns = [
 data_columns_TR = [
         "Row_Hash",  #not part of COUNTER data, needed for uniqueness of rows
         "Provider_Name",
+        "Customer_ID",  # only for a consortium member's rows, see consortium.py
         "Report_Type",
         "Access_Method",
         "Access_Type",
@@ -90,6 +91,7 @@ data_columns_TR = [
 data_columns_PR = [
         "Row_Hash",  #not part of COUNTER data, needed for uniqueness of rows
         "Provider_Name",
+        "Customer_ID",  # only for a consortium member's rows, see consortium.py
         "Report_Type",
         "Platform",
         "Access_Method",
@@ -104,6 +106,7 @@ data_columns_PR = [
 data_columns_DR = [
         "Row_Hash",  #not part of COUNTER data, needed for uniqueness of rows
         "Provider_Name",
+        "Customer_ID",  # only for a consortium member's rows, see consortium.py
         "Report_Type",
         "Database_Name",
         "Access_Method",
@@ -122,6 +125,7 @@ data_columns_DR = [
 data_columns_IR = [
         "Row_Hash",  #not part of COUNTER data, needed for uniqueness of rows
         "Provider_Name",
+        "Customer_ID",  # only for a consortium member's rows, see consortium.py
         "Report_Type",
         "Item",
         "Access_Method",
@@ -0,0 +1,122 @@
+# db_coverage.py : which months of each provider's reports are already in the sqlite database (the Harvest_Coverage
+### table), so that incremental_harvest only asks for the others; a standard view follows its master report
+
+import os
+import sqlite3
+from datetime import date, datetime
+from logger import log_error
+from report_merge import first_changeable_month, month_index
+from run_options import provider_options
+
+# Global variables
+_coverage = {}  # (Provider_Name, Customer_ID of a consortium member or '', Report_Type) -> set of months as YYYY-MM
+
+DATABASE_REPORTS = ('TR', 'DR', 'PR', 'IR')
+COVERAGE_TABLE = 'Harvest_Coverage'
+FINAL_EXCEPTIONS = {3030}  # "No Usage Available for Requested Dates": a report with no items that is still a full answer
+
+
+def create_coverage_table(cursor):
+    cursor.execute(f'''
+        CREATE TABLE IF NOT EXISTS {COVERAGE_TABLE} (
+            Provider_Name TEXT NOT NULL,
+            Customer_ID TEXT NOT NULL,
+            Report_Type TEXT NOT NULL,
+            Data_Month TEXT NOT NULL,
+            Harvested TEXT NOT NULL,
+            PRIMARY KEY (Provider_Name, Customer_ID, Report_Type, Data_Month)
+        );
+    ''')
+
+
+def load_coverage(options):
+    """Read the months already harvested into the database, if incremental_harvest is on (called by run_harvester)."""
+    global _coverage
+    _coverage = {}
+    if not options.incremental_harvest:
+        return
+    restatement_months = options.restatement_months
+    sqlite_filename = options.sqlite_filename
+    if not os.path.exists(sqlite_filename):
+        log_error(f"INFO: incremental harvest: {sqlite_filename} does not exist yet, harvesting every month")
+        return
+    coverage = {}
+    conn = sqlite3.connect(sqlite_filename)
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f'SELECT Provider_Name, Customer_ID, Report_Type, Data_Month, Harvested FROM {COVERAGE_TABLE}')
+            harvested_months = cursor.fetchall()
+        except sqlite3.OperationalError:
+            harvested_months = []  # a database from before the coverage table
+        for provider_name, member, report_type, month, harvested in harvested_months:
+            # only a month that could not be restated any more when it was harvested is final
+            if month_index(month) < first_changeable_month(date.fromisoformat(harvested[:10]), restatement_months):
+                coverage.setdefault((provider_name, member, report_type), set()).add(month)
+        # usage rows harvested before the coverage table was kept count too, once they are old enough not to change
+        last_final = first_changeable_month(date.today(), restatement_months)
+        for table in DATABASE_REPORTS:
+            try:
+                cursor.execute(f'SELECT DISTINCT Provider_Name, Customer_ID, Report_Type, Data_Year, Data_Month FROM {table}')
+            except sqlite3.OperationalError:
+                try:  # a database from before consortium members (see consortium.py) has no Customer_ID column
+                    cursor.execute(f"SELECT DISTINCT Provider_Name, '', Report_Type, Data_Year, Data_Month FROM {table}")
+                except sqlite3.OperationalError:
+                    continue  # the table has not been created yet
+            for provider_name, member, report_type, year, month in cursor.fetchall():
+                if year and month and int(year) * 12 + int(month) - 1 < last_final:
+                    coverage.setdefault((provider_name, member or '', report_type), set()).add(f"{int(year):04d}-{int(month):02d}")
+    finally:
+        conn.close()
+    _coverage = coverage
+    log_error(f"INFO: incremental harvest: found {sum(len(months) for months in coverage.values())} provider/report months already harvested into {sqlite_filename}")
+
+
+def month_range(begin, end):
+    # every YYYY-MM from begin to end
+    months = []
+    year, month = int(begin[:4]), int(begin[5:7])
+    while f"{year:04d}-{month:02d}" <= end[:7]:
+        months.append(f"{year:04d}-{month:02d}")
+        month += 1
+        if month > 12:
+            month = 1
+            year += 1
+    return months
+
+
+def missing_months(provider_info, report_id, begin, end):
+    """
+    Narrow a report's YYYY-MM begin and end to the months not yet harvested into the database
+    (for a consortium member, the months not yet harvested for its Customer_ID).
+
+    Returns:
+        (begin, end) to ask the provider for, or None if every month is already there
+    """
+    if not provider_options(provider_info).incremental_harvest:
+        return begin, end
+    present = _coverage.get((provider_info.get('Name'), provider_info.get('Member', ''), report_id[:2]), set())
+    missing = [month for month in month_range(begin, end) if month not in present]
+    if not missing:
+        return None
+    return missing[0], missing[-1]
+
+
+def final_empty_report(report_header):
+    """True if a report with no items means the provider has no usage for those months, not that it failed to answer."""
+    exceptions = report_header.get('Exceptions') or []
+    return all(isinstance(exception, dict) and exception.get('Code') in FINAL_EXCEPTIONS for exception in exceptions)
+
+
+def record_coverage(cursor, provider_info, report_type):
+    """
+    Note in the database that the months asked for in this _EX report have been harvested
+    (called once its rows are in, or once the provider has answered that it has no usage for them).
+    """
+    dates = provider_info.get('Report_Dates', {}).get(report_type, '')
+    if not report_type.upper().endswith('_EX') or len(dates) != 21:
+        return
+    harvested = datetime.now().isoformat(timespec='seconds')
+    cursor.executemany(f'INSERT OR REPLACE INTO {COVERAGE_TABLE} VALUES (?, ?, ?, ?, ?)',
+                       [(provider_info.get('Name', ''), provider_info.get('Member', ''), report_type[:2].upper(), month, harvested)
+                        for month in month_range(dates[:7], dates[11:18])])
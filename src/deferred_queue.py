@@ -0,0 +1,81 @@
+# deferred_queue.py : parking place for reports the provider answered with 202 "report queued", asked for again
+### on a schedule while the harvester goes on with other reports, until queued_report_deadline passes
+
+import threading
+import time
+from rate_limiter import queued_retry_wait
+
+
+class QueuedReport:
+    """One parked report and its polling schedule."""
+
+    def __init__(self, provider_info, report_id, url, first_wait, deadline_seconds, max_poll_interval):
+        now = time.monotonic()
+        self.provider_info = provider_info
+        self.report_id = report_id
+        self.url = url
+        self.parked_at = now
+        self.deadline = now + deadline_seconds
+        self.max_poll_interval = max_poll_interval
+        self.wait = first_wait
+        self.ready_at = now + first_wait
+        self.polls = 0
+
+    def reschedule(self):
+        """Schedule the next poll; returns False if that would be past the deadline."""
+        self.polls += 1
+        self.wait = min(self.wait * 2, self.max_poll_interval)
+        self.ready_at = time.monotonic() + self.wait
+        return self.ready_at <= self.deadline
+
+    def minutes_waited(self):
+        return (time.monotonic() - self.parked_at) / 60
+
+
+class DeferredQueue:
+    """The parked reports for one harvester run, shared by all provider threads."""
+
+    def __init__(self, options):
+        self.deadline_seconds = options.queued_report_deadline
+        self.max_poll_interval = options.queued_poll_interval
+        self.items = []
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.items)
+
+    def schedule(self, provider_info, report_id, url):
+        """Make the polling schedule for a queued report; the first poll is after the provider's Retry wait."""
+        first_wait = min(queued_retry_wait(provider_info), self.max_poll_interval)
+        return QueuedReport(provider_info, report_id, url, first_wait, self.deadline_seconds, self.max_poll_interval)
+
+    def park(self, provider_info, report_id, url):
+        """Park a report the provider has queued."""
+        item = self.schedule(provider_info, report_id, url)
+        with self.lock:
+            self.items.append(item)
+        return item
+
+    def repark(self, item):
+        """Put a report back after another 202; returns False if its deadline has passed."""
+        if not item.reschedule():
+            return False
+        with self.lock:
+            self.items.append(item)
+        return True
+
+    def take_due(self):
+        """Remove and return the parked reports that are due to be asked for again."""
+        now = time.monotonic()
+        with self.lock:
+            due = [item for item in self.items if item.ready_at <= now]
+            self.items = [item for item in self.items if item.ready_at > now]
+        return due
+
+    def seconds_until_next(self):
+        """Seconds until the next parked report is due (0 if the queue is empty)."""
+        with self.lock:
+            if not self.items:
+                return 0
+            return max(0.0, min(item.ready_at for item in self.items) - time.monotonic())
@@ -0,0 +1,183 @@
+# derive_reports.py : make master reports and standard views from the _EX downloads instead of downloading them,
+### by filtering the _EX rows and adding up the usage over the columns the report does not have
+
+import copy
+import json
+import tsv_utils
+from report_merge import item_identity, PERFORMANCE
+
+# What the _EX copy of each master report asks for on top of the master (see fetch_json.add_report_urls)
+EX_ATTRIBUTES_TO_SHOW = {
+    'TR': 'YOP|Access_Method|Access_Type',
+    'DR': 'Access_Method',
+    'PR': 'Access_Method',
+    'IR': 'Authors|Publication_Date|Article_Version|YOP|Access_Type|Access_Method',
+}
+EX_PARENT_DETAILS = {'IR'}  # the _EX also has include_parent_details=True
+EX_REPORT_ATTRIBUTES = ('Attributes_To_Show', 'Include_Parent_Details')  # what the _EX adds to Report_Attributes
+ATTRIBUTE_COLUMNS = {'Data_Type', 'YOP', 'Access_Type', 'Access_Method'}  # the columns that come from Attribute_Performance
+
+# The COUNTER definition of each standard view: its master report, its name, the filters on its rows (a Parent_
+# filter is on the item's parent, see filter_items), and any column in its tsv column list that COUNTER adds the
+# usage up over all the same.
+# Which columns it has and which metric types it shows come from tsv_utils. The views are made from the _EX,
+# as the master report itself has no Access_Method.
+STANDARD_VIEWS = {
+    'PR_P1': ('PR', 'Platform Usage', {'Access_Method': ['Regular']}, {'Data_Type'}),
+    'DR_D1': ('DR', 'Database Search and Item Usage', {'Access_Method': ['Regular']}, set()),
+    'DR_D2': ('DR', 'Database Access Denied', {'Access_Method': ['Regular']}, set()),
+    'TR_J1': ('TR', 'Journal Requests (Controlled)', {'Data_Type': ['Journal'], 'Access_Type': ['Controlled'], 'Access_Method': ['Regular']}, set()),
+    'TR_J2': ('TR', 'Journal Access Denied', {'Data_Type': ['Journal'], 'Access_Method': ['Regular']}, set()),
+    'TR_J3': ('TR', 'Journal Usage by Access Type', {'Data_Type': ['Journal'], 'Access_Method': ['Regular']}, set()),
+    'TR_J4': ('TR', 'Journal Requests by YOP (Controlled)', {'Data_Type': ['Journal'], 'Access_Type': ['Controlled'], 'Access_Method': ['Regular']}, set()),
+    'TR_B1': ('TR', 'Book Requests (Controlled)', {'Data_Type': ['Book'], 'Access_Type': ['Controlled'], 'Access_Method': ['Regular']}, set()),
+    'TR_B2': ('TR', 'Book Access Denied', {'Data_Type': ['Book'], 'Access_Method': ['Regular']}, set()),
+    'TR_B3': ('TR', 'Book Usage by Access Type', {'Data_Type': ['Book'], 'Access_Method': ['Regular']}, set()),
+    'IR_A1': ('IR', 'Journal Article Requests', {'Data_Type': ['Article'], 'Parent_Data_Type': ['Journal'], 'Access_Method': ['Regular']}, set()),
+    'IR_M1': ('IR', 'Multimedia Item Requests', {'Data_Type': ['Multimedia'], 'Access_Method': ['Regular']}, set()),
+}
+
+
+def derive_master_from_ex(report_id, options):
+    """True if this master report is made from its _EX download instead of being downloaded itself."""
+    return options.derive_master_reports and report_id in EX_ATTRIBUTES_TO_SHOW
+
+
+def view_master(report_id, supported_report_ids, options):
+    """
+    The master report whose _EX this standard view is made from, or None if the view is downloaded
+    (derive_standard_views is off, it is not a standard view, or the provider does not have the master report).
+    """
+    if not options.derive_standard_views or report_id not in STANDARD_VIEWS:
+        return None
+    master_id = STANDARD_VIEWS[report_id][0]
+    return master_id if master_id in supported_report_ids else None
+
+
+def reports_derived_from(provider_info, report_id):
+    """The (report id, url) of the provider's reports that are made from this downloaded _EX report."""
+    if not report_id.upper().endswith('_EX'):
+        return []
+    master_id = report_id[:-3]
+    return [(derived_id, url) for derived_id, url in provider_info.get('Derived_URLS', {}).items()
+            if derived_id == master_id or STANDARD_VIEWS.get(derived_id, ('',))[0] == master_id]
+
+
+def derive_report(ex_json, report_id):
+    """Make the master report or standard view report_id from the report json of its master's _EX download."""
+    if report_id in STANDARD_VIEWS:
+        return derive_view(ex_json, report_id)
+    return derive_master(ex_json, report_id)
+
+
+def aggregate_items(items, dropped):
+    """
+    Add up report items over the fields in dropped: they are removed from the items and from their
+    Attribute_Performance entries, and items and entries that are then the same are combined into one.
+    The order of the items, entries and metrics is the order they first appear in.
+    """
+    merged = {}  # item identity -> derived item
+    entries = {}  # item identity -> attribute values -> Attribute_Performance entry of that item
+    for item in items:
+        performance_list = item.get('Attribute_Performance', []) or []
+        item = {key: value for key, value in item.items() if key not in dropped and key != 'Attribute_Performance'}
+        key = item_identity(item)
+        target = merged.get(key)
+        if target is None:
+            target = merged[key] = dict(item, Attribute_Performance=[])
+            entries[key] = {}
+        for entry in performance_list:
+            attributes = {name: value for name, value in entry.items() if name != PERFORMANCE and name not in dropped}
+            attributes_key = json.dumps(attributes, sort_keys=True, default=str)
+            combined = entries[key].get(attributes_key)
+            if combined is None:
+                combined = entries[key][attributes_key] = dict(attributes, Performance={})
+                target['Attribute_Performance'].append(combined)
+            for metric, months in (entry.get(PERFORMANCE) or {}).items():
+                totals = combined[PERFORMANCE].setdefault(metric, {})
+                for month, count in months.items():
+                    totals[month] = totals.get(month, 0) + count
+    return [item for item in merged.values() if item['Attribute_Performance']]
+
+
+def derive_master(ex_json, report_id):
+    """
+    Make the master report report_id (eg 'TR') from the report json of its _EX download.
+
+    Returns:
+        the master report json; the _EX report json is not changed
+    """
+    dropped = set(EX_ATTRIBUTES_TO_SHOW[report_id].split('|'))
+    header = copy.deepcopy(ex_json.get('Report_Header', {}))
+    attributes = header.get('Report_Attributes')
+    if isinstance(attributes, dict):
+        for name in EX_REPORT_ATTRIBUTES:
+            attributes.pop(name, None)
+    items = ex_json.get('Report_Items', []) or []
+    if report_id in EX_PARENT_DETAILS:
+        # without parent details the items are not grouped under their parents
+        derived = aggregate_items((child for parent in items for child in parent.get('Items', []) or []), dropped)
+        report_items = [{'Items': derived}] if derived else []
+    else:
+        report_items = aggregate_items(items, dropped)
+    report = dict(ex_json)
+    report['Report_Header'] = header
+    report['Report_Items'] = report_items
+    return report
+
+
+def filter_items(items, filters, metric_types, parent=None):
+    # the items with only the Attribute_Performance entries and metric types that are in a standard view;
+    # the Parent_ filters (eg Parent_Data_Type for IR_A1) are checked on the items' parent, so without one no item is in the view
+    for name, values in filters.items():
+        if name.startswith('Parent_') and (parent or {}).get(name[len('Parent_'):]) not in values:
+            return
+    for item in items:
+        performance_list = []
+        for entry in item.get('Attribute_Performance', []) or []:
+            if any(name in entry and entry[name] not in values for name, values in filters.items()):
+                continue
+            performance = {metric: months for metric, months in (entry.get(PERFORMANCE) or {}).items() if metric in metric_types}
+            if performance:
+                performance_list.append(dict(entry, Performance=performance))
+        if performance_list:
+            yield dict(item, Attribute_Performance=performance_list)
+
+
+def derive_view(ex_json, report_id):
+    """
+    Make the standard view report_id (eg 'TR_J1') from the report json of its master's _EX download.
+
+    Returns:
+        the view's report json; the _EX report json is not changed
+    """
+    master_id, report_name, filters, summed = STANDARD_VIEWS[report_id]
+    columns = set(getattr(tsv_utils, f"{report_id}_list"))
+    metric_types = tsv_utils.default_metric_types[report_id]
+    extra_columns = set(EX_ATTRIBUTES_TO_SHOW[master_id].split('|')) | ATTRIBUTE_COLUMNS
+    dropped = (extra_columns - columns) | summed
+    header = copy.deepcopy(ex_json.get('Report_Header', {}))
+    header['Report_ID'] = report_id
+    header['Report_Name'] = report_name
+    header['Report_Attributes'] = {}
+    ex_filters = header.get('Report_Filters') or {}
+    header['Report_Filters'] = dict(filters, Metric_Type=list(metric_types),
+                                    Begin_Date=ex_filters.get('Begin_Date', ''), End_Date=ex_filters.get('End_Date', ''))
+    items = ex_json.get('Report_Items', []) or []
+    if master_id in EX_PARENT_DETAILS:
+        if 'Parent_Title' in columns:  # the view keeps the items under their parents
+            report_items = []
+            for parent in items:
+                children = aggregate_items(filter_items(parent.get('Items', []) or [], filters, metric_types, parent), dropped)
+                if children:
+                    report_items.append(dict(parent, Items=children))
+        else:
+            children = (child for parent in items for child in filter_items(parent.get('Items', []) or [], filters, metric_types, parent))
+            derived = aggregate_items(children, dropped)
+            report_items = [{'Items': derived}] if derived else []
+    else:
+        report_items = aggregate_items(filter_items(items, filters, metric_types), dropped)
+    report = dict(ex_json)
+    report['Report_Header'] = header
+    report['Report_Items'] = report_items
+    return report
@@ -5,9 +5,25 @@ import time
 import requests
 from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
-import brotli
 from logger import log_error
+from http_session import get_session, host_slot, ResumableBody, BodyBroken
+from timeouts import request_timeouts
+from rate_limiter import get_rate_limiter, provider_delay, queued_retry_wait
+from backoff import Backoff, retry_wait, parse_retry_after
+from circuit_breaker import allow_request, record_success, record_failure
+from harvest_history import note_response_bytes
+from reports_cache import cached_reports, store_reports
+from db_coverage import missing_months
+from stream_json import download_to_file, load_report, new_download_file
+from compression import accept_encoding, decode_body, record_transfer
+from derive_reports import EX_ATTRIBUTES_TO_SHOW, derive_master_from_ex, view_master
+from cancellation import HarvestCancelled, cancelled, cancellable_sleep, abort_on_cancel
+from consortium import member_ids, make_member_info, member_label
+from telemetry import RequestTimer
+from run_options import DEFAULT_OPTIONS, provider_options
+from cassette import recording, replaying, record_response, replay_response, read_body as read_recorded_body, copy_body
 import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
 #from current_config import error_log_file, default_begin
 #Removed - not actually used in this file (only imports for reference)
 from tsv_utils import default_metric_types, official_reports #default metric types is also a list of all possible valid report types, as the keys
@@ -94,128 +110,186 @@ def get_dd(date_string, position):
         raise ValueError(f"ERROR processing input: {e}")
 
 
+# Headers sent with every COUNTER API request
+API_HEADERS = {
+   'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
+    'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': accept_encoding(),  # every codec installed, see compression.py
+    'Referer': 'https://https://www.countermetrics.org/'
+}
+
+# HTTP status codes where there is no point in retrying - the whole provider is given up on
+FATAL_STATUS_MESSAGES = {
+    400: "Bad Request! Check your request parameters",
+    401: "requestor_id or api_key wrong!",
+    403: "Unauthorized requestor_id or customer_id. Check your request parameters.",
+    404: "Resource not found! Check if the base_url is correct.",
+    500: "Server error! The API might be down or experiencing issues.",
+}
+
+MAX_ATTEMPTS = 3  # We try up to 3 times, because some vendors require sending the request twice and there can be other random connection failures
+
+REPORT_QUEUED = 202  # get_json_data(..., defer_queued=True) returns this when the provider has queued the report, see deferred_queue.py
+
+
+def response_action(status_code, attempts, provider_info, url, response_text=''):
+    """
+    Decide what to do with the HTTP status of one API call. Shared by get_json_data and the
+    asyncio engine in async_harvest.py so both have the same retry and give-up rules.
+
+    Returns:
+        (action, wait, http_desc) where action is
+        'ok', 'queued' (ask again for this report after wait seconds),
+        'throttled' (hold back this provider's host for wait seconds, then retry) or 'fatal'
+    """
+    provider_name = provider_info.get('Name','')
+    sleep_delay = provider_delay(provider_info)
+    if status_code == 200:
+        return 'ok', 0, None
+    elif status_code == 202:
+        http_desc = (f"Request is queued - try again later:{url}\n {response_text}")
+        if attempts > 2:
+            log_error(f'ERROR: {provider_name} request is queued but taking a long time, try this one again in an hour: \n    {url}')
+            return 'fatal', 0, http_desc
+        return 'queued', queued_retry_wait(provider_info), http_desc
+    elif status_code in FATAL_STATUS_MESSAGES:
+        http_desc = FATAL_STATUS_MESSAGES[status_code]
+        log_error(f'ERROR: {http_desc}\n')
+        log_error(f'ERROR: fatal error: code={status_code}; url={url}\n')
+        return 'fatal', 0, http_desc
+    elif status_code == 429:
+        http_desc = f"Too many requests too fast. {provider_name} needs a delay: {response_text}"
+        return 'throttled', sleep_delay or 3, http_desc #a reasonable delay if we need one but don't have a number to use
+    elif status_code == 503:
+        http_desc = f"Service too busy or request is queued, try again soon and add a delay in your providers.tsv: {url}\n{response_text}"
+        log_error(f'ERROR: {http_desc}\n')
+        # a reasonable time to retry if we didn't have a provider-advised one, will total 10 seconds
+        return 'throttled', (sleep_delay or 5) + 5, http_desc
+    else:
+        http_desc = f"Unexpected status code: {status_code}\nResponse body: {response_text}"
+        log_error(f'ERROR: {http_desc}\n')
+        log_error(f'ERROR: fatal error: code={status_code}; url={url}\n')
+        return 'fatal', 0, http_desc
+
+
+def record_health(provider_info, status_code):
+    # Feed one HTTP status to the provider's circuit breaker: server errors count against it, anything else shows it is alive
+    if status_code >= 500 and status_code != 503:  # 503 is "busy", handled by the retries
+        return record_failure(provider_info, f"HTTP {status_code}")
+    record_success(provider_info)
+    return False
+
+
+def read_body(body, provider_info, timer=None):
+    # Read a ResumableBody as it came over the wire and decode it, once, see compression.py
+    start = time.perf_counter()
+    wire_content = b''.join(body.chunks())
+    read_done = time.perf_counter()
+    content = decode_body(wire_content, body.headers.get('Content-Encoding'))
+    record_transfer(provider_info, len(wire_content), len(content))
+    if timer:
+        timer.transferred(read_done - start, len(wire_content), len(content), time.perf_counter() - read_done)
+    return content
+
+
+def decode_json(content, url):
+    # Parse a decoded response body into the report json
+    report_json = json.loads(content)
+    if  (not isinstance(report_json, dict)) and (not isinstance(report_json, list)):
+        log_error(f"ERROR: Failed to get a valid response after {MAX_ATTEMPTS} attempts, url={url}")
+        return -1
+    return report_json
+
+
 ### This is used for getting all URLs via the SUSHI API - the list of supported reports, and the individual reports
 # return None means a failure of this one URL
 # return -1 means a failure of the entire provider API - don't bother trying any more URLs with that same base_url
-def get_json_data(url, provider_info):
-    report_json = {}
+# return REPORT_QUEUED (only with defer_queued=True) means the provider is still building the report - ask again later
+# with to_file=True and stream_downloads on, a report is written to disk as it arrives, see stream_json.py
+def get_json_data(url, provider_info, defer_queued=False, to_file=False):
     provider_name = provider_info.get('Name','')
-    sleep_delay = provider_info.get('Delay',0)
-    retry_needed = provider_info.get('Delay',0)
+    limiter = get_rate_limiter(provider_info)
+    options = provider_options(provider_info)
+    to_file = to_file and options.stream_downloads
+    if replaying():  # answered from the cassette, see cassette.py
+        return replay_json_data(url, provider_info, to_file)
     try:
-        if sleep_delay and isinstance(sleep_delay, str):
-            sleep_delay = float(sleep_delay)
-        else:
-            sleep_delay = 0.1
-    except:
-        sleep_delay = 5
-    if retry_needed and not sleep_delay:
-        sleep_delay = 5
-    headers = {
-       'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-        'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8',
-        'Accept-Language': 'en-US,en;q=0.5',
-        'Accept-Encoding': 'gzip, deflate',
-        'Referer': 'https://https://www.countermetrics.org/'
-    }
-    try:
-        # We are going to try up to 3 times to make the API call, because some vendors require sending the request twice and there can be other random connection failures
-        max_attempts = 3  # Maximum number of tries
         attempts = 0      # Counter for the number of tries
-        fatal_error = 0  #If we get a fatal error, there will not be any point in retrying
+        response = None
         http_desc = None
+        backoff = None    # the growing waits for retries of this url, see backoff.py
+        download_path = None
 
-        while attempts < max_attempts:
+        while attempts < MAX_ATTEMPTS:
             attempts += 1
-            if sleep_delay:
-                time.sleep(sleep_delay)
-            if fatal_error:
-                log_error(f'ERROR:  Got a fatal HTTP error - need to give up on this provider\n')
-                break
+            if cancelled():  # the user clicked Stop, see cancellation.py
+                return None
+            if not allow_request(provider_info):  # the provider's API is down, see circuit_breaker.py
+                return -1
+            # only waits if this request would go over the provider's Delay budget
+            wait = limiter.reserve()
+            if wait and cancellable_sleep(wait):
+                return None
             try:
-                response = requests.get(url, headers=headers, timeout=(10,30)) #### The actual API call
-                #response.raise_for_status()  # Raise exception for HTTP error codes (4xx, 5xx)
-                if response.status_code == 200:
-                    http_desc = None
+                timeout = request_timeouts(provider_info, url)  # from how long the provider took in earlier runs, see timeouts.py
+                with host_slot(url), RequestTimer(provider_info, url, attempts) as timer:  # a failed request is noted as it fails, see telemetry.py
+                    response = get_session(url).get(url, headers=API_HEADERS, timeout=timeout, stream=True) #### The actual API call, on the pooled session for this host
+                    timer.first_byte(response.status_code)
+                    body = ResumableBody(response, url, API_HEADERS, timeout)  # a body that breaks off is read on from where it stopped
+                    # Stop shuts the connection down, so reading a big report ends at once instead of running to the end
+                    with abort_on_cancel(body.abort):
+                        if to_file and response.status_code == 200:
+                            download_path, download_size, wire_size = download_to_file(body, options, timer)
+                            record_transfer(provider_info, wire_size, download_size)
+                            content = None
+                        else:
+                            content = read_body(body, provider_info, timer)
+                if recording():
+                    record_response(url, response.status_code, response.headers.get('Retry-After'), content, download_path)
+                record_health(provider_info, response.status_code)
+                # the body is only needed as text for the error messages
+                response_text = content.decode('utf-8', errors='replace') if response.status_code != 200 else ''
+                action, wait, http_desc = response_action(response.status_code, attempts, provider_info, url, response_text)
+                if action == 'ok':
                     break
-                elif response.status_code == 202:
-                    http_desc = (f"Request is queued - try again later:{url}\n {response.text}")
-                    #log_error(f'{http_desc}\n')
-                    if attempts > 2:
-                        log_error(f'ERROR: {provider_name} request is queued but taking a long time, try this one again in an hour: \n    {url}')
-                        return -1
-                    if sleep_delay < 5:
-                        sleep_delay = 5
-                    time.sleep(sleep_delay)
-                    fatal_error = 0
-                    continue
-                elif response.status_code == 400:
-                    http_desc = "Bad Request! Check your request parameters"
-                    log_error(f'ERROR: {http_desc}\n')
-                    fatal_error = 1
-                    log_error(f'ERROR: fatal error: code={response.status_code}; report_json={report_json}\n')
-                    return -1
-                elif response.status_code == 401:
-                    http_desc = "requestor_id or api_key wrong!"
-                    log_error(f'ERROR: {http_desc}\n')
-                    fatal_error = 1
-                    log_error(f'ERROR: fatal error: code={response.status_code}; report_json={report_json}\n')
-                    return -1
-                elif response.status_code == 403:
-                    http_desc = "Unauthorized requestor_id or customer_id. Check your request parameters."
-                    log_error(f'ERROR: {http_desc}\n')
-                    fatal_error = 1
-                    log_error(f'ERROR: fatal error: code={response.status_code}; report_json={report_json}\n')
-                    return -1
-                elif response.status_code == 404:
-                    http_desc = "Resource not found! Check if the base_url is correct."
-                    log_error(f'ERROR: {http_desc}\n')
-                    fatal_error = 1
-                    log_error(f'ERROR: fatal error: code={response.status_code}; report_json={report_json}\n')
-                    return -1
-                elif response.status_code == 429:
-                    http_desc = f"Too many requests too fast. {provider_name} needs a delay: {response.text}"
-                    if sleep_delay and (isinstance(sleep_delay, int) or isinstance(sleep_delay, float)):
-                        time.sleep(sleep_delay)
-                    else:
-                        sleep_delay = 3 #a reasonable delay if we need one but don't have a number to use
-                        time.sleep(sleep_delay)
-                    fatal_error = 0
-                    continue
-                elif response.status_code == 500:
-                    http_desc = "Server error! The API might be down or experiencing issues."
-                    log_error(f'ERROR: {http_desc}\n')
-                    fatal_error = 1
-                    log_error(f'ERROR: fatal error: code={response.status_code}; report_json={report_json}\n')
-                    return -1
-                elif response.status_code == 503:
-                    http_desc = f"Service too busy or request is queued, try again soon and add a delay in your providers.tsv: {url}\n{response.text}"
-                    log_error(f'ERROR: {http_desc}\n')
-                    if not sleep_delay:
-                        sleep_delay = 5 # a reasonable time to retry if we didn't have a provider-advised one, will total 10 seconds
-                    time.sleep(sleep_delay+5)
-                    fatal_error = 0
-                    continue
-                else:
-                    http_desc = f"Unexpected status code: {response.status_code}\nResponse body: {response.text}"
-                    log_error(f'ERROR: {http_desc}\n')
-                    fatal_error = 1
-                    log_error(f'ERROR: fatal error: code={response.status_code}; report_json={report_json}\n')
+                timer.done()
+                if action == 'fatal':
                     return -1
+                if action == 'queued' and defer_queued:
+                    return REPORT_QUEUED
+                if action == 'throttled':
+                    backoff = backoff or Backoff(wait, options)
+                    wait = retry_wait(backoff, provider_name, url, parse_retry_after(response.headers.get('Retry-After')))
+                    if wait is None:
+                        return -1
+                    limiter.pause(wait)  # every request to this host holds back, not just this one
+                    attempts -= 1  # throttled retries are limited by the retry budget instead of MAX_ATTEMPTS
+                elif cancellable_sleep(wait):
+                    return None
+                continue
 
             ### these are the while-try
-            except requests.exceptions.Timeout:
+            except HarvestCancelled:
+                # stopped by the user, not a problem with the provider, so nothing for the log or the circuit breaker
+                return None
+            except (requests.exceptions.Timeout, BodyBroken) as e:
+                # a body that broke off part way is asked for again like a timeout, not given up on with the whole provider
+                if record_failure(provider_info, 'request timed out' if isinstance(e, requests.exceptions.Timeout) else 'answer broke off'):
+                    return -1
                 if attempts <= 2:
                     #log_error(f"ERROR: trying to get report for {provider_name}\n{url}\nThe URL request timed out. Will try again\n")
-                    time.sleep(sleep_delay+5)
+                    backoff = backoff or Backoff(5, options)
+                    wait = retry_wait(backoff, provider_name, url)
+                    if wait is None or cancellable_sleep(wait):
+                        return None
                     continue
                 else:
-                    log_error(f"ERROR: trying to get report for {provider_name}: The URL request timed out after multiple tries.\n   {url}\n")
+                    log_error(f"ERROR: trying to get report for {provider_name}: The URL request timed out after multiple tries ({e}).\n   {url}\n")
                     return None
             except requests.exceptions.HTTPError as err:
                 log_error(f"ERROR: \nHTTP Error: {err}")
                 log_error(f"ERROR: Response Code: {err.response.status_code}")
-                print(f"HTTP Error trying to get {url} for  {provider_name}.\n See error log {error_log_file} for details.\n Cannot continue processing this vendor.")
                 log_error(f"ERROR: HTTP Error trying to get  {provider_name}\n{url}: {err}.")
                 try:
                     log_error(err.response.text)
@@ -224,6 +298,7 @@ def get_json_data(url, provider_info):
                 return -1
             except requests.exceptions.ConnectionError as e:
                 log_error(f"ERROR: Network error occurred: {e}")
+                record_failure(provider_info, 'network error')
                 return -1
             except requests.exceptions.TooManyRedirects as e:
                 log_error(f"ERROR: Too many redirects: {e}")
@@ -237,24 +312,61 @@ def get_json_data(url, provider_info):
                 return -1
 
         #out of the while loop without a return -1 interrupting it
-        report_json = response.json()
-        #print(f'2: report_json: {report_json}\nreport_json is class: {type(report_json)}\n')
-        # Handle brotli encoding if present
-        if response.headers.get('Content-Encoding') == 'br':
-            decoded_content = brotli.decompress(response.content)
-            report_json = json.loads(decoded_content)
-        if  (not isinstance(report_json, dict)) and (not isinstance(report_json, list)):
-            log_error(f"ERROR: Failed to get a valid response after 3 attempts, url={url}")
+        if response is None or response.status_code != 200:
+            log_error(f"ERROR: Failed to get a valid response after {MAX_ATTEMPTS} attempts, url={url}\n   {http_desc}")
             return -1
-
-        #print(f'DEBUG3: report_json: {report_json}\nreport_json is class: {type(report_json)}\n')
-        return report_json
+        parse_start = time.perf_counter()
+        try:
+            if download_path:
+                note_response_bytes(url, download_size)
+                report_json = load_report(download_path, temporary=True)
+                if not isinstance(report_json, (dict, list)):
+                    log_error(f"ERROR: Failed to get a valid response after {MAX_ATTEMPTS} attempts, url={url}")
+                    return -1
+                return report_json
+            note_response_bytes(url, len(content))
+            return decode_json(content, url)
+        finally:
+            timer.parsed(time.perf_counter() - parse_start)
+            timer.done()
 
     except Exception as e2:
         log_error(f'ERROR: An error occurred within the main try of get_json_data: {e2}\n')
         return -1
 
 
+def replay_json_data(url, provider_info, to_file=False):
+    """
+    get_json_data from the cassette: the recorded answer to url, with no request and no waits.
+    A report that was still queued when the cassette was recorded fails like a url the provider did not answer.
+
+    Returns:
+        the same as get_json_data, apart from REPORT_QUEUED
+    """
+    provider_name = provider_info.get('Name','')
+    recorded = replay_response(url)
+    if recorded is None:
+        log_error(f"ERROR: {provider_name}: this request is not in the cassette:\n   {url}")
+        return None
+    status_code, body = recorded
+    if status_code == 202:
+        log_error(f"ERROR: {provider_name}: this report was still queued when the cassette was recorded:\n   {url}")
+        return None
+    if status_code != 200:
+        response_text = read_recorded_body(body).decode('utf-8', errors='replace')
+        log_error(f"ERROR: {provider_name}: the provider answered HTTP {status_code} when the cassette was recorded:\n   {url}\n   {response_text}")
+        return -1
+    if to_file:
+        download_path = new_download_file(provider_options(provider_info))
+        copy_body(body, download_path)
+        report_json = load_report(download_path, temporary=True)
+        if not isinstance(report_json, (dict, list)):
+            log_error(f"ERROR: Failed to get a valid response after {MAX_ATTEMPTS} attempts, url={url}")
+            return -1
+        return report_json
+    return decode_json(read_recorded_body(body), url)
+
+
 # if vendor needs delay between url requests, provide the appropriate delay time
 def timedelay(provider_name,thisdelay):
     if thisdelay is None:  # Check if it's None first
@@ -274,252 +386,399 @@ def make_report_id_uppercase(report_json):
             report["Report_ID"] = report["Report_ID"].upper()
     return report_json
 
-def fetch_json(providers, begin_date, end_date, report_type_list, is_cancelled_callback=None):
+def make_provider_info(provider, end_date, options=None):
     """
-    Fetch provider API information with given parameters.
+    Build the provider_info dict that carries one provider's settings through the rest of the harvest.
 
     Args:
-        providers: List of provider dictionaries from load_providers
-        begin_date: Start date in YYYY-MM format
+        provider: One provider dictionary from load_providers
         end_date: End date in YYYY-MM format
-        report_type_list: List of report types selected by the user in the GUI
+        options: the RunOptions of the run (the defaults if not given)
 
     Returns:
-        Dictionary of provider data or None on failure
+        provider_info dict with an empty Report_URLS, or None if mandatory fields are missing
     """
-    data_dict = {}  # Initialize as an empty dictionary for providers
+    # Access mandatory fields
+    provider_name = provider.get('Name')
+    base_url = provider.get('Base_URL')
+    customer_id = provider.get('Customer_ID')
+    # Collect missing fields and present information
+    missing_fields = []
+    if not provider_name:
+        missing_fields.append("Name")
+    if not base_url:
+        missing_fields.append("Base_URL")
+    if not customer_id:
+        missing_fields.append("Customer_ID")
+    # If there are any missing mandatory fields
+    if missing_fields:
+        present_info = []
+        if provider_name:
+            present_info.append(f"Name: {provider_name}")
+        if base_url:
+            present_info.append(f"Base_URL: {base_url}")
+        if customer_id:
+            present_info.append(f"Customer_ID: {customer_id}")
+
+        # Print error information
+        print(
+            f"Error: Missing mandatory fields, skipping this provider: {', '.join(missing_fields)}. Present: {', '.join(present_info)}\n")
+        return None  # Skip to next provider if mandatory fields are missing
+
+    # Optional fields accessed safely
+    requestor_id = provider.get('Requestor_ID', '')
+    api_key = provider.get('API_Key', '')
+    platform = provider.get('Platform', '')
+    version = provider.get('Version', '5.1')  # Default to '5.1' if not provided
+    delay = provider.get('Delay', '')  # Optional field
+    retry = provider.get('Retry', '')  # Optional field
+    first_month_available = provider.get('First_Month_Available', '')
+    last_month_available = provider.get('Last_Month_Available', '')
+    path = provider.get('Path', '')  # for custom reports
+    report_name = provider.get('Report_Name', '')  # for custom reports
+    report_description = provider.get('Report_Description', '')  # for custom reports
+
+    if first_month_available > end_date:
+        log_error(f'WARNING: Provider: {provider_name}: The first date available ({first_month_available}) is after the last date you selected ({end_date}), skipping provider.\n')
+    # several Customer_IDs make the provider a consortium, see consortium.py; the first one is used for the list of supported reports
+    members = member_ids(customer_id)
+    # Initialize the provider entry
+    return {
+        'Name': provider_name,
+        'Base_URL': base_url,
+        'Customer_ID': members[0] if members else customer_id,
+        'Requestor_ID': requestor_id,
+        'API_Key': api_key,
+        'Platform': platform,
+        'Version': version,
+        'Delay': delay,
+        'Retry': retry,
+        'Path': path,
+        'First_Month_Available': first_month_available,
+        'Last_Month_Available': last_month_available,
+        'Report_Name': report_name,
+        'Report_Description': report_description,
+        'Report_URLS': {},  # Initialize the report URLs dictionary
+        'Derived_URLS': {},  # the reports made from another report instead of being downloaded, see derive_reports.py
+        'Report_Dates': {},  # report id -> the begin-end dates asked for, which name its json and tsv files
+        'Member': '',  # the Customer_ID of a consortium member's provider_info
+        'Members': members if len(members) > 1 else [],  # a consortium's Customer_IDs
+        'Options': options or DEFAULT_OPTIONS  # the run's options, see run_options.py
+    }
 
-    if not report_type_list:
-        print("You did not select any report types.\n")
-        return None
 
-    for provider in providers:
-        #print(f"{is_cancelled_callback()} : {provider.get('Name')}")
-        if is_cancelled_callback():
-             break
-        #skip_provider = False
-        provider_info = {}
-        checked_date = 0
-        get_report_url_credentials = ''
-        get_report_url_final = ''
-        get_report_url_daterange = ''
-        credentials = ''
-        b = ''
-        e = ''
-        # Access mandatory fields
-        provider_name = provider.get('Name')
-        base_url = provider.get('Base_URL')
-        customer_id = provider.get('Customer_ID')
-        # Collect missing fields and present information
-        missing_fields = []
-        if not provider_name:
-            missing_fields.append("Name")
-            continue
-        if not base_url:
-            missing_fields.append("Base_URL")
-            continue
-        if not customer_id:
-            missing_fields.append("Customer_ID")
-            continue
-        # If there are any missing mandatory fields
-        if missing_fields:
-            present_info = []
-            if provider_name:
-                present_info.append(f"Name: {provider_name}")
-            if base_url:
-                present_info.append(f"Base_URL: {base_url}")
-            if customer_id:
-                present_info.append(f"Customer_ID: {customer_id}")
-
-            # Print error information
-            print(
-                f"Error: Missing mandatory fields, skipping this provider: {', '.join(missing_fields)}. Present: {', '.join(present_info)}\n")
-            continue  # Skip to next provider if mandatory fields are missing
-
-        # Optional fields accessed safely
-        requestor_id = provider.get('Requestor_ID', '')
-        api_key = provider.get('API_Key', '')
-        platform = provider.get('Platform', '')
-        version = provider.get('Version', '5.1')  # Default to '5.1' if not provided
-        delay = provider.get('Delay', '')  # Optional field
-        retry = provider.get('Retry', '')  # Optional field
-        first_month_available = provider.get('First_Month_Available', '')
-        last_month_available = provider.get('Last_Month_Available', '')
-        path = provider.get('Path', '')  # for custom reports
-        report_name = provider.get('Report_Name', '')  # for custom reports
-        report_description = provider.get('Report_Description', '')  # for custom reports
-
-        if first_month_available > end_date:
-            log(f'Provider: {provider_name}: The first date available ({first_month_available}) is after the last date you selected ({end_date}), skipping provider.\n')
-        # Initialize the provider entry
-        provider_info = {
-            'Name': provider_name,
-            'Base_URL': base_url,
-            'Customer_ID': customer_id,
-            'Requestor_ID': requestor_id,
-            'API_Key': api_key,
-            'Platform': platform,
-            'Version': version,
-            'Delay': delay,
-            'Retry': retry,
-            'Path': path,
-            'First_Month_Available': first_month_available,
-            'Last_Month_Available': last_month_available,
-            'Report_Name': report_name,
-            'Report_Description': report_description,
-            'Report_URLS': {}  # Initialize the report URLs dictionary
-        }
-        # account credentials from the providers.tsv are always used together as a string
-        credentials = f"customer_id={customer_id}" if customer_id else credentials
-        credentials = f"{credentials}&requestor_id={requestor_id}" if requestor_id else credentials
-        credentials = f"{credentials}&api_key={api_key}" if api_key else credentials
-
-        try:  ### first we're going to get the list of supported reports
-            # fix base_urls from the providers.tsv to make sure there is exactly one suffix: /reports/
-            if not base_url.endswith("/reports/"):
-                if base_url.endswith("/reports"):
-                    base_url = f"{base_url}/"
-                else:
-                    base_url = f"{base_url.rstrip('/')}/reports/"
-            # Construct the report_json_url to get the list of reports
-            report_json_url = f"{base_url[:-1]}?{credentials}&platform={platform}"
-            if platform:
-                report_json_url = f"{base_url[:-1]}?{credentials}&platform={platform}"
-            else:
-                report_json_url = f"{base_url[:-1]}?{credentials}"
+def api_credentials(provider_info):
+    # account credentials from the providers.tsv are always used together as a string
+    customer_id = provider_info.get('Customer_ID', '')
+    requestor_id = provider_info.get('Requestor_ID', '')
+    api_key = provider_info.get('API_Key', '')
+    credentials = ''
+    credentials = f"customer_id={customer_id}" if customer_id else credentials
+    credentials = f"{credentials}&requestor_id={requestor_id}" if requestor_id else credentials
+    credentials = f"{credentials}&api_key={api_key}" if api_key else credentials
+    return credentials
+
+
+def reports_base_url(base_url):
+    # fix base_urls from the providers.tsv to make sure there is exactly one suffix: /reports/
+    if not base_url.endswith("/reports/"):
+        if base_url.endswith("/reports"):
+            base_url = f"{base_url}/"
+        else:
+            base_url = f"{base_url.rstrip('/')}/reports/"
+    return base_url
+
+
+def supported_reports_url(provider_info):
+    # Construct the report_json_url to get the list of reports
+    base_url = reports_base_url(provider_info.get('Base_URL', ''))
+    credentials = api_credentials(provider_info)
+    platform = provider_info.get('Platform', '')
+    if platform:
+        report_json_url = f"{base_url[:-1]}?{credentials}&platform={platform}"
+    else:
+        report_json_url = f"{base_url[:-1]}?{credentials}"
+    return report_json_url
 
-            ### *** Here is the actual call to get the report of supported reports #####
-            log_error(f'INFO: {provider_name}: supported reports API URL={report_json_url}')
-            report_json = get_json_data(report_json_url.replace('|', '%7C'), provider_info)
-            ### get_json_data returns a list of dicts if successful  or an integer if unsuccessful
-            #print(f'DEBUG: report_json: {report_json}\nreport_json is class: {type(report_json)}\n')
 
-            if not report_json or isinstance(report_json, int):
-                log_error(f'ERROR: did not get valid json response for this url, {report_json_url}, skipping provider\n')
+def add_report_urls(provider_info, report_json, begin_date, end_date, report_type_list):
+    """
+    Create the URLs for all of the supported reports that the user selected, from the provider's
+    list of supported reports (the /reports API response), into provider_info['Report_URLS'].
+
+    Args:
+        provider_info: provider dict from make_provider_info
+        report_json: what get_json_data returned for supported_reports_url(provider_info)
+        begin_date: Start date in YYYY-MM format
+        end_date: End date in YYYY-MM format
+        report_type_list: List of report types selected by the user in the GUI
+
+    Returns:
+        True if the provider should be harvested, False to skip it
+    """
+    provider_name = member_label(provider_info)  # with the member's Customer_ID for a consortium member
+    platform = provider_info.get('Platform', '')
+    base_url = reports_base_url(provider_info.get('Base_URL', ''))
+    credentials = api_credentials(provider_info)
+    report_json_url = supported_reports_url(provider_info)
+    checked_date = 0
+    b = ''
+    e = ''
+    ### get_json_data returns a list of dicts if successful  or an integer if unsuccessful
+    #print(f'DEBUG: report_json: {report_json}\nreport_json is class: {type(report_json)}\n')
+
+    if not report_json or isinstance(report_json, int):
+        log_error(f'ERROR: did not get valid json response for this url, {report_json_url}, skipping provider\n')
+        return False
+    # Now we can process the list of reports
+    # Loop through the list of reports supported as returned by get_json_data to create all URLs for supported reports
+    #  Need to figure out where custom reports will fit into this           if is_custom_report(provider_info, report_type)
+    if isinstance(report_json, list):  # this must be the supported_reports api response
+        make_report_id_uppercase(report_json) # some providers are sending the report_ids as lower case but we need them upper to compare to "list"
+        # first check if ANY of the supported reports are among the ones the user selected in the GUI
+        report_ids_in_json = {report.get('Report_ID') for report in report_json if 'Report_ID' in report}
+        human_readable_report_list = ",".join(sorted(str(rid) for rid in report_ids_in_json))
+        if report_ids_in_json.isdisjoint(report_type_list):
+            # If there's no overlap, log it (optional) and skip this whole provider.
+            log_error(f"WARNING: Skipping provider {provider_name} as none of its available reports were selected by the user.")
+            return False
+        else:
+            log_error(f'INFO: {provider_name}: supported reports: {human_readable_report_list}')
+        # with derive_standard_views the selected standard views are made from their master's _EX (see derive_reports.py),
+        # so that _EX is needed even if the master report itself was not selected
+        options = provider_options(provider_info)
+        view_masters = {report_id: view_master(report_id, report_ids_in_json, options) for report_id in report_type_list}
+        view_masters = {report_id: master_id for report_id, master_id in view_masters.items() if master_id}
+        wanted_report_ids = set(report_type_list) | set(view_masters.values())
+        for report in report_json:
+            if "Report_ID" not in report:
+                log_error(f"ERROR: No_report_id: a report from {provider_name} does not contain Report_ID\n")
                 continue
-            make_report_id_uppercase(report_json) # some providers are sending the report_ids as lower case but we need them upper to compare to "list"
-            # Now we can process the list of reports
-            # Loop through the list of reports supported as returned by get_json_data to create all URLs for supported reports
-            #  Need to figure out where custom reports will fit into this           if is_custom_report(provider_info, report_type)
-            if isinstance(report_json, list):  # this must be the supported_reports api response
-                # first check if ANY of the supported reports are among the ones the user selected in the GUI
-                report_ids_in_json = {report.get('Report_ID') for report in report_json if 'Report_ID' in report}
-                human_readable_report_list = ",".join(sorted(str(rid) for rid in report_ids_in_json))
-                if report_ids_in_json.isdisjoint(report_type_list):
-                    # If there's no overlap, log it (optional) and skip this whole provider.
-                    log_error(f"WARNING: Skipping provider {provider_name} as none of its available reports were selected by the user.")
-                    continue  # This 'continue' applies to the OUTER loop
-                else:
-                    log_error(f'INFO: {provider_name}: supported reports: {human_readable_report_list}')
-                for report in report_json:
-                    if "Report_ID" not in report:
-                        log_error(f"ERROR: No_report_id: a report from {provider_name} does not contain Report_ID\n")
-                        continue
-                    report_id = report.get('Report_ID')
-                    if report_id not in report_type_list:
-                        continue  # skip to the next report in the list available from this provider that is also in the user_selections vendors list
-                    if platform:  ## this is the providers.tsv platform, NOT the Platform Report meaning of platform
-                        get_report_url_credentials = f'{base_url}{report_id.lower()}?{credentials}&platform={platform}'
-                    else:
-                        get_report_url_credentials = f'{base_url}{report_id.lower()}?{credentials}'
-                    # Determine the overlap between what date range the user asked for, and what is available for this report
-                    first_month = report.get('First_Month_Available', '')
-                    if not validate_date(first_month):
-                        b = begin_date
-                    last_month = report.get('Last_Month_Available', '')
-                    if not validate_date(last_month):
-                        e = end_date
-                    # adjusts and notifies user if user wants too early begin or too late end
-                    if validate_date(first_month) and validate_date(last_month) and not checked_date:
-                        b, e = check_dates(provider_name, report_id, begin_date, end_date, first_month, last_month)
-                        checked_date = 1
-                    if (b > begin_date and not checked_date) and (e < end_date and not checked_date):
-                        log_error(
-                            f"WARNING: Data for {provider_name}:{report_id} will only cover the range {b} - {e}\n")
-                    elif b > begin_date and not checked_date:
-                        log_error(f"WARNING: Data for {provider_name}:{report_id} will not start until {b}\n")
-                    elif e < end_date and not checked_date:
-                        log_error(f"WARNING: Data for {provider_name}:{report_id} only available through {e}\n")
-                    if not validate_date(first_month):
-                        b = begin_date
-                    if not validate_date(last_month):
-                        e = end_date
-                    ### Note that begin and end dates start as yyyy-mm but for the API call, they need to be yyyy-mm-dd
-                    ###  eg begin 2025-01-01 and end 2025-12-31 or whatever is the last valid date in that month, eg 2025-02-28
-                    if (b[:7] != begin_date[:7] or e[:7] != end_date[:7]) and (e >= b):
-                        log_error(f"WARNING: Dates adjusted for {provider_name}'s available range for report: {report_id}: begin: {b[:7]}, end: {e[:7]}")
-                    elif b > e:
-                        log_error(f'WARNING: {provider_name} Available begin date ({b}) is later than requested end date ({e}), skipping {report_id}')
-                        continue
-                    b = get_dd(b, "begin")
-                    e = get_dd(e, "end")
-                    provider_info['Dates'] = f"{b}-{e}"
-                    # Append begin and end dates
-                    ### For the master reports we will get them twice - the primary one will have the default attributes to show,
-                    ### and the "extra" one will have more attributes to show for maximizing the data collection for the database
-                    ### this program will invent its own "standard view" for this: TR_EX, DR_EX, etc.
-
-                    get_report_url_daterange = f"{get_report_url_credentials}&begin_date={b}&end_date={e}"
-                    # Maximize all possible additional data breakdowns using attributes_to_show
-                    extra_report_id = report_id + "_EX"
-                    if report_id == 'IR':
-                        IR_EX_attributes_to_show = "Authors|Publication_Date|Article_Version|YOP|Access_Type|Access_Method"
-                        get_report_url_final_extra = f"{get_report_url_daterange}&attributes_to_show={IR_EX_attributes_to_show}&include_parent_details=True"
-                        get_report_url_final = f"{get_report_url_daterange}"
-                    elif report_id == 'TR':
-                        get_report_url_final = f"{get_report_url_daterange}"
-                        get_report_url_final_extra = f"{get_report_url_daterange}&attributes_to_show=YOP|Access_Method|Access_Type"
-                    elif report_id in {'DR', 'PR'}:
-                        get_report_url_final = f"{get_report_url_daterange}"
-                        get_report_url_final_extra = f"{get_report_url_daterange}&attributes_to_show=Access_Method"
-                    elif report_id not in official_reports:  # most likely a custom report
-                        log_error(
-                            f'INFO: {provider_name} offers a custom report called {report_id} but this harvester does not support those yet.\n')
-                        continue  # go on to the next report for this provider
-                    else:
-                        get_report_url_final = get_report_url_daterange  ### we don't change attributes or filters on standard views
-
-                    # Add the report URL to the provider's entry
-                    provider_info['Report_URLS'][report_id] = get_report_url_final
-                    # Also request the "_EX" versions for the sqlite database
-                    if report_id in ("IR", "TR", "DR", "PR"):
-                        provider_info['Report_URLS'][extra_report_id] = get_report_url_final_extra
-
-                #if skip_provider:
-                #    continue
-                # Store the provider information in the main dictionary
-                data_dict[provider_name] = provider_info  # Add provider_info dict  directly to the data_dict
+            report_id = report.get('Report_ID')
+            if report_id not in wanted_report_ids:
+                continue  # skip to the next report in the list available from this provider that is also in the user_selections vendors list
+            if platform:  ## this is the providers.tsv platform, NOT the Platform Report meaning of platform
+                get_report_url_credentials = f'{base_url}{report_id.lower()}?{credentials}&platform={platform}'
             else:
+                get_report_url_credentials = f'{base_url}{report_id.lower()}?{credentials}'
+            # Determine the overlap between what date range the user asked for, and what is available for this report
+            first_month = report.get('First_Month_Available', '')
+            if not validate_date(first_month):
+                b = begin_date
+            last_month = report.get('Last_Month_Available', '')
+            if not validate_date(last_month):
+                e = end_date
+            # adjusts and notifies user if user wants too early begin or too late end
+            if validate_date(first_month) and validate_date(last_month) and not checked_date:
+                b, e = check_dates(provider_name, report_id, begin_date, end_date, first_month, last_month)
+                checked_date = 1
+            if (b > begin_date and not checked_date) and (e < end_date and not checked_date):
                 log_error(
-                    f'ERROR_INFO: The API response to the url {report_json_url} is not a proper json list\n')
-                if isinstance(report_json, dict):
-                    if ExceptionCode := report_json.get("Code", None):
-                        ErrorText = f'ERROR: A COUNTER Exception code was provided: {ExceptionCode}'
-                        if ExceptionMessage := report_json.get("Message", None):
-                            ErrorText += f'; Message: {ExceptionMessage}'
-                        if ExceptionData := report_json.get("Data", None):
-                            ErrorText += f'; Data: {ExceptionData}'
-                        if ExceptionHelp_URL := report_json.get("Help_URL", None):
-                            ErrorText += f'; Help_URL: {ExceptionHelp_URL}'
-                        log_error(f' this is a test {ErrorText}\n')
+                    f"WARNING: Data for {provider_name}:{report_id} will only cover the range {b} - {e}\n")
+            elif b > begin_date and not checked_date:
+                log_error(f"WARNING: Data for {provider_name}:{report_id} will not start until {b}\n")
+            elif e < end_date and not checked_date:
+                log_error(f"WARNING: Data for {provider_name}:{report_id} only available through {e}\n")
+            if not validate_date(first_month):
+                b = begin_date
+            if not validate_date(last_month):
+                e = end_date
+            ### Note that begin and end dates start as yyyy-mm but for the API call, they need to be yyyy-mm-dd
+            ###  eg begin 2025-01-01 and end 2025-12-31 or whatever is the last valid date in that month, eg 2025-02-28
+            if (b[:7] != begin_date[:7] or e[:7] != end_date[:7]) and (e >= b):
+                log_error(f"WARNING: Dates adjusted for {provider_name}'s available range for report: {report_id}: begin: {b[:7]}, end: {e[:7]}")
+            elif b > e:
+                log_error(f'WARNING: {provider_name} Available begin date ({b}) is later than requested end date ({e}), skipping {report_id}')
+                continue
+            # incremental_harvest: only the months that are not in the database yet (see db_coverage.py)
+            report_months = missing_months(provider_info, report_id, b[:7], e[:7])
+            if not report_months:
+                log_error(f"INFO: {provider_name}: {report_id}: every month from {b[:7]} to {e[:7]} has already been harvested into the database, skipping")
                 continue
-        # these are all raised from get_json_data
-        except requests.exceptions.HTTPError as http_err:
-            print(f"HTTP error occurred for provider '{provider_name}': {http_err}\nSee error log for details")
-            trace_details = traceback.format_exc()
-            log_error(f"ERROR: HTTP error occurred for provider '{provider_name}': {http_err}\n{trace_details}")
-        except requests.exceptions.RequestException as req_err:
-            print(
-                f"Error occurred while requesting data from provider '{provider_name}': {req_err}\nSee error log for details")
-            trace_details = traceback.format_exc()
-            log_error(
-                f"ERROR: Error occurred while requesting data from provider '{provider_name}': {req_err}\n{trace_details}")
-        except Exception as e:
-            trace_details = traceback.format_exc()
-            log_error(
-                f"ERROR: Unexpected error occurred for {provider_name}: {type(e).__name__}: {str(e)}\n{trace_details}")
-    if len(data_dict) > 0:
-        # log_error(f'DEBUG in fj looking for report header: {data_dict}\n')
-        return data_dict
+            if report_months != (b[:7], e[:7]):
+                log_error(f"INFO: {provider_name}: {report_id}: asking only for the months not harvested yet: {report_months[0]} to {report_months[1]}")
+            report_begin = get_dd(report_months[0], "begin")
+            report_end = get_dd(report_months[1], "end")
+            provider_info['Report_Dates'][report_id] = f"{report_begin}-{report_end}"  # each report's own months name its files
+            # Append begin and end dates
+            ### For the master reports we will get them twice - the primary one will have the default attributes to show,
+            ### and the "extra" one will have more attributes to show for maximizing the data collection for the database
+            ### this program will invent its own "standard view" for this: TR_EX, DR_EX, etc.
+
+            get_report_url_daterange = f"{get_report_url_credentials}&begin_date={report_begin}&end_date={report_end}"
+            # Maximize all possible additional data breakdowns using attributes_to_show
+            extra_report_id = report_id + "_EX"
+            if report_id == 'IR':
+                get_report_url_final_extra = f"{get_report_url_daterange}&attributes_to_show={EX_ATTRIBUTES_TO_SHOW['IR']}&include_parent_details=True"
+                get_report_url_final = f"{get_report_url_daterange}"
+            elif report_id == 'TR':
+                get_report_url_final = f"{get_report_url_daterange}"
+                get_report_url_final_extra = f"{get_report_url_daterange}&attributes_to_show={EX_ATTRIBUTES_TO_SHOW['TR']}"
+            elif report_id in {'DR', 'PR'}:
+                get_report_url_final = f"{get_report_url_daterange}"
+                get_report_url_final_extra = f"{get_report_url_daterange}&attributes_to_show={EX_ATTRIBUTES_TO_SHOW[report_id]}"
+            elif report_id not in official_reports:  # most likely a custom report
+                log_error(
+                    f'INFO: {provider_name} offers a custom report called {report_id} but this harvester does not support those yet.\n')
+                continue  # go on to the next report for this provider
+            else:
+                get_report_url_final = get_report_url_daterange  ### we don't change attributes or filters on standard views
+
+            # Add the report URL to the provider's entry, or with derive_master_reports / derive_standard_views
+            # the report is made from the _EX instead (see derive_reports.py)
+            if report_id not in report_type_list:
+                pass  # a master report only needed for the _EX its standard views are made from
+            elif derive_master_from_ex(report_id, options) or report_id in view_masters:
+                provider_info['Derived_URLS'][report_id] = get_report_url_final
+            else:
+                provider_info['Report_URLS'][report_id] = get_report_url_final
+            # Also request the "_EX" versions for the sqlite database
+            if report_id in ("IR", "TR", "DR", "PR"):
+                provider_info['Report_URLS'][extra_report_id] = get_report_url_final_extra
+                provider_info['Report_Dates'][extra_report_id] = provider_info['Report_Dates'][report_id]
+        # a derived report has the months of the _EX it is made from
+        for derived_id in provider_info['Derived_URLS']:
+            master_id = view_masters.get(derived_id, derived_id)
+            if master_id + '_EX' in provider_info['Report_Dates']:
+                provider_info['Report_Dates'][derived_id] = provider_info['Report_Dates'][master_id + '_EX']
+        return True
     else:
+        log_error(
+            f'ERROR_INFO: The API response to the url {report_json_url} is not a proper json list\n')
+        if isinstance(report_json, dict):
+            if ExceptionCode := report_json.get("Code", None):
+                ErrorText = f'ERROR: A COUNTER Exception code was provided: {ExceptionCode}'
+                if ExceptionMessage := report_json.get("Message", None):
+                    ErrorText += f'; Message: {ExceptionMessage}'
+                if ExceptionData := report_json.get("Data", None):
+                    ErrorText += f'; Data: {ExceptionData}'
+                if ExceptionHelp_URL := report_json.get("Help_URL", None):
+                    ErrorText += f'; Help_URL: {ExceptionHelp_URL}'
+                log_error(f' this is a test {ErrorText}\n')
+        return False
+
+
+def add_member_urls(provider_info, report_json, begin_date, end_date, report_type_list):
+    """
+    Create each consortium member's report URLs from the one list of supported reports, into
+    provider_info['Member_Infos'] (a provider_info per member, see consortium.py).
+
+    Returns:
+        provider_info, or None if none of the members has anything to harvest
+    """
+    member_infos = []
+    for customer_id in provider_info['Members']:
+        member_info = make_member_info(provider_info, customer_id)
+        if add_report_urls(member_info, report_json, begin_date, end_date, report_type_list):
+            member_infos.append(member_info)
+    if not member_infos:
+        return None
+    log_error(f"INFO: {provider_info['Name']}: harvesting {len(member_infos)} consortium members: {', '.join(info['Member'] for info in member_infos)}")
+    provider_info['Member_Infos'] = member_infos
+    return provider_info
+
+
+def discover_provider(provider, begin_date, end_date, report_type_list, options=None):
+    """
+    Get one provider's list of supported reports and work out the report URLs to download.
+
+    Args:
+        provider: One provider dictionary from load_providers
+        begin_date: Start date in YYYY-MM format
+        end_date: End date in YYYY-MM format
+        report_type_list: List of report types selected by the user in the GUI
+        options: the RunOptions of the run
+
+    Returns:
+        provider_info dict with its Report_URLS, or None if the provider has nothing to harvest or failed
+    """
+    provider_info = make_provider_info(provider, end_date, options)
+    if not provider_info:
         return None
+    provider_name = provider_info['Name']
+
+    try:  ### first we're going to get the list of supported reports
+        report_json_url = supported_reports_url(provider_info)
+        ### *** Here is the actual call to get the report of supported reports #####
+        log_error(f'INFO: {provider_name}: supported reports API URL={report_json_url}')
+        report_json = cached_reports(provider_info)  # the list from an earlier run, if it is recent enough
+        if report_json is None:
+            report_json = get_json_data(report_json_url.replace('|', '%7C'), provider_info)
+            store_reports(provider_info, report_json)
+        else:
+            log_error(f'INFO: {provider_name}: using the saved list of supported reports')
+        if provider_info['Members']:
+            return add_member_urls(provider_info, report_json, begin_date, end_date, report_type_list)
+        if add_report_urls(provider_info, report_json, begin_date, end_date, report_type_list):
+            return provider_info
+    # these are all raised from get_json_data
+    except requests.exceptions.HTTPError as http_err:
+        print(f"HTTP error occurred for provider '{provider_name}': {http_err}\nSee error log for details")
+        trace_details = traceback.format_exc()
+        log_error(f"ERROR: HTTP error occurred for provider '{provider_name}': {http_err}\n{trace_details}")
+    except requests.exceptions.RequestException as req_err:
+        print(
+            f"Error occurred while requesting data from provider '{provider_name}': {req_err}\nSee error log for details")
+        trace_details = traceback.format_exc()
+        log_error(
+            f"ERROR: Error occurred while requesting data from provider '{provider_name}': {req_err}\n{trace_details}")
+    except Exception as e:
+        trace_details = traceback.format_exc()
+        log_error(
+            f"ERROR: Unexpected error occurred for {provider_name}: {type(e).__name__}: {str(e)}\n{trace_details}")
+    return None
+
+
+def discover_providers(providers, begin_date, end_date, report_type_list, options, is_cancelled_callback=None):
+    """
+    Discover several providers at once, handing each one back as soon as its discovery is done,
+    so its reports can start downloading while the slower providers are still being asked.
+
+    Args:
+        providers: List of provider dictionaries from load_providers, in the order to ask them
+        begin_date: Start date in YYYY-MM format
+        end_date: End date in YYYY-MM format
+        report_type_list: List of report types selected by the user in the GUI
+        options: the RunOptions of the run; discovery_workers providers are asked at once
+        is_cancelled_callback: function that returns True if the user cancelled
+
+    Yields:
+        (provider_name, provider_info) for each provider that has reports to harvest, in the order they finish
+    """
+    if not report_type_list:
+        print("You did not select any report types.\n")
+        return
+    executor = ThreadPoolExecutor(max_workers=options.discovery_workers)
+    try:
+        futures = [executor.submit(discover_provider, provider, begin_date, end_date, report_type_list, options)
+                   for provider in providers]
+        for future in as_completed(futures):
+            if is_cancelled_callback and is_cancelled_callback():
+                break
+            provider_info = future.result()  # discover_provider logs its own errors
+            if provider_info:
+                yield provider_info['Name'], provider_info
+    finally:
+        # on cancel (or if the caller stops early) the providers not started yet are not asked at all
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def fetch_json(providers, begin_date, end_date, report_type_list, is_cancelled_callback=None, options=None):
+    """
+    Fetch provider API information with given parameters.
+
+    Args:
+        providers: List of provider dictionaries from load_providers
+        begin_date: Start date in YYYY-MM format
+        end_date: End date in YYYY-MM format
+        report_type_list: List of report types selected by the user in the GUI
+        is_cancelled_callback: function that returns True if the user cancelled
+        options: the RunOptions of the run (the defaults if not given)
+
+    Returns:
+        Dictionary of provider name -> provider_info, or None if no provider has reports to harvest
+    """
+    # the same discovery run_harvester uses (discover_providers), gathered into one dictionary
+    data_dict = dict(discover_providers(providers, begin_date, end_date, report_type_list,
+                                        options or DEFAULT_OPTIONS, is_cancelled_callback))
+    return data_dict or None
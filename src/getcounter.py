@@ -1,12 +1,32 @@
 import sqlite3
+import time
 import traceback
+from contextlib import closing
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
 from logger import log_error, set_progress_callback
 from create_tables import create_data_table
 from load_providers import load_providers
-from fetch_json import fetch_json
+from fetch_json import discover_providers, REPORT_QUEUED
 from process_item_details import process_item_details
+from deferred_queue import DeferredQueue
+from http_session import close_sessions, set_max_per_host
+from run_options import run_options, DEFAULT_OPTIONS
+from rate_limiter import reset_rate_limiters
+from compression import reset_transfer_stats, log_transfer_stats
+from backoff import reset_retry_budget
+from circuit_breaker import load_provider_health, save_provider_health, allow_request
+from harvest_history import load_harvest_history, record_report, longest_first, save_harvest_history
+from reports_cache import load_reports_cache, save_reports_cache
+from db_coverage import load_coverage
+from stream_json import cleanup_downloads
+from report_pipeline import finish_pipeline
+from cancellation import begin_cancellation, end_cancellation, cancelled, cancellable_sleep
+from consortium import member_label
+from cassette import start_cassette, close_cassette
+from telemetry import start_telemetry, log_telemetry_summary
+from async_harvest import run_async_harvest, async_engine_available
 
 # Import VendorRepository to find the providers file the same way GUI does
 import sys
@@ -19,8 +39,18 @@ from core.repositories import VendorRepository, ConfigRepository
 from logger import set_error_log_file
 
 
+def initialize_database(sqlite_filename):
+    """Create the report tables in the sqlite database if they are not there yet."""
+    conn = sqlite3.connect(sqlite_filename)
+    cursor = conn.cursor()
+    create_data_table(cursor)
+    #create_data_table(cursor, data_table)  # Pass data_table from config-Daniel
+    conn.commit()
+    conn.close()
+
+
 def run_harvester(begin_date, end_date, selected_vendors, selected_reports, config_dict,
-                  progress_callback=None, is_cancelled_callback=None):
+                  progress_callback=None, is_cancelled_callback=None, cancel_token=None):
     """
     Run the COUNTER harvester with given parameters.
 
@@ -32,6 +62,8 @@ def run_harvester(begin_date, end_date, selected_vendors, selected_reports, conf
         config_dict: Settings (where to save files, database name, etc.)
         progress_callback: function to call with progress messages
         is_cancelled_callback:  function that returns True if user cancelled
+        cancel_token: cancellation.CancelToken the caller cancels to stop the run within seconds;
+            without one the run follows is_cancelled_callback
 
     Returns:
         Dictionary with results
@@ -45,6 +77,8 @@ def run_harvester(begin_date, end_date, selected_vendors, selected_reports, conf
 
     defaults = ConfigRepository()._get_defaults()
     config = {**defaults, **config_dict}  # Merge: defaults + user settings
+    # the files kept between runs go in state_dir, which is next to current_config.py unless it is an absolute path
+    config['state_dir'] = str(ConfigRepository().config_file.parent / (config.get('state_dir') or 'harvester_state'))
 
     # Extract config values (all keys guaranteed to exist)-Daniel
     sqlite_filename = config['sqlite_filename']
@@ -62,6 +96,9 @@ def run_harvester(begin_date, end_date, selected_vendors, selected_reports, conf
     # Set the callback for logger to use
     set_progress_callback(progress_callback)
 
+    # Stop cuts short the waits and downloads in progress, see cancellation.py
+    begin_cancellation(cancel_token, is_cancelled_callback)
+    options = DEFAULT_OPTIONS  # the run's options are read below, once the log has been cleared
 
     def log(msg):
         """Send message to callback or print."""
@@ -72,9 +109,7 @@ def run_harvester(begin_date, end_date, selected_vendors, selected_reports, conf
 
     def is_cancelled():
         """Checks if operation was cancelled."""
-        if is_cancelled_callback:
-            return is_cancelled_callback()
-        return False
+        return cancelled()
 
     # Initialize results
     results = {
@@ -86,6 +121,26 @@ def run_harvester(begin_date, end_date, selected_vendors, selected_reports, conf
         open(error_log_file, 'w', encoding="utf-8").close()
         current_time = datetime.now()
         log_error(f'INFO: Start of harvester run: {current_time}, user selected begin_date: {begin_date}, end_date: {end_date}\n')
+        # after clearing the log, so a problem with an option or a state file shows up in it;
+        # the other modules get the options through provider_info['Options'], see run_options.py
+        options = run_options(config, begin_date, end_date)
+        max_workers = options.max_workers
+        max_per_host = options.max_requests_per_host
+        harvest_engine = options.harvest_engine
+        if harvest_engine == 'asyncio' and not async_engine_available():
+            log_error("WARNING: harvest_engine = asyncio needs the aiohttp package (pip install aiohttp), using the threaded engine instead")
+            harvest_engine = 'threads'
+        # Limit how many requests can be open at once against the same provider host
+        set_max_per_host(max_per_host)
+        reset_rate_limiters()
+        reset_transfer_stats()
+        start_telemetry(options)
+        reset_retry_budget(options)
+        load_provider_health(options)
+        load_harvest_history(options)
+        load_reports_cache(options)
+        load_coverage(options)
+        start_cassette(options)
 
         # Find the full path to the providers file using same logic as GUI-Daniel
         vendor_repo = VendorRepository(providers_file=providers_file)
@@ -137,46 +192,93 @@ def run_harvester(begin_date, end_date, selected_vendors, selected_reports, conf
         if is_cancelled():
             return results
 
-        # Fetch provider API information -start and end dates, filtered to only report types selected by user in the GUI
-        providers_dict = fetch_json(providers, begin_date, end_date, selected_reports, is_cancelled_callback)
-
-        if not providers_dict:
-            error_msg = "Failed to fetch provider information from API or no providers are within your selected date range"
-            log(f"ERROR: {error_msg}")
-            results['errors'].append(error_msg)
-            return results
-
-        if is_cancelled():
+        if harvest_engine == 'asyncio':
+            # The asyncio engine does the discovery and the downloads together, so the database has to be ready first
+            initialize_database(sqlite_filename)
+            run_async_harvest(providers, begin_date, end_date, selected_reports, config, options, log, is_cancelled, results)
+            results['errors'].extend(finish_pipeline())
+            log(f"Finished")
+            log(f"Check {error_log_file} for problems/reports that failed/exceptions")
             return results
 
-        # Initialize database
-        conn = sqlite3.connect(sqlite_filename)
-        cursor = conn.cursor()
-        create_data_table(cursor)
-        #create_data_table(cursor, data_table)  # Pass data_table from config-Daniel
-        conn.commit()
-        conn.close()
+        # Initialize database, before the discovery, as the first providers' reports are downloaded while the
+        # other providers are still being asked for their lists of supported reports
+        initialize_database(sqlite_filename)
 
         if is_cancelled():
             return results
 
-        # Process each provider's reports
-        for provider_name, provider_info in providers_dict.items():
+        # Reports the provider answered with 202 "queued" are parked here and asked for again later
+        deferred = DeferredQueue(options)
+
+        def retrieve_report(provider_name, provider_info, report_id, report_url):
+            started = time.monotonic()
+            if process_item_details(provider_info, report_id, report_url, config, defer_queued=True) == REPORT_QUEUED:
+                item = deferred.park(provider_info, report_id, report_url)
+                log_error(f"INFO: {provider_name}: {report_id.upper()} is queued by the provider, asking again in {item.wait:.0f} seconds")
+            else:
+                record_report(provider_info['Name'], report_id, report_url, time.monotonic() - started)
+
+        def poll_deferred():
+            # Ask again for every parked report that is due, re-parking the ones that are still queued
+            for item in deferred.take_due():
+                if is_cancelled():
+                    return
+                provider_name = member_label(item.provider_info)
+                log_error(f"INFO: Retrieving queued report: {provider_name}: {item.report_id.upper()}: {item.url}")
+                try:
+                    started = time.monotonic()
+                    if process_item_details(item.provider_info, item.report_id, item.url, config, defer_queued=True) != REPORT_QUEUED:
+                        record_report(item.provider_info['Name'], item.report_id, item.url, time.monotonic() - started)
+                        continue
+                    if not deferred.repark(item):
+                        error_msg = f"{provider_name}: {item.report_id.upper()} was still queued by the provider after {item.minutes_waited():.1f} minutes, try this one again later"
+                        log_error(f"ERROR: {error_msg}:\n   {item.url}")
+                        results['errors'].append(error_msg)
+                except Exception as e:
+                    error_msg = f"Error processing {provider_name}:{item.report_id}: {str(e)}"
+                    log_error(f"ERROR: {error_msg}\n{traceback.format_exc()}")
+                    results['errors'].append(error_msg)
+
+        def harvest_provider(provider_name, provider_info):
+            """Retrieve and process every report URL for one provider, or for each member of a consortium."""
+            members = provider_info.get('Member_Infos')
+            if not members:
+                harvest_reports(provider_name, provider_info)
+                return
+            # the members share the platform, so as many of them run at once as it takes requests (see consortium.py)
+            with ThreadPoolExecutor(max_workers=min(len(members), max_per_host)) as member_pool:
+                futures = {member_pool.submit(harvest_reports, member_label(member_info), member_info): member_label(member_info)
+                           for member_info in members}
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except Exception as e:
+                        # one member failing must not stop the others
+                        error_msg = f"Error processing {futures[future]}: {str(e)}"
+                        log_error(f"ERROR: {error_msg}\n{traceback.format_exc()}")
+                        results['errors'].append(error_msg)
+
+        def harvest_reports(provider_name, provider_info):
+            """Retrieve and process every report URL in one provider_info."""
             if is_cancelled(): #Check #1, before starting a provider
-                break
+                return
             current_timestamp = datetime.now()
             formatted_time = current_timestamp.strftime("%M:%S")
             report_urls = provider_info.get('Report_URLS', {})
             if not report_urls:
                 log_error(f'WARNING: no reports for provider: {provider_name} met your criteria for retrieval\n')
-                continue
+                return
             log_error(f"\nINFO: {formatted_time}: {provider_name}\n")
             log(f"Retrieving reports: {provider_name}") # do this line for pause..instead of retrieve ..use completed
 
             for report_id, report_url in report_urls.items():
+                poll_deferred()  # queued reports that are due go first
+                if not allow_request(provider_info):  # logs once that the rest of this provider is skipped
+                    break
                 log_error(f"INFO: Retrieving : {provider_name}: {report_id.upper()}: {report_url}")
                 try:
-                    process_item_details(provider_info, report_id, report_url,config) #Pass config dict-Daniel
+                    retrieve_report(provider_name, provider_info, report_id, report_url) #Pass config dict-Daniel
                     if is_cancelled():
                         log(f"Completed {provider_name}: {report_id.upper()}")
                         break
@@ -187,6 +289,54 @@ def run_harvester(begin_date, end_date, selected_vendors, selected_reports, conf
                     log_error(f"ERROR: {error_msg}\n{traceback.format_exc()}")
                     results['errors'].append(error_msg)
 
+        # Ask the providers for their supported reports several at a time (fetch_json.discover_providers), and start
+        # downloading each provider's reports as soon as its discovery is done instead of waiting for the slowest one.
+        # The providers that took longest in earlier runs are asked first, so they don't become the tail of the run
+        ordered = longest_first(providers, selected_reports, options)
+        log_error(f'INFO: asking up to {options.discovery_workers} providers at a time for their supported reports')
+        log_error(f'INFO: provider order: {", ".join(str(provider.get("Name")) for provider in ordered)}')
+        discovered = []  # names of the providers that have reports to harvest
+        with closing(discover_providers(ordered, begin_date, end_date, selected_reports, options, is_cancelled)) as providers_found:
+            # Process each provider's reports, either one provider at a time or several at once in a worker pool
+            if max_workers > 1 and len(providers) > 1:
+                log_error(f'INFO: harvesting up to {max_workers} providers at a time, at most {max_per_host} request(s) in flight per host')
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {}
+                    for provider_name, provider_info in providers_found:
+                        discovered.append(provider_name)
+                        futures[executor.submit(harvest_provider, provider_name, provider_info)] = provider_name
+                    for future in as_completed(futures):
+                        try:
+                            future.result()
+                        except Exception as e:
+                            # one provider failing must not stop the others
+                            error_msg = f"Error processing {futures[future]}: {str(e)}"
+                            log_error(f"ERROR: {error_msg}\n{traceback.format_exc()}")
+                            results['errors'].append(error_msg)
+            else:
+                for provider_name, provider_info in providers_found:
+                    if is_cancelled():
+                        break
+                    discovered.append(provider_name)
+                    harvest_provider(provider_name, provider_info)
+
+        if not discovered:
+            if is_cancelled():
+                return results
+            error_msg = "Failed to fetch provider information from API or no providers are within your selected date range"
+            log(f"ERROR: {error_msg}")
+            results['errors'].append(error_msg)
+            return results
+
+        # Everything else is done, wait for the reports that are still queued (checking for cancel every second)
+        if len(deferred) and not is_cancelled():
+            log(f"Waiting for {len(deferred)} report(s) queued by the provider")
+        while len(deferred) and not is_cancelled():
+            cancellable_sleep(min(1.0, deferred.seconds_until_next()))
+            poll_deferred()
+        # and for the reports still being saved, converted and loaded into the database (see report_pipeline.py)
+        results['errors'].extend(finish_pipeline())
+
         log(f"Finished")
         log(f"Check {error_log_file} for problems/reports that failed/exceptions")
 
@@ -195,5 +345,20 @@ def run_harvester(begin_date, end_date, selected_vendors, selected_reports, conf
         log(f"ERROR: {error_msg}")
         log_error(f"ERROR: {error_msg}\n{traceback.format_exc()}")
         results['errors'].append(error_msg)
+    finally:
+        # Let the reports already downloaded finish going into the json archive, tsvs and database
+        finish_pipeline()
+        # Release the kept-alive connections to every provider host used in this run
+        close_sessions()
+        # Remember which providers were down, for the next run
+        save_provider_health(options)
+        save_harvest_history(options)
+        save_reports_cache(options)
+        cleanup_downloads(options)
+        close_cassette()
+        log_transfer_stats()
+        # Where each provider's time went: waiting for the first byte or reading the body, see telemetry.py
+        results['network'] = log_telemetry_summary()
+        end_cancellation()
 
     return results
@@ -0,0 +1,182 @@
+# harvest_history.py : how long each provider's reports took in earlier runs, and how big they were, per month of data
+### (kept in harvest_history_file), so the slowest providers can be started first
+
+import json
+import threading
+from datetime import datetime
+from logger import log_error
+from consortium import member_ids
+from report_merge import request_dates
+from run_options import months_between
+
+# Global variables
+_history = {}  # provider name -> report id -> {'seconds_per_month', 'bytes_per_month', 'runs', 'last_run', 'first_byte_seconds', 'first_byte_max'}
+_responses = {}  # url -> [size of its API response, months of data it asked for] in this run
+_history_lock = threading.Lock()
+
+WEIGHT_OF_LATEST = 0.5  # how much the latest run counts in the averages, so the history follows providers that grow
+FIRST_BYTE_MAX_DECAY = 0.9  # each new request shrinks the longest first byte wait remembered, so one slow day is forgotten
+
+
+def load_harvest_history(options):
+    """Load the history saved by earlier runs (called by run_harvester)."""
+    global _history
+    with _history_lock:
+        _history = {}
+        _responses.clear()
+    if not options.harvest_history_file:
+        return
+    try:
+        with open(options.harvest_history_file, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        log_error(f"WARNING: could not read {options.harvest_history_file}, starting with no harvest history: {e}")
+        return
+    if isinstance(saved, dict):
+        with _history_lock:
+            _history = saved
+
+
+def url_months(url):
+    """Months of data a report url asks for (1 for a url without dates, eg the list of supported reports)."""
+    begin_date, end_date = request_dates(url)
+    return months_between(begin_date, end_date) if begin_date else 1
+
+
+def note_response_bytes(url, size):
+    """Remember how big the API response for this url was, and how many months it asked for, for record_report."""
+    with _history_lock:
+        _responses[url] = [size, url_months(url)]
+
+
+def note_archived(url):
+    """Note that every month of this report url came from the json archive (see month_cache.py), so nothing was asked for."""
+    with _history_lock:
+        _responses[url] = [0, 0]
+
+
+def move_response_bytes(from_url, to_url):
+    """Count the response for from_url (eg one chunk of a report) as part of to_url (the whole report)."""
+    if from_url == to_url:
+        return
+    with _history_lock:
+        moved = _responses.pop(from_url, None)
+        if moved:
+            response = _responses.setdefault(to_url, [0, 0])
+            response[0] += moved[0]
+            response[1] += moved[1]
+
+
+def expected_bytes_per_month(provider_name, report_id):
+    """Average response size per month of data for this provider's report in earlier runs, or None."""
+    with _history_lock:
+        entry = _history.get(provider_name, {}).get(report_id)
+        if not entry or not entry.get('bytes_per_month'):
+            return None
+        return entry['bytes_per_month']
+
+
+def record_report(provider_name, report_id, url, seconds):
+    """
+    Add one finished report to the history, per month of data actually asked for: a chunked, archived or
+    incremental report may have asked the provider for fewer months than the run's dates.
+    """
+    with _history_lock:
+        # no response noted means the request failed, which still took its time for every month it asked for
+        size, months = _responses.pop(url, None) or (0, url_months(url))
+        if not months:
+            return  # answered from the json archive, the provider was not asked
+        entry = _history.setdefault(provider_name, {}).setdefault(report_id, {})
+        seconds_per_month = seconds / months
+        bytes_per_month = size / months
+        if 'seconds_per_month' in entry:
+            entry['seconds_per_month'] = (1 - WEIGHT_OF_LATEST) * entry['seconds_per_month'] + WEIGHT_OF_LATEST * seconds_per_month
+            entry['bytes_per_month'] = (1 - WEIGHT_OF_LATEST) * entry.get('bytes_per_month', 0) + WEIGHT_OF_LATEST * bytes_per_month
+            entry['runs'] = entry.get('runs', 0) + 1
+        else:  # new, or so far only its first byte is known
+            entry.update({'seconds_per_month': seconds_per_month, 'bytes_per_month': bytes_per_month, 'runs': 1})
+        entry['last_run'] = datetime.now().isoformat(timespec='seconds')
+
+
+def record_first_byte(provider_name, report_id, seconds):
+    """
+    Add how long the provider took to start answering a request for report_id ('reports' for the list of
+    supported reports) to the history, for timeouts.py: the average, and the longest, which slowly forgets.
+    """
+    with _history_lock:
+        entry = _history.setdefault(provider_name, {}).setdefault(report_id, {})
+        if 'first_byte_seconds' in entry:
+            entry['first_byte_seconds'] = (1 - WEIGHT_OF_LATEST) * entry['first_byte_seconds'] + WEIGHT_OF_LATEST * seconds
+            entry['first_byte_max'] = max(seconds, entry.get('first_byte_max', 0) * FIRST_BYTE_MAX_DECAY)
+        else:
+            entry['first_byte_seconds'] = seconds
+            entry['first_byte_max'] = seconds
+
+
+def expected_first_byte(provider_name, report_id):
+    """
+    How long the provider took to start answering requests for report_id in earlier runs.
+
+    Returns:
+        (average seconds, longest seconds), or None if it is not known
+    """
+    with _history_lock:
+        entry = _history.get(provider_name, {}).get(report_id)
+        if not entry or 'first_byte_seconds' not in entry:
+            return None
+        return entry['first_byte_seconds'], entry.get('first_byte_max', entry['first_byte_seconds'])
+
+
+def expected_seconds(provider_name, report_ids, months):
+    """
+    How long the provider is expected to take for these reports, for months of data.
+
+    Returns:
+        seconds, or None if the provider has no history yet
+    """
+    with _history_lock:
+        reports = _history.get(provider_name)
+        if not reports:
+            return None
+        known = [entry['seconds_per_month'] for entry in reports.values() if 'seconds_per_month' in entry]
+        if not known:
+            return None
+        typical = sum(known) / len(known)
+        # a report this provider has not been asked for before is guessed from its other reports
+        return sum(reports.get(report_id, {}).get('seconds_per_month', typical) for report_id in report_ids) * months
+
+
+def longest_first(providers, report_ids, options):
+    """
+    Order the providers longest expected harvest of these reports first.
+    Providers with no history go first, as they could be any size; otherwise the order is kept.
+
+    Args:
+        providers: List of provider dictionaries from load_providers
+        report_ids: the report types selected for this run
+        options: the RunOptions of the run
+
+    Returns:
+        list of the provider dictionaries
+    """
+    def sort_key(provider):
+        expected = expected_seconds(provider.get('Name'), report_ids, options.months)
+        # the history is per report, and a consortium harvests each report once for every member
+        members = max(1, len(member_ids(provider.get('Customer_ID'))))
+        return (0, 0) if expected is None else (1, -expected * members)
+    return sorted(providers, key=sort_key)
+
+
+def save_harvest_history(options):
+    """Write the history to harvest_history_file for the next run."""
+    if not options.harvest_history_file:
+        return
+    with _history_lock:
+        saved = json.dumps(_history, indent=2)
+    try:
+        with open(options.harvest_history_file, 'w', encoding='utf-8') as f:
+            f.write(saved)
+    except OSError as e:
+        log_error(f"WARNING: could not save the harvest history to {options.harvest_history_file}: {e}")
@@ -0,0 +1,175 @@
+# http_session.py : pooled HTTP sessions for the COUNTER API calls, one requests.Session per Base_URL host
+### for one run_harvester run; a body that breaks off is read on from where it stopped (ResumableBody)
+
+import socket
+import threading
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ReadTimeoutError, ProtocolError
+from cancellation import check_cancelled, WATCH_INTERVAL
+
+# Global variables
+_sessions = {}  # host -> requests.Session
+_sessions_lock = threading.Lock()
+_host_slots = {}  # host -> BoundedSemaphore limiting the requests in flight to that host
+_max_per_host = 1
+
+
+def session_key(url):
+    """Return the host part of a url, which is what the sessions are keyed on."""
+    return urlsplit(url).netloc.lower()
+
+
+def get_session(url):
+    """
+    Get the shared session for the host of this url, creating it on first use.
+
+    Args:
+        url: Any COUNTER API url (the /reports listing or a report url) for the provider
+
+    Returns:
+        requests.Session that keeps its connections alive for the rest of the run
+    """
+    host = session_key(url)
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            # keep one connection alive for each request that may be in flight to the host (max_requests_per_host)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=_max_per_host)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[host] = session
+    return session
+
+
+def set_max_per_host(max_per_host):
+    """Set how many requests may be in flight to one host at a time (config max_requests_per_host)."""
+    global _max_per_host
+    with _sessions_lock:
+        _max_per_host = max(1, int(max_per_host))
+        _host_slots.clear()
+
+
+@contextmanager
+def host_slot(url):
+    """
+    Hold one of the in-flight request slots for the host of this url while the request runs.
+    When providers are harvested in parallel this keeps us from opening several requests at once
+    against the same server, which most COUNTER servers treat as abuse.
+    """
+    host = session_key(url)
+    with _sessions_lock:
+        slot = _host_slots.get(host)
+        if slot is None:
+            slot = threading.BoundedSemaphore(_max_per_host)
+            _host_slots[host] = slot
+    while not slot.acquire(timeout=WATCH_INTERVAL):
+        check_cancelled()  # don't wait for a slot on a run that has been stopped
+    try:
+        yield
+    finally:
+        slot.release()
+
+
+def wire_chunks(response, chunk_size=1024 * 1024):
+    """
+    Read the body of a stream=True response as it came over the wire, still compressed (see compression.py).
+    Read errors are raised as the same requests exceptions response.content would raise.
+    Stops with cancellation.HarvestCancelled if the run is stopped (see abort_response).
+    """
+    try:
+        for chunk in response.raw.stream(chunk_size, decode_content=False):
+            check_cancelled()
+            yield chunk
+    except ReadTimeoutError as e:
+        check_cancelled()  # the read was cut short by abort_response
+        raise requests.exceptions.ConnectionError(e)
+    except ProtocolError as e:
+        check_cancelled()
+        raise requests.exceptions.ChunkedEncodingError(e)
+    check_cancelled()  # a body cut short without an error is not the whole body
+
+
+class BodyBroken(requests.exceptions.RequestException):
+    """The provider started sending its answer but the body broke off, and could not be read on from where it stopped."""
+
+
+class ResumableBody:
+    """
+    The body of a stream=True response, read as it came over the wire (see wire_chunks).
+    A big report that was arriving normally is not started again from scratch when the connection drops:
+    if the provider said it takes byte ranges (Accept-Ranges: bytes), the rest is asked for with an HTTP Range
+    request, up to MAX_RESUMES times. Otherwise BodyBroken is raised, so the report is retried as a whole.
+    """
+
+    MAX_RESUMES = 3
+
+    def __init__(self, response, url, headers, timeout):
+        self.response = response
+        self.headers = response.headers
+        self.url = url
+        self.request_headers = headers
+        self.timeout = timeout
+        self.resumes = 0
+
+    def chunks(self, chunk_size=1024 * 1024):
+        received = 0
+        while True:
+            try:
+                for chunk in wire_chunks(self.response, chunk_size):
+                    received += len(chunk)
+                    yield chunk
+                return
+            except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+                if not self._resume(received):
+                    raise BodyBroken(f"the answer broke off after {received} bytes: {e}") from e
+
+    def _resume(self, received):
+        # ask for the rest of the body, from byte received on; False if the provider cannot send just that
+        if not received or self.resumes >= self.MAX_RESUMES or self.headers.get('Accept-Ranges', '').lower() != 'bytes':
+            return False
+        self.resumes += 1
+        headers = dict(self.request_headers, Range=f'bytes={received}-')
+        validator = self.headers.get('ETag') or self.headers.get('Last-Modified')
+        if validator:
+            headers['If-Range'] = validator  # a report that has changed meanwhile is sent whole (200), and not used
+        try:
+            response = get_session(self.url).get(self.url, headers=headers, timeout=self.timeout, stream=True)
+        except requests.exceptions.RequestException:
+            return False
+        if response.status_code != 206 or not response.headers.get('Content-Range', '').startswith(f'bytes {received}-'):
+            response.close()
+            return False
+        self.response.close()
+        self.response = response
+        return True
+
+    def abort(self):
+        """Shut down the connection the body is being read from (see abort_response)."""
+        abort_response(self.response)
+
+
+def abort_response(response):
+    """Shut down the connection a stream=True response is read from, so a read waiting on it in another thread ends at once."""
+    connection = getattr(response.raw, 'connection', None)
+    sock = getattr(connection, 'sock', None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # already closed
+
+
+def close_sessions():
+    """Close every pooled session, called at the end of a harvester run."""
+    with _sessions_lock:
+        for session in _sessions.values():
+            try:
+                session.close()
+            except Exception:
+                pass
+        _sessions.clear()
+        _host_slots.clear()
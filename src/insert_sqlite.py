@@ -29,6 +29,8 @@ def generate_unique_hash(data_dict, data_columns):
         if column in  ["Data_ID", "Row_Hash", "Metric_Usage"]:# exclude these from hash because they will prevent replacing data that needs to be replaced
             continue
         value = data_dict.get(column)
+        if column == "Customer_ID" and value is None:
+            continue  # only a consortium member's rows have one, and the other rows must keep the hash they always had
         # Special handling for None/NULL values
         if value is None:
             values.append("__NULL__" + column)
@@ -1,7 +1,9 @@
 # logger.py
+import threading
 
 # Global variables
 _progress_callback = None
+_log_lock = threading.Lock()  # providers can be harvested in parallel threads, keep their log lines whole
 _error_log_file = 'infolog.txt'  # Default value
 
 
@@ -24,8 +26,9 @@ def set_progress_callback(callback):
 
 def log_error(message):
     #Log error messages that users need to know about
-    with open(_error_log_file, 'a') as elog_file:
-        elog_file.write(str(message) + '\n')
+    with _log_lock:
+        with open(_error_log_file, 'a') as elog_file:
+            elog_file.write(str(message) + '\n')
 
     # Also send to progress dialog if callback exists and it's an error/warning
     if _progress_callback:
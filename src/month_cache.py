@@ -0,0 +1,124 @@
+# month_cache.py : answer the finished months of a report (older than restatement_months) from the jsons saved
+### by earlier runs (use_json_archive), and only ask the provider for the months that could still change
+
+import json
+import os
+import re
+from datetime import date
+from logger import log_error
+from report_merge import first_changeable_month, month_index, month_string, request_dates, with_dates, keep_months, merge_items, set_report_dates
+from report_chunks import get_chunked_json
+from consortium import file_prefix
+from harvest_history import note_archived
+from run_options import provider_options
+
+
+def archived_report(provider_info, report_id, first, last):
+    """
+    Find the saved json that has the most finished months from month first onwards.
+
+    Returns:
+        (report json trimmed to the months it can answer, last month index it answers) or (None, None)
+    """
+    options = provider_options(provider_info)
+    vendor = provider_info.get('Name', '').replace(' ', '_')
+    prefix = file_prefix(provider_info)
+    platform = provider_info.get('Platform', '')
+    folder = os.path.join(options.json_dir, vendor)
+    if not os.path.isdir(folder):
+        return None, None
+    # the same name save_json gives the file, see process_item_details.py
+    platform_part = f"{re.escape(platform)}_" if platform else ''
+    name_pattern = re.compile(rf"^{re.escape(prefix)}_{re.escape(report_id)}_{platform_part}\d{{4}}-\d{{2}}-\d{{2}}-\d{{4}}-\d{{2}}-\d{{2}}_(\d{{4}})_(\d{{2}})_(\d{{2}})\.json$")
+    candidates = []
+    for filename in os.listdir(folder):
+        match = name_pattern.match(filename)
+        if match:
+            candidates.append((date(*map(int, match.groups())), filename))
+    best, best_last = None, None
+    for saved_on, filename in sorted(candidates, reverse=True):
+        # a saved json is only trusted for the months that were already finished on the day it was saved
+        usable_last = min(last, first_changeable_month(saved_on, options.restatement_months) - 1)
+        if usable_last < first or (best_last is not None and usable_last <= best_last):
+            continue
+        try:
+            with open(os.path.join(folder, filename), 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            filters = saved.get('Report_Header', {}).get('Report_Filters', {})
+            saved_first = month_index(filters.get('Begin_Date', ''))
+            saved_last = month_index(filters.get('End_Date', ''))
+        except (OSError, ValueError, AttributeError) as e:
+            log_error(f"WARNING: could not use the saved json {filename}: {e}")
+            continue
+        if saved_first > first or saved_last < first:
+            continue
+        usable_last = min(usable_last, saved_last)
+        if best_last is None or usable_last > best_last:
+            best, best_last = saved, usable_last
+            if best_last == last:
+                break
+    if best is None:
+        return None, None
+    best['Report_Items'] = keep_months(best.get('Report_Items', []), first, best_last)
+    return best, best_last
+
+
+def plan_request(provider_info, report_id, url):
+    """
+    Split a report request into the months the archive can answer and the months to ask the provider for.
+
+    Returns:
+        (archived report json or None, url to ask the provider for or None if the archive has every month)
+    """
+    options = provider_options(provider_info)
+    if not options.use_json_archive:
+        return None, url
+    begin_date, end_date = request_dates(url)
+    if not begin_date:
+        return None, url
+    first, last = month_index(begin_date), month_index(end_date)
+    last_finished = min(last, first_changeable_month(date.today(), options.restatement_months) - 1)
+    if last_finished < first:
+        return None, url
+    archived, archived_last = archived_report(provider_info, report_id, first, last_finished)
+    if archived is None:
+        return None, url
+    provider_name = provider_info.get('Name', '')
+    if archived_last >= last:
+        log_error(f"INFO: {provider_name}: {report_id.upper()}: all months are finished and already saved, not asking the provider")
+        return archived, None
+    network_begin = f"{month_string(archived_last + 1)}-01"
+    log_error(f"INFO: {provider_name}: {report_id.upper()}: using saved data for {begin_date[:7]} to {month_string(archived_last)}, asking the provider from {network_begin[:7]}")
+    return archived, with_dates(url, network_begin, end_date)
+
+
+def merge_reports(archived, fresh, url):
+    """
+    Combine the archived months with the provider's answer for the other months into one report json.
+    Anything but a proper report from the provider (eg an error code) is returned as it is.
+    """
+    if fresh is not None and not (isinstance(fresh, dict) and fresh.get('Report_Header')):
+        return fresh
+    if fresh is not None and not isinstance(fresh.get('Report_Items', []), list):
+        return fresh
+    if fresh is None:
+        report = archived
+    else:
+        report = dict(fresh)
+        report['Report_Items'] = merge_items(archived.get('Report_Items', []), fresh.get('Report_Items', []))
+    return set_report_dates(report, url)
+
+
+def get_report_json(url, provider_info, report_id, defer_queued=False):
+    """get_json_data for a report url, answering the finished months from the json archive when use_json_archive is on
+    and splitting a long date range into chunks (see report_chunks.py)."""
+    archived, network_url = plan_request(provider_info, report_id, url)
+    if archived is None:
+        return get_chunked_json(url, provider_info, report_id, defer_queued)
+    if not network_url:
+        note_archived(url)
+        return merge_reports(archived, None, url)
+    fresh = get_chunked_json(network_url, provider_info, report_id, defer_queued, report_url=url)
+    if fresh is None or isinstance(fresh, int):
+        return fresh  # error codes, and REPORT_QUEUED, go back to the caller unchanged
+    return merge_reports(archived, fresh, url)
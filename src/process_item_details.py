@@ -8,13 +8,26 @@ import json
 import datetime
 import sqlite3
 import csv
+import threading
 import data_columns
 from logger import log_error
-from fetch_json import get_json_data  # generic routine to get json report with various error handling, headers, content encoding, etc.
+from fetch_json import REPORT_QUEUED
 from insert_sqlite import insert_sqlite
+from month_cache import get_report_json  # get_json_data (generic routine to get json report with various error handling, headers, content encoding, etc.), with the finished months from the json archive if use_json_archive is on
 #from current_config import sqlite_filename, json_dir, error_log_file, save_empty_report
 #removing it as these values get cached at import time. We'll pass them through the call chain instead-Daniel
 from convert_counter_json_to_tsv import convert_counter_json_to_tsv
+from stream_json import write_report_json, discard_download
+from derive_reports import reports_derived_from, derive_report
+from report_pipeline import submit_report
+from cancellation import cancelled
+from consortium import file_prefix, member_label
+from db_coverage import record_coverage, final_empty_report
+from run_options import provider_options
+
+# Providers may be harvested in parallel threads; sqlite only allows one writer at a time,
+# so each report's inserts are done while holding this lock
+_sqlite_lock = threading.Lock()
 
 
 def count_date_keys(data):
@@ -111,14 +124,15 @@ def save_json(report_json, report_id, provider_info, json_folder, save_empty=Fal
     api_platform = provider_info.get("Platform","")
     if exceptions and exceptions[0].get("Code") != 3030:
         log_error(f'ERROR: Exceptions reported for {vendor}: {report_type}')
-    date_range = provider_info.get("Dates","")
+    date_range = provider_info.get("Report_Dates", {}).get(report_id, "")
     created_date = f"{datetime.datetime.now():%Y_%m_%d}"
     if not all ((report_type,date_range,created_date,vendor)):
         return -1
+    prefix = file_prefix(provider_info)  # with the member's Customer_ID for a consortium member, see consortium.py
     if api_platform:
-        json_filename = f'{vendor}_{report_id}_{api_platform}_{date_range}_{created_date}.json'
+        json_filename = f'{prefix}_{report_id}_{api_platform}_{date_range}_{created_date}.json'
     else:
-        json_filename = f'{vendor}_{report_id}_{date_range}_{created_date}.json'
+        json_filename = f'{prefix}_{report_id}_{date_range}_{created_date}.json'
     if save_empty and not report_items:
         json_filename = json_filename.removesuffix(".json") + "_empty.json"
     if exceptions:
@@ -135,9 +149,9 @@ def save_json(report_json, report_id, provider_info, json_folder, save_empty=Fal
     # Remove the sensitive key from the copy
     if key_to_skip in temp_dict_for_writing:
         del temp_dict_for_writing[key_to_skip]
-    # Dump the temporary, modified dictionary to the file
+    # Dump the temporary, modified dictionary to the file (item by item, as Report_Items may still be on disk, see stream_json.py)
     with open(full_file_path, "w", encoding="utf-8") as json_file:
-        json.dump(temp_dict_for_writing, json_file, indent=4)
+        write_report_json(temp_dict_for_writing, json_file)
     return full_file_path
 
 """
@@ -147,7 +161,7 @@ def save_json(report_json, report_id, provider_info, json_folder, save_empty=Fal
     - Special handling for MMM-YYYY date columns
     Returns a list of dictionaries, where each dictionary represents a row for SQLite insertion.
 """
-def parse_tsv_file(file_path, provider_name, report_type):
+def parse_tsv_file(file_path, provider_name, report_type, member=''):
     # Month name to number mapping
     month_map = {
         "Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
@@ -179,6 +193,8 @@ def parse_tsv_file(file_path, provider_name, report_type):
             date_columns = []
             base_dict["Provider_Name"] = provider_name
             base_dict["Report_Type"] = report_type[:2]
+            if member:  # a consortium member's rows are told apart by its Customer_ID, see consortium.py
+                base_dict["Customer_ID"] = member
             # First pass: identify regular columns and date columns "headers" = column names
             for idx, header in enumerate(headers):
                 if header == "Reporting_Period_Total":
@@ -216,31 +232,61 @@ def parse_tsv_file(file_path, provider_name, report_type):
     return result_rows
 
 
-def process_item_details(provider_info,report_type,get_report_url,config):
+def process_item_details(provider_info,report_type,get_report_url,config,defer_queued=False):
     #dded 'config' parameter,it now receives config dict from getcounter.py
-
-    #  Extract the values we need from the config dict. Now these are local variables with current values.
-    sqlite_filename = config['sqlite_filename']
-    json_dir = config['json_dir']
-    error_log_file = config['error_log_file']
-    save_empty_report = config['save_empty_report']
+    # with defer_queued=True a report the provider has queued (202) returns REPORT_QUEUED so the caller can park it
     provider_name = provider_info.get('Name')
 
     if not all((provider_info,report_type,get_report_url)):
         log_error(f"ERROR: missing one or more of the parameters for process_item_details\n")
         return -1
     try:
-        ################# This uses get_json_data in fetch_json.py to actually get the specific report
-
-        report_data = get_json_data(get_report_url,provider_info)
+        ################# This uses get_json_data in fetch_json.py (through month_cache.py) to actually get the specific report
 
-        #log_error(f'DEBUG PID: Does the report data contain the Report Header?\n{report_data}\n')
-        if (not report_data) or (isinstance(report_data, int)) or (not isinstance(report_data, dict)): # an int response is an error
-            log_error(f"ERROR: Processing {provider_name}:{report_type.upper()}: unable to get report using {get_report_url}\n")
-            return -1
+        report_data = get_report_json(get_report_url,provider_info,report_type,defer_queued)
+        if defer_queued and report_data == REPORT_QUEUED:
+            return REPORT_QUEUED
     except Exception as e:
         log_error(f"ERROR: Processing {provider_name}:{report_type.upper()}: Error occurred for {get_report_url}: \n{e} type: {type(e).__name__}\n")
         return None
+    return process_report_data(provider_info, report_type, get_report_url, report_data, config)
+
+
+# Everything after the download: save the json, make the tsv, and load the _EX reports into sqlite
+### Split from process_item_details so that a report downloaded some other way (eg the asyncio engine) is processed the same way
+def process_report_data(provider_info, report_type, get_report_url, report_data, config):
+    queue_size = provider_options(provider_info).pipeline_queue_size
+    if queue_size:
+        # saved, converted and loaded in the pipeline's threads while the caller goes on to the next download
+        return submit_report(PIPELINE_STAGES, queue_size, provider_info, report_type, get_report_url, report_data, config)
+    return persist_report(provider_info, report_type, get_report_url, report_data, config)
+
+
+def stopped(provider_info, report_type, step):
+    # Between two steps of a report is a safe place to stop once the user has clicked Stop (see cancellation.py)
+    if not cancelled():
+        return False
+    log_error(f"INFO: {member_label(provider_info)}:{report_type.upper()} was not {step}, the harvest was stopped")
+    return True
+
+
+# The three steps after the download, each handing its result to the next one (then) when it succeeds.
+### process_report_data runs them one after another; report_pipeline.py runs each step in its own thread
+### and passes a then that queues the result for the next step instead
+def persist_report(provider_info, report_type, get_report_url, report_data, config, then=None):
+    """Check the downloaded report and save its json (and those of the reports made from it), then make the tsv."""
+    then = then or convert_report
+    if stopped(provider_info, report_type, 'saved'):
+        return None
+    #  Extract the values we need from the config dict. Now these are local variables with current values.
+    json_dir = config['json_dir']
+    save_empty_report = config['save_empty_report']
+    provider_name = provider_info.get('Name')
+
+    #log_error(f'DEBUG PID: Does the report data contain the Report Header?\n{report_data}\n')
+    if (not report_data) or (isinstance(report_data, int)) or (not isinstance(report_data, dict)): # an int response is an error
+        log_error(f"ERROR: Processing {provider_name}:{report_type.upper()}: unable to get report using {get_report_url}\n")
+        return -1
     #log_error(f'DEBUG PID: did we get the report header? { report_data.get("Report_Header", "No report header")}\n')
     try:
         report_header = report_data.get("Report_Header", {})
@@ -271,6 +317,8 @@ def process_item_details(provider_info,report_type,get_report_url,config):
         report_items = report_data.get("Report_Items", [])
         if not report_items:
             log_error(f"Warning: Processing {provider_name}:{report_type.upper()}: Got Report Header but no usage table")
+            if final_empty_report(report_header):
+                note_harvested(provider_info, report_type, config)  # no usage in these months is an answer too, see db_coverage.py
             if save_empty_report:
                 log_error(f'  Saving empty reports: tsv with header and exceptions but no usage table.')
             if not save_empty_report:  # user configures whether they want to save a report with just the header so they have a record of trying and not having data for that report/period
@@ -281,15 +329,34 @@ def process_item_details(provider_info,report_type,get_report_url,config):
         if save_empty_report:
             log_error(f'  Saving empty reports: tsv with header and exceptions but no usage table.')
         return -1
+    ########### Step 0 - the master report and standard views made from this _EX instead of downloaded (see derive_reports.py)
+    for derived_id, derived_url in reports_derived_from(provider_info, report_type):
+        try:
+            derived_data = derive_report(report_data, derived_id)
+        except Exception as e:
+            log_error(f"ERROR: Processing {provider_name}:{derived_id.upper()}: unable to make it from {report_type.upper()}: {e} type: {type(e).__name__}\n")
+            continue
+        log_error(f"INFO: {provider_name}:{derived_id.upper()} made from {report_type.upper()}")
+        persist_report(provider_info, derived_id, derived_url, derived_data, config, then)
     ########### Step 1 - Save the json to a file
     #save the entire json to a file in folder specified in user config
     #log_error(f'DEBUG GALE IR_A1: {report_data},\n {report_type},\n {provider_info},\n {json_dir},\n {save_empty_report},\n {report_items}\n')
     json_saved_filename = save_json(report_data, report_type, provider_info, json_dir, save_empty_report, report_items)
+    discard_download(report_data)  # the saved json has everything the streamed download had
     if not json_saved_filename or not isinstance(json_saved_filename, str):
         log_error(f'ERROR-detail: Unable to save json, skipping this report for {provider_info} {report_type.upper()};report_data=\n{report_data}\n\n')
         log_error(f'ERROR: Unable to save json for {provider_info} {report_type.upper()}; see infolog for details\n')
         return -1
+    return then(provider_info, report_type, json_saved_filename, config)
 
+
+def convert_report(provider_info, report_type, json_saved_filename, config, then=None):
+    """Make the tsv from the saved json, then load it into the sqlite database."""
+    then = then or ingest_report
+    if stopped(provider_info, report_type, 'converted to tsv'):
+        return None
+    error_log_file = config['error_log_file']
+    provider_name = provider_info.get('Name')
     ##### Step 2 - create the tsv file - the official COUNTER report
     tsv_saved_file = convert_counter_json_to_tsv(report_type.upper(),json_saved_filename, provider_info,config)
     # added config parameter to pass to the next function in the chain so it can access tsv_dir.-Daniel
@@ -298,8 +365,15 @@ def process_item_details(provider_info,report_type,get_report_url,config):
         print(f'Unable to save tsv for: {provider_name}: {report_type.upper()}; see {error_log_file} for details\n')
         log_error(f'ERROR: Unable to save tsv for: {provider_name}: {report_type.upper()}\njson file: {json_saved_filename}\n')
         return -1
+    return then(provider_info, report_type, tsv_saved_file, config)
 
 
+def ingest_report(provider_info, report_type, tsv_saved_file, config):
+    """Add the rows of an _EX report's tsv to the sqlite database."""
+    if stopped(provider_info, report_type, 'added to the sqlite database'):
+        return None
+    sqlite_filename = config['sqlite_filename']
+    provider_name = provider_info.get('Name')
     ########## Step 3 - save the data from the EX reports to the sqlite database
     ####   From here on we are only working with the special master reports for the database
     if not report_type.endswith("EX"):
@@ -335,39 +409,65 @@ def process_item_details(provider_info,report_type,get_report_url,config):
             log_error(f'INFO: {provider_name}:{report_type} is empty, nothing to save to sqlite database.')
             return None
         #### MUST ALSO PASS the Provider_Name and Report_Type!!!!!
-        rows = parse_tsv_file(tsv_saved_file, provider_name, report_type)
+        rows = parse_tsv_file(tsv_saved_file, provider_name, report_type, provider_info.get('Member', ''))
     except Exception as h:
         log_error(f'ERROR: Unable to open or parse the tsv file so unable to write the data to the sqlite database.\nTSV filename tried: {tsv_saved_file}\n{h}\n')
         return None
-    # Connect to SQLite using the imported `sqlite_filename` we open it once then close it once at the end of this function
-    conn = sqlite3.connect(sqlite_filename)
-    cursor = conn.cursor()
     if not rows:
         log_error(f'INFO: no data retrieved from tsv file, so nothing to save to sqlite database.')
+        note_harvested(provider_info, report_type, config)
         return None
-    log_error(f'INFO: saving the contents of {tsv_saved_file} to the sqlite database')
+    # Connect to SQLite using the imported `sqlite_filename` we open it once then close it once at the end of this function
+    with _sqlite_lock:
+        conn = sqlite3.connect(sqlite_filename)
+        cursor = conn.cursor()
+        log_error(f'INFO: saving the contents of {tsv_saved_file} to the sqlite database')
+
+        for row in rows:
+            if cancelled():
+                # leave the database as it was before this report rather than with part of it
+                conn.rollback()
+                conn.close()
+                log_error(f'INFO: {provider_name}:{report_type.upper()}: the harvest was stopped, none of {tsv_saved_file} was added to the sqlite database')
+                return None
+            try:
+                ####### The actual insert per each row of usage data, note that at this point, report type includes the _EX
+                insert_sqlite(row,report_type,cursor,conn,config,all_data_columns[report_type[:2]]) # Added config- Daniel
+                # pass config dict so insert_sqlite can access data_table -Daniel
+            except sqlite3.OperationalError as e:
+                # Handle operational errors (e.g., unable to connect, missing table, etc.)
+                log_error(f"ERROR: OperationalError: {e}")
+
+            except sqlite3.DatabaseError as e:
+                # Generic database errors
+                log_error(f"ERROR: DatabaseError: {e}")
+
+            except sqlite3.Error as e:
+                # Handle SQLite errors
+                error_message = f"\nSQLite Error: {e}\n"
+                log_error(error_message)
+
+        if conn:
+        #save all of the data sent to sqlite for this report, and that its months have been harvested (see db_coverage.py)
+            record_coverage(cursor, provider_info, report_type)
+            conn.commit()
+            conn.close()
 
-    for row in rows:
-        try:
-            ####### The actual insert per each row of usage data, note that at this point, report type includes the _EX
-            insert_sqlite(row,report_type,cursor,conn,config,all_data_columns[report_type[:2]]) # Added config- Daniel
-            # pass config dict so insert_sqlite can access data_table -Daniel
-        except sqlite3.OperationalError as e:
-            # Handle operational errors (e.g., unable to connect, missing table, etc.)
-            log_error(f"ERROR: OperationalError: {e}")
+    timestamp = datetime.datetime.now().strftime("%H:%M:%S")
 
-        except sqlite3.DatabaseError as e:
-            # Generic database errors
-            log_error(f"ERROR: DatabaseError: {e}")
 
+def note_harvested(provider_info, report_type, config):
+    # Note the months of a report that adds no rows as harvested, see db_coverage.py
+    with _sqlite_lock:
+        conn = sqlite3.connect(config['sqlite_filename'])
+        try:
+            record_coverage(conn.cursor(), provider_info, report_type)
+            conn.commit()
         except sqlite3.Error as e:
-            # Handle SQLite errors
-            error_message = f"\nSQLite Error: {e}\n"
-            log_error(error_message)
+            log_error(f"ERROR: could not note the months of {member_label(provider_info)}:{report_type.upper()} as harvested: {e}")
+        finally:
+            conn.close()
 
-    if conn:
-    #save all of the data sent to sqlite for this report
-        conn.commit()
-        conn.close()
 
-    timestamp = datetime.datetime.now().strftime("%H:%M:%S")
+# The steps process_report_data hands to report_pipeline.py when pipeline_queue_size is above 0
+PIPELINE_STAGES = [('json save', persist_report), ('tsv conversion', convert_report), ('sqlite insert', ingest_report)]
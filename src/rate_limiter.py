@@ -0,0 +1,123 @@
+# rate_limiter.py : per-provider request pacing from the Delay and Retry columns of providers.tsv, a token
+### bucket per host shared by all threads (and the asyncio engine), that only waits when over the budget
+
+import threading
+import time
+from http_session import session_key
+
+# Global variables
+_limiters = {}  # host -> TokenBucket
+_limiters_lock = threading.Lock()
+
+DEFAULT_QUEUED_WAIT = 5  # seconds to wait before asking again for a queued (202) report if the provider gives no number
+
+
+def parse_seconds(value):
+    """Return a Delay/Retry cell as a number of seconds, or None if it is empty or not a number (eg 'Y')."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).strip())
+    except ValueError:
+        return None
+
+
+def provider_delay(provider_info):
+    # Seconds the provider wants between API requests, from the Delay column (0 = no delay needed)
+    ### anything in Delay that is not a number gets a reasonable 5 seconds
+    delay = provider_info.get('Delay', '')
+    seconds = parse_seconds(delay)
+    if seconds is None:
+        return 5.0 if delay not in (None, '') else 0.0
+    return max(seconds, 0.0)
+
+
+def queued_retry_wait(provider_info):
+    # Seconds to wait before asking again for a report the provider has queued, from the Retry column.
+    ### A number in Retry is used as is; a "Y" (or nothing) falls back to the Delay, with a sane minimum
+    seconds = parse_seconds(provider_info.get('Retry', ''))
+    if seconds:
+        return seconds
+    return max(provider_delay(provider_info), DEFAULT_QUEUED_WAIT)
+
+
+class TokenBucket:
+    """
+    Token bucket allowing `burst` requests at once and `rate` requests per second after that.
+    A rate of None means no limit.
+    """
+
+    def __init__(self, rate=None, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        """
+        Take a token for one request.
+
+        Returns:
+            Seconds the caller has to wait before sending the request (0 if it can go now)
+        """
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.paused_until - now)
+            if self.rate:
+                self._refill(now)
+                self.tokens -= 1
+                if self.tokens < 0:
+                    wait = max(wait, -self.tokens / self.rate)
+            return wait
+
+    def pause(self, seconds):
+        """Hold back every request to this host for the next `seconds`, eg after a 429 Too Many Requests."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def tighten(self, rate, burst):
+        """Switch to a stricter rate if another provider on the same host asks for one."""
+        with self.lock:
+            if rate and (not self.rate or rate < self.rate):
+                self._refill(time.monotonic())
+                self.rate = rate
+                self.burst = min(self.burst, max(1, burst))
+                self.tokens = min(self.tokens, self.burst)
+
+
+def provider_rate(provider_info):
+    # (requests per second, burst size) for this provider; (None, 1) means no limit
+    delay = provider_delay(provider_info)
+    if not delay:
+        return None, 1
+    return 1.0 / delay, 1
+
+
+def get_rate_limiter(provider_info):
+    """Get the token bucket for this provider's Base_URL host, creating it on first use."""
+    base_url = provider_info.get('Base_URL', '') or provider_info.get('Name', '')
+    host = session_key(base_url) or base_url
+    rate, burst = provider_rate(provider_info)
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = TokenBucket(rate, burst)
+            _limiters[host] = limiter
+            return limiter
+    limiter.tighten(rate, burst)
+    return limiter
+
+
+def reset_rate_limiters():
+    """Forget all buckets, called at the start of a harvester run."""
+    with _limiters_lock:
+        _limiters.clear()
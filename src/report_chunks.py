@@ -0,0 +1,86 @@
+# report_chunks.py : download a report with a long date range (chunk_months) as several shorter date ranges
+### at once, and merge them back into one report json
+
+from concurrent.futures import ThreadPoolExecutor
+from logger import log_error
+from fetch_json import get_json_data, REPORT_QUEUED
+from harvest_history import expected_bytes_per_month, move_response_bytes
+from report_merge import (month_index, month_begin_date, month_end_date, request_dates, with_dates,
+                          merge_items, set_report_dates)
+from run_options import provider_options
+
+
+def chunk_urls(provider_info, report_id, url):
+    """
+    Plan the date-range chunks for a report url.
+
+    Returns:
+        list of chunk urls, or an empty list if the report is asked for in one go
+    """
+    options = provider_options(provider_info)
+    if not options.chunk_months or report_id.upper() not in options.chunk_reports:
+        return []
+    begin_date, end_date = request_dates(url)
+    if not begin_date:
+        return []
+    first, last = month_index(begin_date), month_index(end_date)
+    months_per_chunk = options.chunk_months
+    # once the report has been harvested, its size decides the chunks instead, so each is about chunk_target_mb
+    bytes_per_month = expected_bytes_per_month(provider_info.get('Name', ''), report_id)
+    if bytes_per_month:
+        months_per_chunk = max(1, int(options.chunk_target_bytes // bytes_per_month))
+    if months_per_chunk >= last - first + 1:
+        return []
+    return [with_dates(url, month_begin_date(start), month_end_date(min(start + months_per_chunk - 1, last)))
+            for start in range(first, last + 1, months_per_chunk)]
+
+
+def merge_chunks(results, url):
+    """
+    Merge the chunks of a report into one report json for the whole date range of url.
+    If any chunk failed the report has failed (an error code is returned); if any is queued the report is queued.
+    """
+    for result in results:
+        if result is None or (isinstance(result, int) and result != REPORT_QUEUED):
+            return result
+    if REPORT_QUEUED in [result for result in results if isinstance(result, int)]:
+        return REPORT_QUEUED
+    for result in results:
+        if not isinstance(result, dict) or not result.get('Report_Header') or not isinstance(result.get('Report_Items', []), list):
+            return result  # not a proper report, process_report_data reports the problem
+    report = dict(results[0])
+    items = []
+    exceptions = []
+    for result in results:
+        items = merge_items(items, result.get('Report_Items', []))
+        for exception in result['Report_Header'].get('Exceptions', []) or []:
+            if exception not in exceptions:
+                exceptions.append(exception)
+    report['Report_Items'] = items
+    report = set_report_dates(report, url)
+    if exceptions:
+        report['Report_Header']['Exceptions'] = exceptions
+    return report
+
+
+def get_chunked_json(url, provider_info, report_id, defer_queued=False, report_url=None):
+    """
+    get_json_data for a report url, in date-range chunks if the report is large (see chunk_urls).
+
+    Args:
+        report_url: the url the report is known by in the harvest history, if not url itself
+    """
+    chunks = chunk_urls(provider_info, report_id, url)
+    if not chunks:
+        # a whole report can be read from disk as it is (stream_downloads); chunks and archive merges need lists
+        report_json = get_json_data(url, provider_info, defer_queued, to_file=not report_url)
+        report_url = report_url or url
+        move_response_bytes(url, report_url)
+        return report_json
+    report_url = report_url or url
+    log_error(f"INFO: {provider_info.get('Name','')}: {report_id.upper()}: asking for {len(chunks)} date-range chunks")
+    with ThreadPoolExecutor(max_workers=max(1, min(len(chunks), provider_options(provider_info).max_requests_per_host))) as executor:
+        results = list(executor.map(lambda chunk_url: get_json_data(chunk_url, provider_info, defer_queued), chunks))
+    for chunk_url in chunks:
+        move_response_bytes(chunk_url, report_url)
+    return merge_chunks(results, url)
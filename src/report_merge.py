@@ -0,0 +1,109 @@
+# report_merge.py : date ranges of report urls, and combining report jsons that cover different months
+### (used by month_cache.py and report_chunks.py); items are matched on everything but their usage
+
+import calendar
+import copy
+import json
+import re
+
+# the nested lists of a COUNTER report json that hold the usage, and the field that holds the counts
+ITEM_LISTS = ('Report_Items', 'Items', 'Attribute_Performance')
+PERFORMANCE = 'Performance'
+
+
+def month_index(yyyy_mm):
+    # 'YYYY-MM...' as a number of months, so months can be compared and counted
+    return int(yyyy_mm[:4]) * 12 + int(yyyy_mm[5:7]) - 1
+
+
+def first_changeable_month(as_of, restatement_months):
+    # the index of the oldest month a provider could still restate on the date as_of
+    return as_of.year * 12 + as_of.month - 1 - restatement_months
+
+
+def month_string(index):
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+def month_begin_date(index):
+    # first day of a month index as YYYY-MM-DD, for begin_date
+    return f"{month_string(index)}-01"
+
+
+def month_end_date(index):
+    # last day of a month index as YYYY-MM-DD, for end_date
+    year, month = index // 12, index % 12 + 1
+    return f"{month_string(index)}-{calendar.monthrange(year, month)[1]:02d}"
+
+
+def request_dates(url):
+    """Return the (begin_date, end_date) YYYY-MM-DD strings of a report url, or (None, None)."""
+    begin = re.search(r'begin_date=(\d{4}-\d{2}-\d{2})', url)
+    end = re.search(r'end_date=(\d{4}-\d{2}-\d{2})', url)
+    if not begin or not end:
+        return None, None
+    return begin.group(1), end.group(1)
+
+
+def with_dates(url, begin_date, end_date):
+    """The same report url asking for begin_date..end_date (YYYY-MM-DD) instead."""
+    url = re.sub(r'begin_date=\d{4}-\d{2}-\d{2}', f'begin_date={begin_date}', url)
+    return re.sub(r'end_date=\d{4}-\d{2}-\d{2}', f'end_date={end_date}', url)
+
+
+def keep_months(items, first, last):
+    """Copy of report items with only the usage for months first..last (month indexes); items left empty are dropped."""
+    kept = []
+    for item in items:
+        item = dict(item)
+        if PERFORMANCE in item:
+            performance = {}
+            for metric, months in item[PERFORMANCE].items():
+                months = {month: count for month, count in months.items() if first <= month_index(month) <= last}
+                if months:
+                    performance[metric] = months
+            if not performance:
+                continue
+            item[PERFORMANCE] = performance
+        lists = [field for field in ITEM_LISTS if field in item]
+        for field in lists:
+            item[field] = keep_months(item[field], first, last)
+        if lists and not any(item[field] for field in lists):
+            continue
+        kept.append(item)
+    return kept
+
+
+def item_identity(item):
+    # everything but the usage identifies an item (title, ids, platform, access type, ...)
+    return json.dumps({key: value for key, value in item.items() if key not in ITEM_LISTS and key != PERFORMANCE},
+                      sort_keys=True, default=str)
+
+
+def merge_items(old_items, new_items):
+    """Merge two lists of report items, combining the usage of items that are the same title/attributes."""
+    merged = {}
+    for item in list(old_items) + list(new_items):
+        key = item_identity(item)
+        target = merged.get(key)
+        if target is None:
+            merged[key] = copy.deepcopy(item)
+            continue
+        for field in ITEM_LISTS:
+            if field in item:
+                target[field] = merge_items(target.get(field, []), item[field])
+        if PERFORMANCE in item:
+            performance = target.setdefault(PERFORMANCE, {})
+            for metric, months in item[PERFORMANCE].items():
+                performance.setdefault(metric, {}).update(months)
+    return list(merged.values())
+
+
+def set_report_dates(report, url):
+    """Make the report header's Begin_Date and End_Date those of url (the header is copied, not changed in place)."""
+    begin_date, end_date = request_dates(url)
+    report['Report_Header'] = copy.deepcopy(report['Report_Header'])
+    filters = report['Report_Header'].setdefault('Report_Filters', {})
+    filters['Begin_Date'] = begin_date
+    filters['End_Date'] = end_date
+    return report
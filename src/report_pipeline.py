@@ -0,0 +1,104 @@
+# report_pipeline.py : save, convert and load one report while the next one downloads (pipeline_queue_size above 0),
+### each step in its own thread with a queue of at most pipeline_queue_size reports in front of it
+
+import functools
+import queue
+import threading
+import traceback
+from logger import log_error
+
+# Global variables
+_pipeline = None
+_pipeline_lock = threading.Lock()
+
+_STOP = None  # put on a stage's queue after its last report
+
+
+class _Stage:
+    # One step of the pipeline: a thread doing work(*job) for each job on its queue, in order
+
+    def __init__(self, name, work, queue_size, errors):
+        self.name = name
+        self.work = work
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.errors = errors
+        self.thread = threading.Thread(target=self._run, name=f'pipeline {name}', daemon=True)
+        self.thread.start()
+
+    def put(self, *job):
+        self.queue.put(job)  # waits while the queue is full, which is what holds back the step before
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is _STOP:
+                return
+            try:
+                self.work(*job)
+            except Exception as e:
+                # one report failing must not stop the reports behind it
+                provider_info, report_id = job[0], job[1]
+                error_msg = f"Error processing {provider_info.get('Name')}:{report_id}: {self.name} failed: {str(e)}"
+                log_error(f"ERROR: {error_msg}\n{traceback.format_exc()}")
+                self.errors.append(error_msg)
+
+    def stop(self):
+        self.queue.put(_STOP)
+        self.thread.join()
+
+
+class ReportPipeline:
+    """
+    The steps after the download, each in its own thread.
+    stages is a list of (name, function); each function is called with one report's job and then=,
+    a function to hand its result to the next stage (the last function is called without then).
+    """
+
+    def __init__(self, stages, queue_size):
+        self.errors = []
+        self.stages = []
+        following = None
+        for name, function in reversed(stages):  # each stage needs the one after it
+            work = function if following is None else functools.partial(function, then=following.put)
+            following = _Stage(name, work, queue_size, self.errors)
+            self.stages.insert(0, following)
+
+    def submit(self, *job):
+        """Queue one downloaded report for the first stage (waits while that queue is full)."""
+        self.stages[0].put(*job)
+
+    def finish(self):
+        """Wait for every queued report to go through all the stages, then stop the threads."""
+        for stage in self.stages:  # in order, so each stage has had everything from the one before
+            stage.stop()
+        return self.errors
+
+
+def submit_report(stages, queue_size, *job):
+    """
+    Hand one downloaded report to the pipeline, starting it for the first report of the run.
+
+    Returns:
+        None; the outcome of each report is in the info log, and errors are returned by finish_pipeline()
+    """
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = ReportPipeline(stages, queue_size)
+        pipeline = _pipeline
+    pipeline.submit(*job)
+
+
+def finish_pipeline():
+    """
+    Wait until every report handed to the pipeline is saved, converted and in the database (called by run_harvester).
+
+    Returns:
+        list of error messages for the reports that failed in the pipeline
+    """
+    global _pipeline
+    with _pipeline_lock:
+        pipeline, _pipeline = _pipeline, None
+    if pipeline is None:
+        return []
+    return pipeline.finish()
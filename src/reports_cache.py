@@ -0,0 +1,89 @@
+# reports_cache.py : disk cache of each provider's list of supported reports (the /reports API call)
+### kept in reports_cache_file for reports_cache_ttl hours, per Base_URL, customer and platform
+
+import json
+import threading
+from datetime import datetime
+from logger import log_error
+from run_options import provider_options
+
+# Global variables
+_cache = {}  # cache key -> {'saved': iso datetime, 'reports': the /reports json}
+_cache_lock = threading.Lock()
+
+
+def cache_key(provider_info):
+    # the /reports answer depends on the Base_URL, the customer and the platform
+    return '|'.join((str(provider_info.get('Base_URL', '')).strip().rstrip('/').lower(),
+                     str(provider_info.get('Customer_ID', '')).strip(),
+                     str(provider_info.get('Platform', '')).strip()))
+
+
+def cache_enabled(options):
+    return bool(options.reports_cache_file) and options.reports_cache_ttl > 0
+
+
+def load_reports_cache(options):
+    """Load the lists cached by earlier runs (called by run_harvester)."""
+    global _cache
+    with _cache_lock:
+        _cache = {}
+    if not cache_enabled(options):
+        return
+    try:
+        with open(options.reports_cache_file, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        return
+    except (OSError, ValueError) as e:
+        log_error(f"WARNING: could not read {options.reports_cache_file}, asking every provider for its list of reports: {e}")
+        return
+    if isinstance(saved, dict):
+        with _cache_lock:
+            _cache = saved
+
+
+def cached_reports(provider_info):
+    """
+    Get the provider's list of supported reports from the cache.
+
+    Returns:
+        the cached /reports json, or None if it has to be asked for
+    """
+    options = provider_options(provider_info)
+    if options.refresh_reports_cache or not cache_enabled(options):
+        return None
+    with _cache_lock:
+        entry = _cache.get(cache_key(provider_info))
+    if not entry:
+        return None
+    try:
+        saved = datetime.fromisoformat(entry['saved'])
+    except (KeyError, TypeError, ValueError):
+        return None
+    now = datetime.now()
+    # the list also says which is the last month available, so one saved in an earlier month is never used
+    if (now - saved).total_seconds() > options.reports_cache_ttl or (saved.year, saved.month) != (now.year, now.month):
+        return None
+    return entry.get('reports')
+
+
+def store_reports(provider_info, report_json):
+    """Cache a provider's list of supported reports; anything but a good list (eg an error code) is not cached."""
+    if not cache_enabled(provider_options(provider_info)) or not isinstance(report_json, list) or not report_json:
+        return
+    with _cache_lock:
+        _cache[cache_key(provider_info)] = {'saved': datetime.now().isoformat(timespec='seconds'), 'reports': report_json}
+
+
+def save_reports_cache(options):
+    """Write the cached lists to reports_cache_file for the next run."""
+    if not cache_enabled(options):
+        return
+    with _cache_lock:
+        saved = json.dumps(_cache)
+    try:
+        with open(options.reports_cache_file, 'w', encoding='utf-8') as f:
+            f.write(saved)
+    except OSError as e:
+        log_error(f"WARNING: could not save the list of supported reports to {options.reports_cache_file}: {e}")
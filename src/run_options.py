@@ -0,0 +1,116 @@
+# run_options.py : the options of one harvester run, read from the config once by run_harvester
+### and handed to the other modules in provider_info['Options'], or as options where there is no provider_info
+
+import os
+from dataclasses import dataclass
+from config_utils import config_int, config_float, config_bool, state_path
+from cassette import cassette_mode
+
+
+@dataclass(frozen=True)
+class RunOptions:
+    """
+    The checked and converted config options of one run. It is never changed once made, so every thread
+    of the run can read it, and a second run has its own.
+    """
+    months: int = 1  # months of data asked for in the run
+    json_dir: str = 'json_folders'
+    sqlite_filename: str = 'counterdata.db'
+    max_workers: int = 1
+    max_requests_per_host: int = 1
+    harvest_engine: str = 'threads'
+    max_retries: int = 5
+    max_retry_wait: float = 300.0  # seconds
+    retry_budget_per_provider: int = 20
+    retry_budget_per_run: int = 200
+    queued_report_deadline: float = 30 * 60.0  # seconds
+    queued_poll_interval: float = 300.0  # seconds
+    circuit_breaker_threshold: int = 3
+    circuit_breaker_cooldown: float = 15 * 60.0  # seconds
+    provider_health_file: str = None  # the state files are paths in state_dir, or None when turned off
+    harvest_history_file: str = None
+    reports_cache_file: str = None
+    reports_cache_ttl: float = 24 * 3600.0  # seconds
+    refresh_reports_cache: bool = False
+    use_json_archive: bool = False
+    restatement_months: int = 3
+    incremental_harvest: bool = False
+    chunk_months: int = 0
+    chunk_reports: frozenset = frozenset({'IR', 'IR_EX', 'TR', 'TR_EX'})
+    chunk_target_bytes: float = 50 * 1024 * 1024
+    stream_downloads: bool = False
+    derive_master_reports: bool = False
+    derive_standard_views: bool = False
+    discovery_workers: int = 8
+    pipeline_queue_size: int = 0
+    cassette_mode: str = 'off'
+    cassette_file: str = 'harvest_cassette.zip'
+    telemetry_file: str = None
+    adaptive_timeouts: bool = True
+    max_read_timeout: float = 600.0  # seconds
+
+    @property
+    def download_dir(self):
+        """Where stream_downloads writes the reports as they arrive."""
+        return os.path.join(self.json_dir, 'downloads_in_progress')
+
+
+DEFAULT_OPTIONS = RunOptions()
+
+
+def months_between(begin_date, end_date):
+    """Number of months from begin_date to end_date (YYYY-MM...), at least 1."""
+    try:
+        begin = int(begin_date[:4]) * 12 + int(begin_date[5:7])
+        end = int(end_date[:4]) * 12 + int(end_date[5:7])
+    except (TypeError, ValueError):
+        return 1
+    return max(1, end - begin + 1)
+
+
+def run_options(config, begin_date='', end_date=''):
+    """Read the options of a run from the config dict (defaults merged with the user's settings)."""
+    mode = cassette_mode(config)
+    return RunOptions(
+        months=months_between(begin_date, end_date),
+        json_dir=config.get('json_dir') or 'json_folders',
+        sqlite_filename=config.get('sqlite_filename') or 'counterdata.db',
+        max_workers=max(1, config_int(config, 'max_workers', 1)),
+        max_requests_per_host=max(1, config_int(config, 'max_requests_per_host', 1)),
+        harvest_engine=str(config.get('harvest_engine', 'threads')).strip().lower(),
+        max_retries=config_int(config, 'max_retries', 5),
+        max_retry_wait=config_float(config, 'max_retry_wait', 300.0),
+        retry_budget_per_provider=config_int(config, 'retry_budget_per_provider', 20),
+        retry_budget_per_run=config_int(config, 'retry_budget_per_run', 200),
+        queued_report_deadline=config_float(config, 'queued_report_deadline', 30) * 60,  # minutes in the config
+        queued_poll_interval=config_float(config, 'queued_poll_interval', 300),
+        circuit_breaker_threshold=max(1, config_int(config, 'circuit_breaker_threshold', 3)),
+        circuit_breaker_cooldown=config_float(config, 'circuit_breaker_cooldown', 15) * 60,  # minutes in the config
+        provider_health_file=state_path(config, 'provider_health_file'),
+        harvest_history_file=state_path(config, 'harvest_history_file'),
+        reports_cache_file=state_path(config, 'reports_cache_file'),
+        reports_cache_ttl=config_float(config, 'reports_cache_ttl', 24) * 3600,  # hours in the config
+        # a cassette needs each provider's list from the provider (or the recording), not from an earlier run
+        refresh_reports_cache=config_bool(config, 'refresh_reports_cache', False) or mode != 'off',
+        use_json_archive=config_bool(config, 'use_json_archive', False),
+        restatement_months=max(0, config_int(config, 'restatement_months', 3)),
+        incremental_harvest=config_bool(config, 'incremental_harvest', False),
+        chunk_months=max(0, config_int(config, 'chunk_months', 0)),
+        chunk_reports=frozenset(report_id.strip().upper() for report_id in str(config.get('chunk_reports', '')).split(',') if report_id.strip()),
+        chunk_target_bytes=config_float(config, 'chunk_target_mb', 50) * 1024 * 1024,
+        stream_downloads=config_bool(config, 'stream_downloads', False),
+        derive_master_reports=config_bool(config, 'derive_master_reports', False),
+        derive_standard_views=config_bool(config, 'derive_standard_views', False),
+        discovery_workers=max(1, config_int(config, 'discovery_workers', 8)),
+        pipeline_queue_size=max(0, config_int(config, 'pipeline_queue_size', 0)),
+        cassette_mode=mode,
+        cassette_file=config.get('cassette_file') or 'harvest_cassette.zip',
+        telemetry_file=state_path(config, 'telemetry_file'),
+        adaptive_timeouts=config_bool(config, 'adaptive_timeouts', True),
+        max_read_timeout=config_float(config, 'max_read_timeout', 600),
+    )
+
+
+def provider_options(provider_info):
+    """The run's options carried by a provider_info (the defaults for one made outside a run)."""
+    return provider_info.get('Options') or DEFAULT_OPTIONS
@@ -0,0 +1,236 @@
+# stream_json.py : download a report straight to disk (stream_downloads) and read its Report_Items
+### back one at a time, so a big report never has to be in memory all at once
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from compression import body_decoder
+
+# Global variables
+_downloads = set()  # temporary download files of this run
+_downloads_lock = threading.Lock()
+
+READ_SIZE = 1024 * 1024  # characters read from the file at a time
+WRITE_SIZE = 1024 * 1024  # bytes written to the file at a time
+_whitespace = re.compile(r'[ \t\n\r]*')
+_decoder = json.JSONDecoder()
+
+
+def new_download_file(options):
+    """Create an empty temporary file for a download in the run's download_dir and return its path."""
+    os.makedirs(options.download_dir, exist_ok=True)
+    handle, path = tempfile.mkstemp(suffix='.json', dir=options.download_dir)
+    os.close(handle)
+    with _downloads_lock:
+        _downloads.add(path)
+    return path
+
+
+def download_to_file(body, options, timer=None):
+    """
+    Write the body of a requests response (an http_session.ResumableBody) to a temporary file as it arrives,
+    decoding it on the way (see compression.py). A telemetry.RequestTimer gets the read and decode times.
+    The file is removed again if the body breaks off.
+
+    Returns:
+        (path of the file, number of bytes written, number of bytes on the wire)
+    """
+    path = new_download_file(options)
+    decoder = body_decoder(body.headers.get('Content-Encoding'))
+    size = 0
+    wire_size = 0
+    start = time.perf_counter()
+    decode_seconds = 0.0
+    try:
+        with open(path, 'wb') as f:
+            for chunk in body.chunks(WRITE_SIZE):
+                wire_size += len(chunk)
+                decode_start = time.perf_counter()
+                chunk = decoder.decompress(chunk)
+                decode_seconds += time.perf_counter() - decode_start
+                f.write(chunk)
+                size += len(chunk)
+            chunk = decoder.flush()
+            f.write(chunk)
+            size += len(chunk)
+    except BaseException:
+        remove_download(path)
+        raise
+    if timer:
+        timer.transferred(time.perf_counter() - start - decode_seconds, wire_size, size, decode_seconds)
+    return path, size, wire_size
+
+
+def discard_download(report_json):
+    """Remove the temporary download file behind a report once it has been saved to the archive."""
+    items = report_json.get('Report_Items') if isinstance(report_json, dict) else None
+    if isinstance(items, ReportItems) and items.temporary:
+        remove_download(items.path)
+
+
+def remove_download(path):
+    with _downloads_lock:
+        _downloads.discard(path)
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+def cleanup_downloads(options):
+    """Remove any temporary download files left by this run (eg from reports that failed)."""
+    with _downloads_lock:
+        paths = list(_downloads)
+    for path in paths:
+        remove_download(path)
+    try:
+        os.rmdir(options.download_dir)
+    except OSError:
+        pass  # not there, or not empty
+
+
+class _Reader:
+    # Reads json values from a file one at a time, keeping only a window of the file in memory
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=READ_SIZE):
+        if self.eof:
+            return False
+        chunk = self.f.read(size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # the next character that is not whitespace ('' at the end of the file)
+        while True:
+            self.pos = _whitespace.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ''
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"expected '{char}' in the json at position {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        size = READ_SIZE
+        while True:
+            self.peek()
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+                if end < len(self.buf) or self.eof:
+                    self.pos = end
+                    return value
+                # a number at the very end of the window might continue in the next read
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill(size)
+            size *= 2  # a value bigger than the window: read more at a time instead of re-parsing over and over
+
+
+def _walk_report(path):
+    # Yields ('field', key, value) for the top-level fields, ('items',) where Report_Items starts and ('item', item) for each of them
+    with open(path, 'r', encoding='utf-8') as f:
+        reader = _Reader(f)
+        reader.expect('{')
+        while reader.peek() not in ('}', ''):
+            key = reader.value()
+            reader.expect(':')
+            if key == 'Report_Items' and reader.peek() == '[':
+                reader.expect('[')
+                yield ('items',)
+                while reader.peek() not in (']', ''):
+                    yield ('item', reader.value())
+                    if reader.peek() == ',':
+                        reader.pos += 1
+                reader.expect(']')
+            else:
+                yield ('field', key, reader.value())
+            if reader.peek() == ',':
+                reader.pos += 1
+
+
+class ReportItems:
+    """The Report_Items of a report json file, read from the file one item at a time each time they are looped over."""
+
+    def __init__(self, path, temporary=False):
+        self.path = path
+        self.temporary = temporary  # a download file that is removed once the report is saved
+        self._has_items = None
+
+    def __iter__(self):
+        for entry in _walk_report(self.path):
+            if entry[0] == 'item':
+                yield entry[1]
+
+    def __bool__(self):
+        if self._has_items is None:
+            items = iter(self)
+            self._has_items = next(items, None) is not None
+            items.close()
+        return self._has_items
+
+
+def load_report(path, temporary=False):
+    """
+    Read a report json file with everything but Report_Items in memory.
+
+    Returns:
+        the report dict with Report_Items as a ReportItems, or the whole json if it is not a json object (eg an exception list)
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        reader = _Reader(f)
+        if reader.peek() != '{':
+            return reader.value()
+    report = {}
+    items = ReportItems(path, temporary)
+    items._has_items = False
+    for entry in _walk_report(path):
+        if entry[0] == 'field':
+            report[entry[1]] = entry[2]
+        elif entry[0] == 'items':
+            report['Report_Items'] = items  # keeps the fields in the order of the file
+        else:
+            items._has_items = True
+    return report
+
+
+def write_report_json(report_json, f):
+    """
+    Write a report to an open text file exactly as json.dump(report_json, f, indent=4) would,
+    but one report item at a time, so Report_Items can be a ReportItems.
+    """
+    fields = list(report_json.items())
+    if not fields:
+        f.write('{}')
+        return
+    f.write('{')
+    for index, (key, value) in enumerate(fields):
+        f.write('\n    ' + json.dumps(key) + ': ')
+        if key == 'Report_Items' and isinstance(value, ReportItems):
+            first = True
+            for item in value:
+                f.write('[\n        ' if first else ',\n        ')
+                f.write(json.dumps(item, indent=4).replace('\n', '\n        '))
+                first = False
+            f.write('[]' if first else '\n    ]')
+        else:
+            f.write(json.dumps(value, indent=4).replace('\n', '\n    '))
+        if index < len(fields) - 1:
+            f.write(',')
+    f.write('\n}')
@@ -0,0 +1,160 @@
+# telemetry.py : timings and sizes of every COUNTER API request (one json line each in telemetry_file),
+### and a summary per provider at the end of the run saying if it is latency- or bandwidth-bound
+
+import json
+import statistics
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from logger import log_error
+from cassette import CREDENTIAL_PARAMETERS
+from harvest_history import record_first_byte
+from timeouts import url_report_id
+from run_options import provider_options
+
+# Global variables
+_records = []  # every request of this run
+_lock = threading.Lock()
+
+
+def start_telemetry(options):
+    """Start a new telemetry_file for this run (called by run_harvester); an empty telemetry_file writes none."""
+    global _records
+    with _lock:
+        _records = []
+    if options.telemetry_file:
+        try:
+            open(options.telemetry_file, 'w', encoding='utf-8').close()
+        except OSError as e:
+            log_error(f"WARNING: cannot write the telemetry_file {options.telemetry_file}: {e}")
+
+
+def public_url(url):
+    """The url without the customer_id, requestor_id and api_key, for the telemetry_file."""
+    parts = urlsplit(url)
+    query = [(name, value) for name, value in parse_qsl(parts.query, keep_blank_values=True)
+             if name.lower() not in CREDENTIAL_PARAMETERS]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query, safe='|'), ''))
+
+
+class RequestTimer:
+    """
+    The telemetry of one HTTP request: a with block around sending the request and reading the answer,
+    which notes the request at once if it raises; otherwise call done() once the answer has been dealt with.
+    """
+
+    def __init__(self, provider_info, url, attempt):
+        self.start = time.perf_counter()
+        self.path = provider_options(provider_info).telemetry_file
+        self.record = {'time': datetime.now().isoformat(timespec='seconds'), 'provider': provider_info.get('Name', ''),
+                       'member': provider_info.get('Member', ''), 'url': public_url(url), 'attempt': attempt,
+                       'status': None, 'ttfb_ms': None, 'transfer_ms': None, 'wire_bytes': 0, 'decoded_bytes': 0,
+                       'decode_ms': 0.0, 'parse_ms': None, 'error': None}
+        self.finished = False
+
+    def first_byte(self, status_code):
+        """The status line and headers are in."""
+        self.record['status'] = status_code
+        self.record['ttfb_ms'] = _ms(time.perf_counter() - self.start)
+
+    def transferred(self, transfer_seconds, wire_bytes, decoded_bytes, decode_seconds=0.0):
+        """The body has been read (transfer_seconds, not counting decode_seconds) and decoded."""
+        self.record['transfer_ms'] = _ms(transfer_seconds)
+        self.record['wire_bytes'] = wire_bytes
+        self.record['decoded_bytes'] = decoded_bytes
+        self.record['decode_ms'] = _ms(decode_seconds)
+
+    def parsed(self, parse_seconds):
+        self.record['parse_ms'] = _ms(parse_seconds)
+
+    def failed(self, error):
+        self.record['error'] = str(error)[:200]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        # a request that raised (timed out, lost its connection, stopped by the user) is noted as it fails
+        if error is not None:
+            self.failed(error if str(error) else error_type.__name__)
+            self.done()
+        return False
+
+    def done(self):
+        """Add the request to the run's telemetry (only the first call counts)."""
+        if self.finished:
+            return
+        self.finished = True
+        add_record(self.record, self.path)
+        if self.record['status'] == 200 and self.record['ttfb_ms'] is not None:
+            # how long the provider takes to start answering sets its read timeouts in later runs, see timeouts.py
+            record_first_byte(self.record['provider'], url_report_id(self.record['url']), self.record['ttfb_ms'] / 1000)
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 1)
+
+
+def add_record(record, path=None):
+    with _lock:
+        _records.append(record)
+        if path:
+            try:
+                with open(path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(record) + '\n')
+            except OSError:
+                pass  # the summary is still made from the records in memory
+
+
+def summarise_telemetry():
+    """
+    Add up the run's requests per provider.
+
+    Returns:
+        dict of provider name -> dict of totals, in provider name order
+    """
+    with _lock:
+        records = list(_records)
+    by_provider = {}
+    for record in records:
+        by_provider.setdefault(record['provider'], []).append(record)
+    summary = {}
+    for provider_name, provider_records in sorted(by_provider.items()):
+        answered = [record for record in provider_records if record['ttfb_ms'] is not None]
+        ttfb = [record['ttfb_ms'] for record in answered]
+        transfer_ms = sum(record['transfer_ms'] or 0 for record in answered)
+        wire_bytes = sum(record['wire_bytes'] for record in answered)
+        ttfb_ms = sum(ttfb)
+        summary[provider_name] = {
+            'requests': len(provider_records),
+            'failed': sum(1 for record in provider_records if record['status'] != 200),
+            'ttfb_median_ms': round(statistics.median(ttfb), 1) if ttfb else None,
+            'ttfb_ms': round(ttfb_ms, 1),
+            'transfer_ms': round(transfer_ms, 1),
+            'wire_bytes': wire_bytes,
+            'decoded_bytes': sum(record['decoded_bytes'] for record in answered),
+            'decode_ms': round(sum(record['decode_ms'] for record in answered), 1),
+            'parse_ms': round(sum(record['parse_ms'] or 0 for record in answered), 1),
+            'mb_per_second': round(wire_bytes / (1024 * 1024) / (transfer_ms / 1000), 2) if transfer_ms else None,
+            'bound': 'latency' if ttfb_ms >= transfer_ms else 'bandwidth',
+        }
+    return summary
+
+
+def log_telemetry_summary():
+    """
+    Write each provider's request summary to the info log (called by run_harvester at the end of the run).
+
+    Returns:
+        the summary, see summarise_telemetry()
+    """
+    summary = summarise_telemetry()
+    for provider_name, totals in summary.items():
+        failed = f" ({totals['failed']} not 200)" if totals['failed'] else ''
+        median = f"{totals['ttfb_median_ms']:.0f} ms" if totals['ttfb_median_ms'] is not None else 'none'
+        speed = f" at {totals['mb_per_second']} MB/s" if totals['mb_per_second'] is not None else ''
+        log_error(f"INFO: {provider_name}: {totals['requests']} requests{failed}, time to first byte median {median} "
+                  f"(total {totals['ttfb_ms'] / 1000:.1f} s), reading {totals['transfer_ms'] / 1000:.1f} s{speed}, "
+                  f"decoding {totals['decode_ms'] / 1000:.1f} s, json parsing {totals['parse_ms'] / 1000:.1f} s: {totals['bound']}-bound")
+    return summary
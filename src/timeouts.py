@@ -0,0 +1,53 @@
+# timeouts.py : connect and read timeouts for each request (adaptive_timeouts), from how long the provider
+### took to start answering in earlier runs (see harvest_history.py), or from the report's expected size
+
+from urllib.parse import urlsplit
+from harvest_history import expected_first_byte, expected_bytes_per_month, url_months
+from run_options import provider_options
+
+DEFAULT_TIMEOUTS = (10, 30)  # (connect, read) seconds when nothing is known about the provider, as before
+MIN_CONNECT_TIMEOUT = 5
+MIN_READ_TIMEOUT = 10
+FIRST_BYTE_MARGIN = 3  # the read timeout is this many times the provider's usual wait for the first byte ...
+LONGEST_MARGIN = 1.5  # ... and at least this many times its longest recent wait
+EXTRA_SECONDS = 5  # plus this much, for the network
+SECONDS_PER_MB = 2  # extra read timeout for a report known to be big but not yet how slow it is to start
+
+
+def url_report_id(url):
+    """The report id of a COUNTER API url as the history knows it: eg 'TR', 'TR_EX', or 'reports' for the list of supported reports."""
+    parts = urlsplit(url)
+    report_id = parts.path.rstrip('/').rsplit('/', 1)[-1].upper()
+    if report_id == 'REPORTS':
+        return 'reports'
+    if 'attributes_to_show=' in parts.query.lower() and not report_id.endswith('_EX'):
+        report_id += '_EX'
+    return report_id
+
+
+def request_timeouts(provider_info, url):
+    """
+    The timeouts for one request to the provider.
+
+    Returns:
+        (connect seconds, read seconds), as requests takes them
+    """
+    options = provider_options(provider_info)
+    if not options.adaptive_timeouts:
+        return DEFAULT_TIMEOUTS
+    provider_name = provider_info.get('Name', '')
+    connect, read = DEFAULT_TIMEOUTS
+    listing = expected_first_byte(provider_name, 'reports')
+    if listing:
+        # the list of supported reports is tiny, so its wait is mostly the round trip to the provider
+        connect = min(connect, max(MIN_CONNECT_TIMEOUT, FIRST_BYTE_MARGIN * listing[1] + 1))
+    report_id = url_report_id(url)
+    first_byte = expected_first_byte(provider_name, report_id)
+    if first_byte:
+        usual, longest = first_byte
+        read = max(FIRST_BYTE_MARGIN * usual, LONGEST_MARGIN * longest) + EXTRA_SECONDS
+    else:
+        bytes_per_month = expected_bytes_per_month(provider_name, report_id)
+        if bytes_per_month:
+            read = DEFAULT_TIMEOUTS[1] + SECONDS_PER_MB * bytes_per_month * url_months(url) / (1024 * 1024)
+    return connect, round(min(max(read, MIN_READ_TIMEOUT), max(MIN_READ_TIMEOUT, options.max_read_timeout)), 1)
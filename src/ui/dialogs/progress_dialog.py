@@ -15,6 +15,7 @@ sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
 # Import the backend directly
 import getcounter
+from cancellation import CancelToken
 
 
 
@@ -45,6 +46,7 @@ class HarvesterThread(QThread):
         self.reports = reports
         self.config_dict = config_dict #storing dict
         self._is_cancelled = False # button remains false until user clicks it .turns into tue
+        self._cancel_token = CancelToken() # Stop cancels this, which cuts short the downloads and waits in progress
         self._has_started_processing = False # for if the user stops before any report ws retrieved, tracking the retrieving report message...
 
     def run(self):
@@ -65,8 +67,9 @@ class HarvesterThread(QThread):
                 selected_reports=self.reports,
                 config_dict=self.config_dict,
                 progress_callback=self._handle_progress, #Send log messages from backend to UI
-                is_cancelled_callback=lambda: self._is_cancelled #pass the cancel function through here ,lambda creates a function that returns the current  value
+                is_cancelled_callback=lambda: self._is_cancelled, #pass the cancel function through here ,lambda creates a function that returns the current  value
             # almost like we store the logic for getting the most recent result
+                cancel_token=self._cancel_token
             )
 
             # Emit results
@@ -85,8 +88,9 @@ class HarvesterThread(QThread):
     def cancel(self):
         """Cancel the running harvest."""
         self._is_cancelled = True
+        self._cancel_token.cancel()
         if self._has_started_processing:
-            self.log_signal.emit("Cancellation requested, finishing saving the last report started before the Stop request...")
+            self.log_signal.emit("Cancellation requested, stopping the downloads in progress...")
         else:
             self.log_signal.emit("Cancellation requested")
 
@@ -0,0 +1,7 @@
+# conftest.py : lets the tests import the harvester modules from src, the way run_harvester does
+### when it is started from the src folder
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
@@ -0,0 +1,35 @@
+# test_compression.py : response bodies decode the same whether they come in one piece or a few bytes at a time
+### as they do over a slow connection
+
+import zlib
+import pytest
+import compression
+
+BODY = b'{"Report_Header": {"Report_ID": "TR"}, "Report_Items": []}' * 200
+
+
+def deflate(data, wbits):
+    encoder = zlib.compressobj(wbits=wbits)
+    return encoder.compress(data) + encoder.flush()
+
+
+def decode_in_chunks(content, content_encoding, size):
+    decoder = compression.body_decoder(content_encoding)
+    decoded = b''.join(decoder.decompress(content[i:i + size]) for i in range(0, len(content), size))
+    return decoded + decoder.flush()
+
+
+@pytest.mark.parametrize('wbits', [zlib.MAX_WBITS, -zlib.MAX_WBITS], ids=['zlib-wrapped', 'raw'])
+@pytest.mark.parametrize('size', [1, 2, 3, len(BODY)])
+def test_deflate_in_small_chunks(wbits, size):
+    assert decode_in_chunks(deflate(BODY, wbits), 'deflate', size) == BODY
+
+
+@pytest.mark.parametrize('size', [1, 1024])
+def test_gzip_in_small_chunks(size):
+    assert decode_in_chunks(deflate(BODY, 16 + zlib.MAX_WBITS), 'gzip', size) == BODY
+
+
+def test_decode_body_whole():
+    assert compression.decode_body(deflate(BODY, -zlib.MAX_WBITS), 'deflate') == BODY
+    assert compression.decode_body(BODY, '') == BODY
@@ -0,0 +1,39 @@
+# test_convert_ir_reports.py : the IR converters build each item's rows from that item alone
+### an item with no Item_ID must not keep the identifiers of the item before it
+
+import pytest
+import logger
+import convert_ir_reports
+
+HEADER_DATES = ['2025-01']
+
+
+@pytest.fixture(autouse=True)
+def error_log(tmp_path):
+    logger.set_error_log_file(str(tmp_path / 'infolog.txt'))
+
+
+def report_item(name, item_id=None):
+    item = {
+        'Item': name,
+        'Platform': 'Platform A',
+        'Publisher': 'Publisher A',
+        'Attribute_Performance': [{'Performance': {'Total_Item_Requests': {'2025-01': 3}}}],
+    }
+    if item_id is not None:
+        item['Item_ID'] = item_id
+    return item
+
+
+@pytest.mark.parametrize('get_data', [convert_ir_reports.get_ir_data, convert_ir_reports.get_ir_m1_data])
+def test_item_without_item_id_does_not_inherit_previous_item_id(get_data):
+    report_items = [{'Items': [
+        report_item('First', {'DOI': '10.1000/first', 'Proprietary': 'pub:first'}),
+        report_item('Second'),
+    ]}]
+    rows = get_data(report_items, HEADER_DATES)
+    assert [row['Item'] for row in rows] == ['First', 'Second']
+    assert rows[0]['DOI'] == '10.1000/first'
+    assert rows[0]['Proprietary_ID'] == 'pub:first'
+    assert 'DOI' not in rows[1]
+    assert 'Proprietary_ID' not in rows[1]